@@ -1,21 +1,53 @@
 # app/routes/generate.py
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Request
 from fastapi.responses import StreamingResponse
 from typing import Union
+import json
 import logging
+import time as time_module
 from ..schemas.frontend import FrontendPayload
 from ..schemas.llm_request import LLMRequest
 from ..models.model_pool import ParallelModelPool
+from ..models.batch_runner import BatchRunner, read_requests
 
 logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
 # Assume model_pool is initialized elsewhere and imported
-from ..dependencies import model_pool
+from ..dependencies import model_pool, trace_recorder
+
+async def _prepend(first_chunk: str, stream):
+    yield first_chunk
+    async for chunk in stream:
+        yield chunk
+
+async def _traced(stream, trace_entry: dict, start: float, first_chunk_at: float):
+    # Records the request once its stream ends, however it ends
+    metrics = None
+    status = 499  # Client disconnected before the end of the stream
+    try:
+        async for chunk in stream:
+            if chunk.startswith('data: {"metrics"'):
+                metrics = json.loads(chunk[len("data: "):])["metrics"]
+            yield chunk
+        status = 200
+    except HTTPException as he:
+        status = he.status_code
+        raise
+    except Exception:
+        status = 500
+        raise
+    finally:
+        trace_recorder.record(
+            trace_entry, status, metrics,
+            ttft=first_chunk_at - start, latency=time_module.perf_counter() - start
+        )
 
 @router.post("/generate")
 async def generate(request: FrontendPayload):
+    start = time_module.perf_counter()
+    trace_entry = None
     try:
         # Parse `history_messages` if it's a string
         if isinstance(request.history_messages, str):
@@ -28,8 +60,23 @@ async def generate(request: FrontendPayload):
             query=request.query,
             history_messages=history_messages,
             temperature=request.temperature,
-            top_p=request.top_p
+            top_p=request.top_p,
+            session_id=request.session_id,
+            priority=request.priority
         )
+        if request.max_new_tokens is not None:
+            llm_request.max_new_tokens = request.max_new_tokens
+        if trace_recorder is not None:
+            trace_entry = trace_recorder.request_entry(
+                time_module.time(),
+                llm_request.query,
+                llm_request.history_messages,
+                max_new_tokens=llm_request.max_new_tokens,
+                temperature=llm_request.temperature,
+                top_p=llm_request.top_p,
+                priority=llm_request.priority,
+                session_id=llm_request.session_id
+            )
         context = {}
 
         # Pass the parsed request to the model
@@ -39,11 +86,58 @@ async def generate(request: FrontendPayload):
             history_messages=llm_request.history_messages,
             max_new_tokens=llm_request.max_new_tokens,
             temperature=llm_request.temperature,
-            top_p=llm_request.top_p
+            top_p=llm_request.top_p,
+            session_id=llm_request.session_id,
+            priority=llm_request.priority
         )
 
+        # Start the stream before answering so admission errors (429 with
+        # Retry-After) are returned as HTTP errors, not inside a 200 stream
+        try:
+            first_chunk = await response_stream.__anext__()
+        except StopAsyncIteration:
+            raise HTTPException(status_code=500, detail="Generation ended without producing output.")
+        except HTTPException:
+            raise
+        except Exception as e:
+            # A generation that fails before its first chunk is an error response, not an empty stream
+            await response_stream.aclose()
+            raise HTTPException(status_code=500, detail=f"Generation error: {e}")
+        stream = _prepend(first_chunk, response_stream)
+        if trace_entry is not None:
+            stream = _traced(stream, trace_entry, start, time_module.perf_counter())
+
         # Wrap response stream in StreamingResponse
-        return StreamingResponse(response_stream, media_type="text/event-stream")
+        return StreamingResponse(stream, media_type="text/event-stream")
+    except HTTPException as he:
+        if trace_entry is not None:
+            trace_recorder.record(trace_entry, he.status_code, latency=time_module.perf_counter() - start)
+        raise
     except Exception as e:
         logger.error(f"Generation error: {e}")
+        if trace_entry is not None:
+            trace_recorder.record(trace_entry, 500, latency=time_module.perf_counter() - start)
         raise HTTPException(status_code=500, detail=str(e))
+
+@router.post("/generate/batch")
+async def generate_batch(request: Request, batch_size: int = 8, max_batch_tokens: int = 32768):
+    """
+    Runs a JSONL body of requests (one `/generate`-style object per line) with
+    batched generation and streams one JSON result per line as batches finish.
+    Batches are admitted at low priority, behind interactive requests.
+    """
+    if model_pool.worker_processes:
+        raise HTTPException(status_code=501, detail="Batch generation is not available with worker processes.")
+    if not model_pool.model_instances:
+        raise HTTPException(status_code=503, detail="Model pool is still loading. Please try again later.")
+    body = (await request.body()).decode("utf-8")
+    requests = read_requests(body.splitlines())
+    if not requests:
+        raise HTTPException(status_code=422, detail="Request body contains no JSONL rows.")
+    runner = BatchRunner(model_pool, batch_size=batch_size, max_batch_tokens=max_batch_tokens)
+
+    async def results():
+        async for result in runner.run(requests):
+            yield json.dumps(result, ensure_ascii=False) + "\n"
+
+    return StreamingResponse(results(), media_type="application/x-ndjson")
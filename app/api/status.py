@@ -1,13 +1,47 @@
 # app/routes/status.py
 from fastapi import APIRouter
+from fastapi.responses import JSONResponse, PlainTextResponse
 from ..models.model_pool import ParallelModelPool
 
 router = APIRouter()
 
 # Assume model_pool is initialized elsewhere and imported
-from ..dependencies import model_pool
+from ..dependencies import model_pool, trace_recorder
 
 @router.get("/model-pool-status")
 async def get_model_pool_status():
-    status = [{'device': instance['device'], 'in_use': instance['in_use']} for instance in model_pool.model_instances]
-    return {"model_instances": status}
+    status = [
+        {
+            'device': instance['device'],
+            'in_use': instance['active_requests'] > 0,
+            'active_requests': instance['active_requests'],
+            'throughput': model_pool.throughput(instance)
+        }
+        for instance in model_pool.model_instances
+    ]
+    return {
+        "model_instances": status,
+        "stats": model_pool.stats,
+        "admission": model_pool.admission.metrics(),
+        "routing": model_pool.router.metrics(),
+        "response_cache": model_pool.response_cache.metrics() if model_pool.response_cache else None,
+        "coalescing": model_pool.single_flight.metrics() if model_pool.single_flight else None,
+        "history": model_pool.history_manager.metrics() if model_pool.history_manager else None,
+        "prompt_assembly": model_pool.prompt_assembler.metrics() if model_pool.prompt_assembler else None,
+        "speculative": model_pool.speculation.metrics() if model_pool.speculation else None,
+        "memory": model_pool.memory_manager.metrics(),
+        "trace": trace_recorder.metrics() if trace_recorder else None
+    }
+
+
+@router.get("/ready")
+async def get_readiness():
+    # 503 until the first instance is online so load balancers hold traffic back
+    readiness = model_pool.readiness()
+    return JSONResponse(readiness, status_code=200 if readiness["ready"] else 503)
+
+
+@router.get("/metrics")
+async def get_metrics():
+    # Prometheus text exposition format
+    return PlainTextResponse(model_pool.metrics_text(), media_type="text/plain; version=0.0.4")
@@ -3,10 +3,66 @@ import os
 import torch
 from dotenv import load_dotenv
 from .models.model_pool import ParallelModelPool
+from .utils.trace import TraceRecorder
 
 load_dotenv()  # Load environment variables from .env
 
 MODEL_PATH = os.getenv("MODEL_PATH", "meta-llama/Llama-3.2-1B-Instruct")
 NUM_INSTANCES = int(os.getenv("NUM_INSTANCES", torch.cuda.device_count() or 1))
+DEVICES = os.getenv("DEVICES")  # comma-separated, e.g. "cuda:0,cuda:1"; all CUDA devices (or CPU) if unset
+SCHEDULING = os.getenv("SCHEDULING", "exclusive")  # "exclusive" or "continuous"
+MAX_BATCH_SIZE = int(os.getenv("MAX_BATCH_SIZE", 8))
+SESSION_CACHE_MAX_BYTES = int(os.getenv("SESSION_CACHE_MAX_BYTES", 1 << 30))
+MEMORY_HIGH_WATER = float(os.getenv("MEMORY_HIGH_WATER", 0.9))
+MAX_QUEUE_DEPTH = int(os.getenv("MAX_QUEUE_DEPTH", 64))
+MAX_QUEUE_WAIT = float(os.getenv("MAX_QUEUE_WAIT", 30))
+RESPONSE_CACHE_MAX_BYTES = int(os.getenv("RESPONSE_CACHE_MAX_BYTES", 0))  # 0 disables the response cache
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", 300))
+RESPONSE_CACHE_MAX_TEMPERATURE = float(os.getenv("RESPONSE_CACHE_MAX_TEMPERATURE", 0))
+COALESCE_REQUESTS = os.getenv("COALESCE_REQUESTS", "true").lower() in ("1", "true", "yes")
+COALESCE_MAX_TEMPERATURE = float(os.getenv("COALESCE_MAX_TEMPERATURE", 0))
+CONTEXT_TOKEN_BUDGET = os.getenv("CONTEXT_TOKEN_BUDGET")  # tokens of retrieved context per prompt; unlimited if unset
+HISTORY_TOKEN_BUDGET = os.getenv("HISTORY_TOKEN_BUDGET")  # tokens of verbatim history per prompt; unlimited if unset
+SUMMARIZE_HISTORY = os.getenv("SUMMARIZE_HISTORY", "true").lower() in ("1", "true", "yes")
+DRAFT_MODEL_PATH = os.getenv("DRAFT_MODEL_PATH")  # small model for speculative decoding; disabled if unset
+NUM_DRAFT_TOKENS = int(os.getenv("NUM_DRAFT_TOKENS", 5))
+MIN_DRAFT_ACCEPTANCE = float(os.getenv("MIN_DRAFT_ACCEPTANCE", 0.3))
+CPU_QUANTIZATION = os.getenv("CPU_QUANTIZATION")  # "int8" for quantized CPU instances; full weights if unset
+QUANTIZED_CACHE_DIR = os.getenv("QUANTIZED_CACHE_DIR")  # keeps quantized models across restarts if set
+WORKER_PROCESSES = os.getenv("WORKER_PROCESSES", "false").lower() in ("1", "true", "yes")  # one process per instance
+WORKER_THREADS = os.getenv("WORKER_THREADS")  # torch threads per worker process; CPU cores split evenly if unset
+CPU_TOPOLOGY = os.getenv("CPU_TOPOLOGY")  # JSON or JSON file partitioning cores between CPU instances; "off" disables
+TRACE_PATH = os.getenv("TRACE_PATH")  # JSONL trace of /generate requests for replay; disabled if unset
+TRACE_TEXT = os.getenv("TRACE_TEXT", "false").lower() in ("1", "true", "yes")  # also record prompt text
 
-model_pool = ParallelModelPool(MODEL_PATH, num_instances=1, devices = ["cuda:0"])
+# Models are loaded by the application lifespan, not at import time
+model_pool = ParallelModelPool(
+    MODEL_PATH,
+    num_instances=NUM_INSTANCES,
+    devices=DEVICES.split(",") if DEVICES else None,
+    scheduling=SCHEDULING,
+    max_batch_size=MAX_BATCH_SIZE,
+    session_cache_bytes=SESSION_CACHE_MAX_BYTES,
+    memory_high_water=MEMORY_HIGH_WATER,
+    max_queue_depth=MAX_QUEUE_DEPTH,
+    max_queue_wait=MAX_QUEUE_WAIT,
+    response_cache_bytes=RESPONSE_CACHE_MAX_BYTES,
+    response_cache_ttl=RESPONSE_CACHE_TTL,
+    response_cache_max_temperature=RESPONSE_CACHE_MAX_TEMPERATURE,
+    coalesce_requests=COALESCE_REQUESTS,
+    coalesce_max_temperature=COALESCE_MAX_TEMPERATURE,
+    context_token_budget=int(CONTEXT_TOKEN_BUDGET) if CONTEXT_TOKEN_BUDGET else None,
+    history_token_budget=int(HISTORY_TOKEN_BUDGET) if HISTORY_TOKEN_BUDGET else None,
+    summarize_history=SUMMARIZE_HISTORY,
+    draft_model_path=DRAFT_MODEL_PATH,
+    num_draft_tokens=NUM_DRAFT_TOKENS,
+    min_draft_acceptance=MIN_DRAFT_ACCEPTANCE,
+    cpu_quantization=CPU_QUANTIZATION,
+    quantized_cache_dir=QUANTIZED_CACHE_DIR,
+    worker_processes=WORKER_PROCESSES,
+    worker_threads=int(WORKER_THREADS) if WORKER_THREADS else None,
+    cpu_topology=CPU_TOPOLOGY
+)
+
+# Optional request trace, replayed with benchmarks/replay.py
+trace_recorder = TraceRecorder(TRACE_PATH, include_text=TRACE_TEXT) if TRACE_PATH else None
@@ -1,29 +1,110 @@
 from collections.abc import Iterable
 
+# Lower values are kept first when the context has to be cut to its token budget
+DEFAULT_TYPE_PRIORITY = {
+    'Action': 0,
+    'RAG': 1,
+    'Reasoning': 2,
+}
+
 class ContextPreparer:
-    def __init__(self):
+    def __init__(self, tokenizer=None, max_tokens=None, type_priority=None):
+        """
+        Args:
+            tokenizer: Tokenizer used to count context tokens; without one, tokens
+                       are estimated as 4 characters each.
+            max_tokens (Optional[int]): Token budget of the assembled context; None for no limit.
+            type_priority (Optional[Dict[str, int]]): Priority per context type, lower is kept
+                                                      first. A subquery's own 'Priority' wins.
+        """
         self.handlers = {
-            'RAG': self.prepare_rag_context,
-            'Action': self.prepare_function_call_context,
-            'Reasoning': self.prepare_reasoning_context
+            'RAG': self.rag_entries,
+            'Action': self.function_call_entries,
+            'Reasoning': self.reasoning_entries
             # Add other types here if needed
         }
+        self.tokenizer = tokenizer
+        self.max_tokens = max_tokens
+        self.type_priority = type_priority or DEFAULT_TYPE_PRIORITY
+        self.last_report = None
 
     def prepare_context(self, context):
-        context_str = ""
+        context_str, _ = self.assemble(context)
+        return context_str
+
+    def assemble(self, context):
+        """
+        Builds the context string from every subquery's sources.
+
+        Identical sources listed under several subqueries are kept once. When
+        the context exceeds `max_tokens`, entries are kept by priority and,
+        within a priority, most recent subquery first; the kept entries stay
+        in their original order.
+
+        Returns:
+            Tuple[str, Dict]: The context string and a report of what was kept,
+            deduplicated and dropped.
+        """
+        entries = []
+        seen = set()
+        duplicates = 0
         if isinstance(context, dict):  # Check if context is a dictionary
-            for subquery, details in context.items():
+            for position, (subquery, details) in enumerate(context.items()):
                 if not isinstance(details, dict) or 'Type' not in details:
                     continue  # Skip if details are not a dictionary or 'Type' is missing
                 handler = self.handlers.get(details['Type'])
                 if handler:
-                    context_str += handler(details)
+                    items = handler(details)
                 else:
-                    context_str += f"\n- Unknown Type: {details.get('Type', 'None')}\n"
-        return context_str
+                    items = [(None, f"\n- Unknown Type: {details.get('Type', 'None')}\n")]
+
+                priority = details.get('Priority', self.type_priority.get(details['Type'], len(self.type_priority)))
+                for key, text in items:
+                    if key is not None:
+                        if key in seen:
+                            duplicates += 1
+                            continue
+                        seen.add(key)
+                    entries.append({'position': position, 'priority': priority, 'text': text})
+
+        for entry in entries:
+            entry['tokens'] = self.count_tokens(entry['text'])
+
+        kept = entries
+        if self.max_tokens is not None:
+            used = 0
+            kept = []
+            for entry in sorted(entries, key=lambda entry: (entry['priority'], -entry['position'])):
+                if used + entry['tokens'] <= self.max_tokens:
+                    kept.append(entry)
+                    used += entry['tokens']
+            kept_ids = {id(entry) for entry in kept}
+            kept = [entry for entry in entries if id(entry) in kept_ids]
+
+        context_str = "".join(entry['text'] for entry in kept)
+        total_tokens = sum(entry['tokens'] for entry in entries)
+        kept_tokens = sum(entry['tokens'] for entry in kept)
+        self.last_report = {
+            'entries': len(entries),
+            'kept': len(kept),
+            'duplicates': duplicates,
+            'dropped': len(entries) - len(kept),
+            'tokens': kept_tokens,
+            'dropped_tokens': total_tokens - kept_tokens,
+            'budget': self.max_tokens,
+        }
+        return context_str, self.last_report
+
+    def count_tokens(self, text):
+        if self.tokenizer is None:
+            return max(1, len(text) // 4)
+        return len(self.tokenizer.encode(text, add_special_tokens=False))
 
     def prepare_rag_context(self, details):
-        context_str = ""
+        return "".join(text for _, text in self.rag_entries(details))
+
+    def rag_entries(self, details):
+        entries = []
         sources = details.get('Source', [])
         if not isinstance(sources, list):  # Ensure 'Source' is a list
             sources = []
@@ -34,11 +115,17 @@ class ContextPreparer:
             url = source.get('url', '#')
             page = source.get('page', '#')
             # context_str += f"\n- Document: [{name}]({url})\n  Text: {text}\n"
-            context_str += f"\n- name: {name}\n  page: {page}\n  url: {url}\n  text: {text}\n"
-        return context_str
+            entries.append((
+                ('RAG', str(name), str(page), str(url), str(text)),
+                f"\n- name: {name}\n  page: {page}\n  url: {url}\n  text: {text}\n"
+            ))
+        return entries
 
     def prepare_function_call_context(self, details):
-        context_str = ""
+        return "".join(text for _, text in self.function_call_entries(details))
+
+    def function_call_entries(self, details):
+        entries = []
         sources = details.get('Source', [])
         if not isinstance(sources, list):  # Ensure 'Source' is treated as a list
             sources = []
@@ -55,14 +142,18 @@ class ContextPreparer:
                 arguments = function_call.get('arguments', {})
                 if not isinstance(arguments, dict):  # Ensure arguments are a dictionary
                     arguments = {}
-                context_str += f"\n- Function: [{function_name}]\n"
+                context_str = f"\n- Function: [{function_name}]\n"
                 context_str += f"  Arguments: {arguments}\n"
                 context_str += f"  Output: {output}\n"
+                entries.append((('Action', str(function_name), repr(sorted(arguments.items())), str(output)), context_str))
 
-        return context_str
+        return entries
 
     def prepare_reasoning_context(self, details):
-        context_str = ""
+        return "".join(text for _, text in self.reasoning_entries(details))
+
+    def reasoning_entries(self, details):
+        entries = []
         sources = details.get('Source', [])
         if not isinstance(sources, list):  # Ensure 'Source' is a list
             sources = []
@@ -71,5 +162,8 @@ class ContextPreparer:
             name = source.get('name', 'Unnamed Source')
             text = source.get('text', 'None')
             url = source.get('url', '#')
-            context_str += f"\n- Non-document: [{name}]({url})\n  Text: {text}\n"
-        return context_str
+            entries.append((
+                ('Reasoning', str(name), str(url), str(text)),
+                f"\n- Non-document: [{name}]({url})\n  Text: {text}\n"
+            ))
+        return entries
@@ -0,0 +1,244 @@
+# app/models/admission.py
+import asyncio
+import bisect
+import itertools
+import logging
+import math
+import time as time_module
+from collections import deque
+from typing import Any, Callable, Dict, List, Optional
+
+from fastapi import HTTPException
+
+logger = logging.getLogger(__name__)
+
+PRIORITIES = {"high": 0, "normal": 1, "low": 2}
+
+
+class _Waiter:
+    def __init__(self, rank: int, seq: int, future: asyncio.Future, request: Optional[Dict[str, Any]]):
+        self.rank = rank
+        self.seq = seq
+        self.future = future
+        self.request = request
+        self.enqueued_at = time_module.monotonic()
+        self.waiting = True  # False once granted, rejected or abandoned
+
+    def __lt__(self, other: "_Waiter") -> bool:
+        return (self.rank, self.seq) < (other.rank, other.seq)
+
+
+class AdmissionController:
+    """
+    Bounded, priority-ordered admission queue in front of the pool's free
+    instance slots.
+
+    Waiters are served highest priority first and FIFO within a priority.
+    When the queue is full a new request is rejected with 429, unless it
+    outranks the newest waiter of the lowest queued priority, which is then
+    rejected in its place. `Retry-After` is derived from the observed rate
+    at which slots are released.
+
+    Which free slot a request gets is decided by `select`; it may also decline
+    all free slots (e.g. to wait for a faster device), in which case later
+    waiters are still served and the request is re-evaluated shortly after.
+    """
+    def __init__(
+        self,
+        max_queue_depth: int = 64,
+        max_wait: float = 30.0,
+        rate_window: float = 60.0,
+        select: Optional[Callable[[deque, Optional[Dict[str, Any]], float], Optional[Any]]] = None,
+        reevaluate_interval: float = 0.05
+    ):
+        """
+        Args:
+            max_queue_depth (int): Maximum number of requests waiting for a slot.
+            max_wait (float): Maximum seconds a request may wait before it is rejected.
+            rate_window (float): Seconds of release history used to estimate the service rate.
+            select (Optional[Callable]): Picks a slot for a request from the free slots,
+                                         given the request info and how long it has waited;
+                                         returns None to keep waiting. Defaults to FIFO.
+            reevaluate_interval (float): Delay before re-offering slots a request declined.
+        """
+        self.max_queue_depth = max_queue_depth
+        self.max_wait = max_wait
+        self.rate_window = rate_window
+        self.select = select or (lambda free, request, waited: free[0])
+        self.reevaluate_interval = reevaluate_interval
+
+        self.free: deque = deque()
+        self._waiters: List[_Waiter] = []
+        self._counter = itertools.count()
+        self._reevaluate_handle: Optional[asyncio.TimerHandle] = None
+        self.waiting = 0
+        self._releases: deque = deque()
+        self.rejected = {priority: 0 for priority in PRIORITIES}
+        self.admitted = {priority: 0 for priority in PRIORITIES}
+
+    def add(self, item: Any):
+        """
+        Makes a new slot available.
+        """
+        self.free.append(item)
+        self._dispatch()
+
+    def release(self, item: Any):
+        """
+        Returns a slot after a request has finished with it.
+        """
+        now = time_module.monotonic()
+        self._releases.append(now)
+        while self._releases and now - self._releases[0] > self.rate_window:
+            self._releases.popleft()
+        self.free.append(item)
+        self._dispatch()
+
+    async def acquire(
+        self,
+        priority: str = "normal",
+        timeout: Optional[float] = None,
+        request: Optional[Dict[str, Any]] = None
+    ) -> Any:
+        """
+        Waits for a free slot in priority order.
+
+        Args:
+            priority (str): One of "high", "normal" or "low".
+            timeout (Optional[float]): Maximum wait; defaults to `max_wait`.
+            request (Optional[Dict[str, Any]]): Request info passed on to `select`.
+
+        Returns:
+            Any: The acquired slot.
+
+        Raises:
+            HTTPException: 429 with Retry-After when the queue is full or the wait times out.
+        """
+        if priority not in PRIORITIES:
+            raise HTTPException(422, f"Unknown priority: {priority}")
+        rank = PRIORITIES[priority]
+
+        if self.free and not self.waiting:
+            item = self.select(self.free, request, 0.0)
+            if item is not None:
+                self.admitted[priority] += 1
+                return self._take(item)
+
+        if self.waiting >= self.max_queue_depth and not self._evict_lower(rank):
+            self.rejected[priority] += 1
+            logger.warning(f"Admission queue full ({self.waiting} waiting), rejecting {priority} request")
+            raise self._rejection("Server is saturated. Please retry later.")
+
+        waiter = _Waiter(rank, next(self._counter), asyncio.get_running_loop().create_future(), request)
+        bisect.insort(self._waiters, waiter)
+        self.waiting += 1
+        self._dispatch()
+
+        try:
+            item = await asyncio.wait_for(asyncio.shield(waiter.future), timeout or self.max_wait)
+            self.admitted[priority] += 1
+            return item
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if waiter.waiting:
+                self._remove(waiter)
+            future = waiter.future
+            if future.done() and not future.cancelled() and future.exception() is None:
+                # Granted just as the wait ended; hand the slot to the next waiter
+                self.free.appendleft(future.result())
+                self._dispatch()
+            else:
+                future.cancel()
+            if isinstance(e, asyncio.TimeoutError):
+                self.rejected[priority] += 1
+                logger.warning(f"No model instance became free in time for a {priority} request")
+                raise self._rejection("No model instances available. Please try again later.")
+            raise
+
+    def _take(self, item: Any) -> Any:
+        self.free.remove(item)
+        return item
+
+    def _remove(self, waiter: _Waiter):
+        waiter.waiting = False
+        self.waiting -= 1
+        self._waiters.remove(waiter)
+
+    def _dispatch(self):
+        """
+        Offers free slots to waiters in priority order.
+        """
+        declined = False
+        now = time_module.monotonic()
+        for waiter in list(self._waiters):
+            if not self.free:
+                break
+            item = self.select(self.free, waiter.request, now - waiter.enqueued_at)
+            if item is None:
+                declined = True
+                continue
+            self._remove(waiter)
+            waiter.future.set_result(self._take(item))
+
+        if declined and self.free and self._reevaluate_handle is None:
+            self._reevaluate_handle = asyncio.get_running_loop().call_later(
+                self.reevaluate_interval, self._reevaluate
+            )
+
+    def _reevaluate(self):
+        self._reevaluate_handle = None
+        self._dispatch()
+
+    def _evict_lower(self, rank: int) -> bool:
+        """
+        Rejects the newest waiter of the lowest queued priority if it ranks
+        below `rank`, making room for the new request.
+        """
+        victims = [waiter for waiter in self._waiters if waiter.rank > rank]
+        if not victims:
+            return False
+        victim = max(victims)
+        self._remove(victim)
+        victim.future.set_exception(self._rejection("Preempted by a higher-priority request."))
+        self.rejected[_priority_name(victim.rank)] += 1
+        return True
+
+    def service_rate(self) -> float:
+        """
+        Returns released slots per second over the recent window.
+        """
+        now = time_module.monotonic()
+        while self._releases and now - self._releases[0] > self.rate_window:
+            self._releases.popleft()
+        if len(self._releases) < 2:
+            return 0.0
+        span = max(now - self._releases[0], 1e-6)
+        return len(self._releases) / span
+
+    def retry_after(self) -> int:
+        """
+        Estimates the seconds until a request arriving now would get a slot.
+        """
+        rate = self.service_rate()
+        if rate <= 0:
+            return max(1, math.ceil(self.max_wait))
+        return min(max(1, math.ceil((self.waiting + 1) / rate)), 3600)
+
+    def _rejection(self, detail: str) -> HTTPException:
+        return HTTPException(429, detail, headers={"Retry-After": str(self.retry_after())})
+
+    def metrics(self) -> Dict[str, Any]:
+        """
+        Returns queue depth, service rate and admission counters.
+        """
+        return {
+            "free_slots": len(self.free),
+            "queue_depth": self.waiting,
+            "max_queue_depth": self.max_queue_depth,
+            "service_rate": self.service_rate(),
+            "admitted": dict(self.admitted),
+            "rejected": dict(self.rejected),
+        }
+
+
+def _priority_name(rank: int) -> str:
+    return next(name for name, value in PRIORITIES.items() if value == rank)
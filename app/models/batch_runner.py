@@ -0,0 +1,411 @@
+# app/models/batch_runner.py
+import argparse
+import asyncio
+import json
+import logging
+import os
+import threading
+import time as time_module
+from typing import Any, AsyncIterator, Dict, Iterable, List, Optional, Set
+
+import torch
+from fastapi import HTTPException
+from transformers import StoppingCriteriaList
+
+from app.models.cancellation import CancellationStoppingCriteria, CancellationToken
+from app.models.cpu_topology import apply_to_thread
+
+logger = logging.getLogger(__name__)
+
+
+def _row_id(row: Any, line_number: int) -> str:
+    if isinstance(row, dict):
+        return str(row.get('id', row.get('request_id', line_number)))
+    return str(line_number)
+
+
+def parse_request(row: Dict[str, Any], line_number: int) -> Dict[str, Any]:
+    """
+    Normalizes one JSONL row into a batch request.
+
+    Rows carry the `/generate` fields (query, history_messages, max_new_tokens,
+    temperature, top_p), with the same defaults, plus an optional context and
+    id; a temperature of 0 gives greedy output. `prompt`, or the `body`
+    of backlog-style rows, is accepted in place of `query`. Rows without an id
+    are identified by their line number.
+
+    Raises:
+        ValueError: The row has no query, or max_new_tokens is below 1.
+    """
+    query = row.get('query') or row.get('prompt') or row.get('body')
+    if not isinstance(query, str) or not query:
+        raise ValueError("row has no query")
+    max_new_tokens = int(row.get('max_new_tokens', 1024))
+    if max_new_tokens < 1:
+        raise ValueError("max_new_tokens must be at least 1")
+    history_messages = row.get('history_messages')
+    if isinstance(history_messages, str):
+        history_messages = [{"role": "user", "content": history_messages}]
+    return {
+        'id': _row_id(row, line_number),
+        'query': query,
+        'context': row.get('context') or {},
+        'history_messages': history_messages,
+        'max_new_tokens': max_new_tokens,
+        'temperature': float(row.get('temperature', 0.7)),
+        'top_p': float(row.get('top_p', 0.9)),
+    }
+
+
+def read_requests(lines: Iterable[str]) -> List[Dict[str, Any]]:
+    """
+    Parses JSONL text into batch requests. Malformed rows become requests
+    carrying an 'error', so they are reported instead of stopping the run,
+    under their own id when the row is a JSON object.
+    """
+    requests = []
+    for line_number, line in enumerate(lines, start=1):
+        if not line.strip():
+            continue
+        row = None
+        try:
+            row = json.loads(line)
+            requests.append(parse_request(row, line_number))
+        except (ValueError, TypeError, AttributeError) as e:
+            requests.append({
+                'id': _row_id(row, line_number),
+                'error': f"Invalid request on line {line_number}: {e}"
+            })
+    return requests
+
+
+class BatchRunner:
+    """
+    Runs offline workloads through the pool with padded, batched `generate`
+    calls instead of one streamed request per prompt.
+
+    Prompts are tokenized and sorted by length, so each batch pads little, and
+    grouped by sampling parameters, which a batch shares. One worker per
+    instance takes the next batch, acquires an instance through the admission
+    queue at `priority` (so interactive traffic keeps precedence) and runs
+    the batch there; results are yielded as batches finish.
+    """
+    def __init__(
+        self,
+        model_pool,
+        batch_size: int = 8,
+        max_batch_tokens: int = 32768,
+        priority: str = "low"
+    ):
+        """
+        Args:
+            model_pool (ParallelModelPool): Loaded pool whose instances run the batches.
+            batch_size (int): Maximum prompts per batch.
+            max_batch_tokens (int): Maximum padded prompt plus output tokens per batch.
+            priority (str): Admission priority of the batches.
+        """
+        if model_pool.worker_processes:
+            raise ValueError("Batch runs need in-process model instances, not worker processes")
+        self.model_pool = model_pool
+        self.batch_size = batch_size
+        self.max_batch_tokens = max_batch_tokens
+        self.priority = priority
+        self.stats = {'batches': 0, 'completed': 0, 'failed': 0, 'prompt_tokens': 0, 'padding_tokens': 0,
+                      'generated_tokens': 0}
+
+    def _tokenize(self, request: Dict[str, Any]):
+        """
+        Builds a request's prompt ids, or gives it an 'error' if the prompt cannot be built.
+        """
+        try:
+            messages, _ = self.model_pool.prepare_messages(
+                request['query'], request['context'], request['history_messages']
+            )
+            request['input_ids'] = self.model_pool.prompt_assembler.encode(messages)['input_ids'][0]
+        except Exception as e:
+            request['error'] = f"Invalid request {request['id']}: {type(e).__name__}: {e}"
+
+    def plan(self, requests: List[Dict[str, Any]]) -> List[List[Dict[str, Any]]]:
+        """
+        Tokenizes the requests that are not yet tokenized and groups them into
+        batches of similar length and identical sampling parameters. Requests
+        whose prompt cannot be built are given an 'error' and left out of the
+        batches.
+        """
+        for request in requests:
+            if 'input_ids' not in request and 'error' not in request:
+                self._tokenize(request)
+        requests = [request for request in requests if 'error' not in request]
+
+        ordered = sorted(requests, key=lambda request: (
+            request['max_new_tokens'], request['temperature'], request['top_p'], len(request['input_ids'])
+        ))
+        batches = []
+        for request in ordered:
+            batch = batches[-1] if batches else None
+            if batch is not None and self._fits(batch, request):
+                batch.append(request)
+            else:
+                batches.append([request])
+        return batches
+
+    def _fits(self, batch: List[Dict[str, Any]], request: Dict[str, Any]) -> bool:
+        first = batch[0]
+        if len(batch) >= self.batch_size or any(
+            request[key] != first[key] for key in ('max_new_tokens', 'temperature', 'top_p')
+        ):
+            return False
+        # Sorted by length, so the new request is the longest of the batch
+        padded_tokens = (len(batch) + 1) * (len(request['input_ids']) + request['max_new_tokens'])
+        return padded_tokens <= self.max_batch_tokens
+
+    async def run(self, requests: List[Dict[str, Any]]) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Runs the requests and yields one result per request, in completion order.
+        """
+        valid = [request for request in requests if 'error' not in request]
+        for request in valid:
+            self._tokenize(request)
+            # Tokenizing thousands of prompts in one go would stall every stream. Prompt
+            # assembly shares the pool's caches with online requests, so it stays on the
+            # event loop and yields between rows
+            await asyncio.sleep(0)
+        planned = self.plan(valid)
+        for request in requests:
+            if 'error' in request:
+                self.stats['failed'] += 1
+                # Invalid requests fail the same way on every run, so they are not retried
+                yield {'id': request['id'], 'error': request['error'], 'invalid': True}
+        if not planned:
+            return
+
+        batches = asyncio.Queue()
+        for batch in planned:
+            batches.put_nowait(batch)
+        results = asyncio.Queue()
+        num_workers = min(max(len(self.model_pool.model_instances), 1), batches.qsize())
+
+        async def worker():
+            try:
+                while not batches.empty():
+                    batch = batches.get_nowait()
+                    for result in await self._run_batch(batch):
+                        results.put_nowait(result)
+            finally:
+                results.put_nowait(None)
+
+        workers = [asyncio.create_task(worker()) for _ in range(num_workers)]
+        try:
+            finished = 0
+            while finished < num_workers:
+                result = await results.get()
+                if result is None:
+                    finished += 1
+                else:
+                    yield result
+        finally:
+            for task in workers:
+                task.cancel()
+
+    async def _run_batch(self, batch: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        Runs one batch on the next free instance, waiting behind online traffic.
+        """
+        request_info = {
+            'prompt_tokens': sum(len(request['input_ids']) for request in batch),
+            'max_new_tokens': batch[0]['max_new_tokens'],
+        }
+        while True:
+            try:
+                model_instance = await self.model_pool.get_free_model(priority=self.priority, request=request_info)
+                break
+            except HTTPException as e:
+                if e.status_code != 429:
+                    return self._failed(batch, e.detail)
+                retry_after = float((e.headers or {}).get("Retry-After", 1))
+                logger.debug(f"No instance for a batch, retrying in {retry_after:.0f}s")
+                await asyncio.sleep(retry_after)
+
+        start = time_module.perf_counter()
+        cancel_token = CancellationToken()
+        generation_done = threading.Event()
+
+        def run_generation():
+            try:
+                return self._generate_batch(model_instance, batch, cancel_token)
+            finally:
+                generation_done.set()
+
+        try:
+            results = await asyncio.to_thread(run_generation)
+        except Exception as e:
+            logger.error(f"Batch of {len(batch)} failed on {model_instance['device']}: {e}")
+            return self._failed(batch, f"Generation error: {e}")
+        finally:
+            # A cancelled run stops the batch before the instance is reused
+            await self.model_pool._stop_generation(generation_done, cancel_token, batch[0]['max_new_tokens'], None)
+            await self.model_pool.release_model(model_instance)
+
+        elapsed = time_module.perf_counter() - start
+        logger.info(f"Batch of {len(batch)} finished on {model_instance['device']} in {elapsed:.2f}s")
+        self.stats['batches'] += 1
+        self.stats['completed'] += len(batch)
+        return results
+
+    def _failed(self, batch: List[Dict[str, Any]], error: str) -> List[Dict[str, Any]]:
+        self.stats['failed'] += len(batch)
+        return [{'id': request['id'], 'error': error} for request in batch]
+
+    def _generate_batch(
+        self,
+        model_instance: Dict[str, Any],
+        batch: List[Dict[str, Any]],
+        cancel_token: CancellationToken
+    ) -> List[Dict[str, Any]]:
+        """
+        Left-pads the batch's prompts and generates for all of them in one call.
+        """
+        apply_to_thread(model_instance['cpu'])
+        tokenizer = self.model_pool.tokenizer
+        model = model_instance['model']
+        pad_token_id = tokenizer.pad_token_id if tokenizer.pad_token_id is not None else tokenizer.eos_token_id
+        length = max(len(request['input_ids']) for request in batch)
+
+        input_ids = torch.full((len(batch), length), pad_token_id, dtype=torch.long)
+        attention_mask = torch.zeros((len(batch), length), dtype=torch.long)
+        for row, request in enumerate(batch):
+            prompt_ids = request['input_ids']
+            input_ids[row, length - len(prompt_ids):] = prompt_ids
+            attention_mask[row, length - len(prompt_ids):] = 1
+
+        first = batch[0]
+        generation_kwargs = {
+            'input_ids': input_ids.to(model.device),
+            'attention_mask': attention_mask.to(model.device),
+            'max_new_tokens': first['max_new_tokens'],
+            'do_sample': first['temperature'] > 0,
+            'pad_token_id': pad_token_id,
+            'stopping_criteria': StoppingCriteriaList([CancellationStoppingCriteria(cancel_token)]),
+        }
+        if first['temperature'] > 0:
+            generation_kwargs.update(temperature=first['temperature'], top_p=first['top_p'])
+        with torch.inference_mode():
+            output = model.generate(**generation_kwargs)
+
+        eos_token_ids = set(self.model_pool._eos_token_ids(model))
+        results = []
+        for row, request in enumerate(batch):
+            generated = output[row, length:].tolist()
+            end = next((index for index, token in enumerate(generated) if token in eos_token_ids), None)
+            if end is not None:
+                generated = generated[:end]
+            self.stats['prompt_tokens'] += len(request['input_ids'])
+            self.stats['padding_tokens'] += length - len(request['input_ids'])
+            self.stats['generated_tokens'] += len(generated)
+            results.append({
+                'id': request['id'],
+                'response': tokenizer.decode(generated, skip_special_tokens=True),
+                'prompt_tokens': len(request['input_ids']),
+                'generated_tokens': len(generated),
+                'finish_reason': "stop" if end is not None else "length",
+                'device': model_instance['device'],
+            })
+        return results
+
+
+def completed_ids(output_path: str) -> Set[str]:
+    """
+    Reads the ids already answered in an output file, so a run can resume.
+
+    A line cut off by an interrupted run is removed from the file. Results
+    with an error are retried, unless the request itself was invalid.
+    """
+    if not os.path.exists(output_path):
+        return set()
+    with open(output_path, "rb+") as output_file:
+        data = output_file.read()
+        complete = data.rfind(b"\n") + 1
+        if complete < len(data):
+            logger.warning(f"Removing an incomplete last line from {output_path}")
+            output_file.truncate(complete)
+
+    done = set()
+    for line in data[:complete].decode("utf-8").splitlines():
+        try:
+            result = json.loads(line)
+        except ValueError:
+            continue
+        if 'error' not in result or result.get('invalid'):
+            done.add(str(result['id']))
+    return done
+
+
+async def run_file(model_pool, input_path: str, output_path: str, **runner_kwargs) -> Dict[str, Any]:
+    """
+    Runs a JSONL file of requests and appends one JSON result per line to
+    `output_path`, skipping requests the file already answers.
+
+    Args:
+        model_pool (ParallelModelPool): Loaded pool.
+        input_path (str): JSONL requests.
+        output_path (str): JSONL results; doubles as the checkpoint.
+        runner_kwargs: Passed on to `BatchRunner`.
+
+    Returns:
+        Dict[str, Any]: Counts of skipped, written and failed requests and the throughput.
+    """
+    with open(input_path, encoding="utf-8") as input_file:
+        requests = read_requests(input_file)
+    done = completed_ids(output_path)
+    pending = [request for request in requests if request['id'] not in done]
+    logger.info(f"{len(requests)} requests, {len(requests) - len(pending)} already answered in {output_path}")
+
+    runner = BatchRunner(model_pool, **runner_kwargs)
+    start = time_module.perf_counter()
+    written = 0
+    with open(output_path, "a", encoding="utf-8") as output_file:
+        async for result in runner.run(pending):
+            output_file.write(json.dumps(result, ensure_ascii=False) + "\n")
+            # Every finished result is a checkpoint
+            output_file.flush()
+            written += 1
+    elapsed = time_module.perf_counter() - start
+    return {
+        "requests": len(requests),
+        "skipped": len(requests) - len(pending),
+        "written": written,
+        "seconds": elapsed,
+        "generated_tokens_per_second": runner.stats['generated_tokens'] / elapsed if elapsed > 0 else 0,
+        **runner.stats,
+    }
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(
+        description="Run a JSONL file of prompts through the model pool with batched generation. "
+                    "The pool is configured from the same environment variables as the server."
+    )
+    parser.add_argument("input", help="JSONL requests")
+    parser.add_argument("output", help="JSONL results; an existing file is resumed")
+    parser.add_argument("--batch-size", type=int, default=8)
+    parser.add_argument("--max-batch-tokens", type=int, default=32768)
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+
+    from app.dependencies import model_pool
+
+    async def run():
+        await model_pool.load()
+        try:
+            return await run_file(
+                model_pool, args.input, args.output,
+                batch_size=args.batch_size, max_batch_tokens=args.max_batch_tokens
+            )
+        finally:
+            model_pool.shutdown()
+
+    print(json.dumps(asyncio.run(run()), indent=2))
+
+
+if __name__ == "__main__":
+    main()
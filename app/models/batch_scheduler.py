@@ -0,0 +1,367 @@
+# app/models/batch_scheduler.py
+import logging
+import queue
+import threading
+from typing import Callable, List, Optional
+
+import torch
+from transformers import DynamicCache
+from transformers.generation.logits_process import (
+    LogitsProcessorList,
+    TemperatureLogitsWarper,
+    TopPLogitsWarper,
+)
+
+logger = logging.getLogger(__name__)
+
+
+class BatchSequence:
+    """
+    State of a single request inside a continuous batch.
+    """
+    def __init__(
+        self,
+        input_ids: torch.Tensor,
+        streamer,
+        max_new_tokens: int,
+        temperature: float,
+        top_p: float,
+        past_key_values: Optional[DynamicCache] = None,
+        keep_cache: bool = False,
+        cancel_token=None
+    ):
+        self.input_ids = input_ids
+        self.cancel_token = cancel_token
+        self.past_key_values = past_key_values
+        self.keep_cache = keep_cache
+        self.generated_ids: List[int] = []
+        self.streamer = streamer
+        self.max_new_tokens = max_new_tokens
+        self.temperature = temperature
+        self.top_p = top_p
+        self.num_generated = 0
+        self.position = input_ids.shape[-1]
+        self.next_token: Optional[int] = None
+        self.error: Optional[Exception] = None
+        self.done = threading.Event()
+
+        warpers = []
+        if temperature > 0:
+            warpers.append(TemperatureLogitsWarper(temperature))
+            if top_p < 1.0:
+                warpers.append(TopPLogitsWarper(top_p))
+        self.logits_warper = LogitsProcessorList(warpers)
+
+    @property
+    def cancelled(self) -> bool:
+        return self.cancel_token is not None and self.cancel_token.cancelled
+
+    def sample(self, logits: torch.Tensor) -> int:
+        """
+        Picks the next token from the last-position logits of this sequence.
+
+        Args:
+            logits (torch.Tensor): Logits of shape (1, vocab_size).
+
+        Returns:
+            int: The sampled token id.
+        """
+        if self.temperature <= 0:
+            return int(torch.argmax(logits, dim=-1).item())
+        scores = self.logits_warper(None, logits.float())
+        probs = torch.softmax(scores, dim=-1)
+        return int(torch.multinomial(probs, num_samples=1).item())
+
+
+class ContinuousBatchScheduler:
+    """
+    Runs a step loop over a single model instance, admitting new sequences and
+    retiring finished ones on every decode step.
+
+    New sequences are prefilled individually and then merged into a left-padded
+    batched KV cache. The batch keeps one `DynamicCache` across decode steps
+    and only pads or drops its rows when the batch membership changes. Each
+    step still appends its keys and values the way `DynamicCache` does, by
+    concatenation, so the cost of a step grows with the cached length.
+    """
+    def __init__(
+        self,
+        model,
+        eos_token_ids: List[int],
+        max_batch_size: int = 8,
+        idle_timeout: float = 0.5,
+        thread_init: Optional[Callable[[], None]] = None
+    ):
+        """
+        Initializes the scheduler and starts its step loop.
+
+        Args:
+            model: The causal LM to run.
+            eos_token_ids (List[int]): Token ids that terminate a sequence.
+            max_batch_size (int): Maximum number of sequences decoded together.
+            idle_timeout (float): How long the loop blocks waiting for work when idle.
+            thread_init (Optional[Callable[[], None]]): Called first on the step loop thread,
+                                                        e.g. to set its CPU affinity and threads.
+        """
+        self.model = model
+        self.device = model.device
+        self.eos_token_ids = set(eos_token_ids)
+        self.max_batch_size = max_batch_size
+        self.idle_timeout = idle_timeout
+        self.thread_init = thread_init
+
+        self.pending: "queue.Queue[BatchSequence]" = queue.Queue()
+        self.active: List[BatchSequence] = []
+        self.past_key_values: Optional[DynamicCache] = None  # batched cache of the active sequences
+        self.attention_mask: Optional[torch.Tensor] = None
+
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def submit(
+        self,
+        input_ids: torch.Tensor,
+        streamer,
+        max_new_tokens: int = 1024,
+        temperature: float = 0.7,
+        top_p: float = 0.9,
+        past_key_values: Optional[DynamicCache] = None,
+        keep_cache: bool = False,
+        cancel_token=None
+    ) -> BatchSequence:
+        """
+        Queues a prompt for admission at the next decode step.
+
+        Args:
+            input_ids (torch.Tensor): Prompt token ids of shape (1, seq_len).
+            streamer: Streamer that receives generated token ids.
+            max_new_tokens (int): Maximum number of tokens to generate.
+            temperature (float): Sampling temperature, 0 for greedy decoding.
+            top_p (float): Top-p sampling threshold.
+            past_key_values (Optional[DynamicCache]): Cache covering a prefix of the prompt;
+                                                      only the rest of the prompt is prefilled.
+            keep_cache (bool): Hand the sequence's final cache back on `past_key_values`
+                               (legacy format) once it finishes.
+            cancel_token (Optional[CancellationToken]): Removes the sequence from the batch
+                                                        at the next step once cancelled.
+
+        Returns:
+            BatchSequence: Handle whose `done` event is set when the sequence finishes.
+        """
+        sequence = BatchSequence(
+            input_ids, streamer, max_new_tokens, temperature, top_p,
+            past_key_values=past_key_values, keep_cache=keep_cache, cancel_token=cancel_token
+        )
+        self.pending.put(sequence)
+        return sequence
+
+    def shutdown(self):
+        """
+        Stops the step loop and finishes all outstanding sequences.
+        """
+        self._stop.set()
+        self._thread.join()
+        for sequence in self.active + self._drain_pending():
+            self._finish(sequence)
+        self.active = []
+
+    def _drain_pending(self) -> List[BatchSequence]:
+        drained = []
+        while True:
+            try:
+                drained.append(self.pending.get_nowait())
+            except queue.Empty:
+                return drained
+
+    def _run(self):
+        if self.thread_init is not None:
+            self.thread_init()
+        with torch.no_grad():
+            while not self._stop.is_set():
+                try:
+                    self._admit()
+                    if not self.active:
+                        continue
+                    self._step()
+                except Exception as e:
+                    logger.error(f"Continuous batching step failed on {self.device}: {e}")
+                    for sequence in self.active:
+                        sequence.error = e
+                        self._finish(sequence)
+                    self.active = []
+                    self.past_key_values = None
+                    self.attention_mask = None
+
+    def _admit(self):
+        """
+        Prefills pending sequences while there is room in the batch.
+        Blocks for up to `idle_timeout` when there is nothing to do.
+        """
+        while len(self.active) < self.max_batch_size:
+            try:
+                block = not self.active
+                sequence = self.pending.get(block=block, timeout=self.idle_timeout if block else None)
+            except queue.Empty:
+                return
+
+            if sequence.cancelled:
+                self._finish(sequence)
+                continue
+
+            try:
+                self._prefill(sequence)
+            except Exception as e:
+                logger.error(f"Prefill failed on {self.device}: {e}")
+                sequence.error = e
+                self._finish(sequence)
+
+    def _prefill(self, sequence: BatchSequence):
+        input_ids = sequence.input_ids.to(self.device)
+        attention_mask = torch.ones_like(input_ids)
+        past_key_values = sequence.past_key_values
+        sequence.past_key_values = None
+        if past_key_values is not None:
+            input_ids = input_ids[:, past_key_values.get_seq_length():]
+        outputs = self.model(
+            input_ids=input_ids,
+            attention_mask=attention_mask,
+            past_key_values=past_key_values,
+            use_cache=True
+        )
+        cache = outputs.past_key_values
+        if isinstance(cache, DynamicCache):
+            cache = cache.to_legacy_cache()
+
+        sequence.next_token = sequence.sample(outputs.logits[:, -1, :])
+        self._emit(sequence)
+        if self._is_finished(sequence):
+            if sequence.keep_cache:
+                sequence.past_key_values = cache
+            self._finish(sequence)
+            return
+
+        self._merge(sequence, cache, attention_mask.shape[-1])
+
+    def _merge(self, sequence: BatchSequence, cache, length: int):
+        """
+        Adds a freshly prefilled sequence to the batched cache, left-padding
+        whichever side is shorter.
+        """
+        if not self.active:
+            self.past_key_values = DynamicCache.from_legacy_cache(cache)
+            self.attention_mask = torch.ones((1, length), dtype=torch.long, device=self.device)
+            self.active.append(sequence)
+            return
+
+        batch_length = self.attention_mask.shape[-1]
+        target = max(batch_length, length)
+        batch_cache = _left_pad_cache(self.past_key_values.to_legacy_cache(), target - batch_length)
+        new_cache = _left_pad_cache(cache, target - length)
+        self.past_key_values = DynamicCache.from_legacy_cache(tuple(
+            (torch.cat([bk, nk], dim=0), torch.cat([bv, nv], dim=0))
+            for (bk, bv), (nk, nv) in zip(batch_cache, new_cache)
+        ))
+
+        batch_mask = torch.nn.functional.pad(self.attention_mask, (target - batch_length, 0))
+        new_mask = torch.zeros((1, target), dtype=torch.long, device=self.device)
+        new_mask[:, target - length:] = 1
+        self.attention_mask = torch.cat([batch_mask, new_mask], dim=0)
+        self.active.append(sequence)
+
+    def _step(self):
+        """
+        Runs one decode step for every active sequence.
+        """
+        input_ids = torch.tensor(
+            [[sequence.next_token] for sequence in self.active], device=self.device
+        )
+        position_ids = torch.tensor(
+            [[sequence.position] for sequence in self.active], device=self.device
+        )
+        attention_mask = torch.nn.functional.pad(self.attention_mask, (0, 1), value=1)
+
+        outputs = self.model(
+            input_ids=input_ids,
+            attention_mask=attention_mask,
+            position_ids=position_ids,
+            past_key_values=self.past_key_values,
+            use_cache=True
+        )
+        # The model appends this step's keys and values to the cache in place
+        self.past_key_values = outputs.past_key_values
+        self.attention_mask = attention_mask
+
+        logits = outputs.logits[:, -1, :]
+        keep = []
+        for index, sequence in enumerate(self.active):
+            sequence.position += 1
+            sequence.next_token = sequence.sample(logits[index:index + 1])
+            self._emit(sequence)
+            if self._is_finished(sequence):
+                if sequence.keep_cache:
+                    sequence.past_key_values = self._extract_cache(index)
+                self._finish(sequence)
+            else:
+                keep.append(index)
+
+        if len(keep) < len(self.active):
+            self._retire(keep)
+
+    def _retire(self, keep: List[int]):
+        """
+        Drops finished rows from the batch and trims columns that became pure padding.
+        """
+        self.active = [self.active[index] for index in keep]
+        if not self.active:
+            self.past_key_values = None
+            self.attention_mask = None
+            return
+
+        rows = torch.tensor(keep, device=self.device)
+        attention_mask = self.attention_mask.index_select(0, rows)
+        lengths = attention_mask.sum(dim=-1)
+        trim = attention_mask.shape[-1] - int(lengths.max().item())
+        self.attention_mask = attention_mask[:, trim:]
+        self.past_key_values = DynamicCache.from_legacy_cache(tuple(
+            (key.index_select(0, rows)[:, :, trim:], value.index_select(0, rows)[:, :, trim:])
+            for key, value in self.past_key_values.to_legacy_cache()
+        ))
+
+    def _extract_cache(self, index: int):
+        """
+        Copies one row out of the batched cache, without its left padding.
+        """
+        length = int(self.attention_mask[index].sum().item())
+        return tuple(
+            (key[index:index + 1, :, -length:].clone(), value[index:index + 1, :, -length:].clone())
+            for key, value in self.past_key_values.to_legacy_cache()
+        )
+
+    def _emit(self, sequence: BatchSequence):
+        sequence.num_generated += 1
+        sequence.generated_ids.append(sequence.next_token)
+        sequence.streamer.put(torch.tensor([sequence.next_token]))
+
+    def _is_finished(self, sequence: BatchSequence) -> bool:
+        return (
+            sequence.cancelled
+            or sequence.next_token in self.eos_token_ids
+            or sequence.num_generated >= sequence.max_new_tokens
+        )
+
+    def _finish(self, sequence: BatchSequence):
+        sequence.streamer.end()
+        sequence.done.set()
+
+
+def _left_pad_cache(cache, amount: int):
+    if amount <= 0:
+        return cache
+    return tuple(
+        (
+            torch.nn.functional.pad(key, (0, 0, amount, 0)),
+            torch.nn.functional.pad(value, (0, 0, amount, 0))
+        )
+        for key, value in cache
+    )
@@ -0,0 +1,34 @@
+# app/models/cancellation.py
+import threading
+
+import torch
+from transformers import StoppingCriteria
+
+
+class CancellationToken:
+    """
+    Per-request flag that the serving side sets when the client goes away
+    and the generation side polls once per decode step.
+    """
+    def __init__(self):
+        self._event = threading.Event()
+
+    def cancel(self):
+        self._event.set()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+
+class CancellationStoppingCriteria(StoppingCriteria):
+    """
+    Stops `model.generate` at the next decode step once its token is cancelled.
+    """
+    def __init__(self, token: CancellationToken):
+        self.token = token
+
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor, **kwargs) -> torch.BoolTensor:
+        return torch.full(
+            (input_ids.shape[0],), self.token.cancelled, dtype=torch.bool, device=input_ids.device
+        )
@@ -0,0 +1,254 @@
+# app/models/cpu_topology.py
+import glob
+import json
+import logging
+import os
+from typing import Any, Dict, List, Optional, Union
+
+import torch
+
+logger = logging.getLogger(__name__)
+
+NUMA_POLICIES = ("spread", "pack", "ignore")
+
+
+def parse_cpu_list(cpu_list: Union[str, List[int]]) -> List[int]:
+    """
+    Parses a Linux CPU list such as "0-3,8,10-11"; lists of ints pass through.
+    """
+    if isinstance(cpu_list, list):
+        return sorted(set(int(cpu) for cpu in cpu_list))
+    cpus = set()
+    for part in cpu_list.strip().split(","):
+        if not part:
+            continue
+        if "-" in part:
+            first, last = part.split("-")
+            cpus.update(range(int(first), int(last) + 1))
+        else:
+            cpus.add(int(part))
+    return sorted(cpus)
+
+
+def _read(path: str) -> Optional[str]:
+    try:
+        with open(path) as sysfs_file:
+            return sysfs_file.read().strip()
+    except OSError:
+        return None
+
+
+def available_cpus() -> List[int]:
+    """
+    CPUs this process may run on.
+    """
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def numa_nodes(cpus: List[int]) -> Dict[int, List[int]]:
+    """
+    Groups CPUs by NUMA node, from sysfs; a single node 0 where that is not available.
+    """
+    allowed = set(cpus)
+    nodes = {}
+    for path in sorted(glob.glob("/sys/devices/system/node/node[0-9]*/cpulist")):
+        cpu_list = _read(path)
+        node_cpus = [cpu for cpu in parse_cpu_list(cpu_list) if cpu in allowed] if cpu_list else []
+        if node_cpus:
+            nodes[int(os.path.basename(os.path.dirname(path))[len("node"):])] = node_cpus
+    covered = {cpu for node_cpus in nodes.values() for cpu in node_cpus}
+    if not nodes or covered != allowed:
+        return {0: sorted(allowed)}
+    return nodes
+
+
+def physical_cores(cpus: List[int]) -> List[List[int]]:
+    """
+    Groups CPUs into physical cores: each group holds a core's hyperthread
+    siblings, first the lowest-numbered one.
+    """
+    allowed = set(cpus)
+    cores = {}
+    for cpu in cpus:
+        siblings = _read(f"/sys/devices/system/cpu/cpu{cpu}/topology/thread_siblings_list")
+        group = tuple(sibling for sibling in parse_cpu_list(siblings) if sibling in allowed) if siblings else (cpu,)
+        cores.setdefault(group or (cpu,), None)
+    return [list(group) for group in sorted(cores, key=lambda group: group[0])]
+
+
+def _split(units: List[Any], count: int) -> List[List[Any]]:
+    """
+    Splits units into `count` contiguous chunks whose sizes differ by at most
+    one. With fewer units than chunks, chunks share units round-robin.
+    """
+    if count <= len(units):
+        size, extra = divmod(len(units), count)
+        chunks, start = [], 0
+        for index in range(count):
+            end = start + size + (index < extra)
+            chunks.append(units[start:end])
+            start = end
+        return chunks
+    return [[units[index % len(units)]] for index in range(count)]
+
+
+class CpuTopology:
+    """
+    Partitions the CPU cores between CPU instances, so that each one runs its
+    torch threads on its own cores instead of every instance spreading a
+    full-size thread pool over all of them.
+
+    Each instance gets contiguous physical cores, all within one NUMA node
+    where the instances allow it, and as many intra-op threads as it has
+    cores. Hyperthread siblings are left idle unless `use_smt` is set, since
+    decoding is bound by memory bandwidth and siblings share a core's caches
+    and ports. Memory follows through the kernel's first-touch placement
+    once an instance's threads are pinned.
+
+    A config can override the automatic partitioning per instance:
+
+        {"numa": "spread", "interop_threads": 1,
+         "instances": [{"cores": "0-7"}, {"cores": "8-15", "threads": 6}]}
+    """
+    def __init__(
+        self,
+        cores: Optional[Union[str, List[int]]] = None,
+        numa: str = "spread",
+        use_smt: bool = False,
+        threads_per_instance: Optional[int] = None,
+        interop_threads: int = 1,
+        instances: Optional[List[Dict[str, Any]]] = None
+    ):
+        """
+        Args:
+            cores (Optional[Union[str, List[int]]]): CPUs to partition, e.g. "0-31";
+                                                     all CPUs available to the process if None.
+            numa (str): "spread" distributes instances over NUMA nodes and keeps each within a
+                        node, "pack" fills the nodes in order, "ignore" disregards nodes.
+            use_smt (bool): Also run threads on hyperthread siblings.
+            threads_per_instance (Optional[int]): Intra-op threads per instance; one per
+                                                  assigned core if None.
+            interop_threads (int): Inter-op threads per instance.
+            instances (Optional[List[Dict[str, Any]]]): Explicit per-instance "cores", "threads"
+                                                        and "interop_threads", used in order
+                                                        and repeated if there are more instances.
+        """
+        if numa not in NUMA_POLICIES:
+            raise ValueError(f"Unknown NUMA policy: {numa}")
+        self.cores = parse_cpu_list(cores) if cores is not None else None
+        self.numa = numa
+        self.use_smt = use_smt
+        self.threads_per_instance = threads_per_instance
+        self.interop_threads = interop_threads
+        self.instances = instances or []
+
+    @classmethod
+    def from_config(cls, config: Union[None, str, Dict[str, Any]]) -> Optional["CpuTopology"]:
+        """
+        Builds a topology from a dict, a JSON string or the path of a JSON file.
+        None gives the automatic partitioning and "off" disables it.
+        """
+        if config is None:
+            return cls()
+        if isinstance(config, str):
+            if config.strip().lower() == "off":
+                return None
+            if os.path.isfile(config):
+                with open(config, encoding="utf-8") as config_file:
+                    config = json.load(config_file)
+            else:
+                config = json.loads(config)
+        return cls(**config)
+
+    def _units(self, cpus: List[int]) -> List[List[int]]:
+        """
+        Scheduling units of a set of CPUs: physical cores, or single CPUs with SMT.
+        """
+        if self.use_smt:
+            return [[cpu] for cpu in cpus]
+        return [core[:1] for core in physical_cores(cpus)]
+
+    def plan(self, count: int) -> List[Dict[str, Any]]:
+        """
+        Assigns cores and thread counts to `count` CPU instances.
+
+        Returns:
+            List[Dict[str, Any]]: Per instance: "cores", "threads", "interop_threads" and "numa_node".
+        """
+        if count <= 0:
+            return []
+        cpus = self.cores or available_cpus()
+        nodes = numa_nodes(cpus)
+
+        if self.instances:
+            chunks = [parse_cpu_list(self.instances[index % len(self.instances)]["cores"])
+                      for index in range(count)]
+        elif self.numa == "spread" and len(nodes) > 1:
+            # Round-robin over the nodes, then split each node's cores among its instances
+            node_ids = sorted(nodes)
+            per_node = {node: [] for node in node_ids}
+            for index in range(count):
+                per_node[node_ids[index % len(node_ids)]].append(index)
+            chunks = [None] * count
+            for node, indices in per_node.items():
+                if indices:
+                    for index, units in zip(indices, _split(self._units(nodes[node]), len(indices))):
+                        chunks[index] = [cpu for unit in units for cpu in unit]
+        else:
+            ordered = [cpu for node in sorted(nodes) for cpu in nodes[node]] if self.numa == "pack" else cpus
+            chunks = [[cpu for unit in units for cpu in unit] for units in _split(self._units(ordered), count)]
+
+        node_of = {cpu: node for node, node_cpus in nodes.items() for cpu in node_cpus}
+        plan = []
+        for index, chunk in enumerate(chunks):
+            override = self.instances[index % len(self.instances)] if self.instances else {}
+            plan.append({
+                'cores': chunk,
+                'threads': override.get('threads', self.threads_per_instance or len(chunk)),
+                'interop_threads': override.get('interop_threads', self.interop_threads),
+                'numa_node': node_of.get(chunk[0]) if chunk else None,
+            })
+        return plan
+
+
+def _set_affinity(cores: Optional[List[int]]):
+    if cores and hasattr(os, "sched_setaffinity"):
+        try:
+            # Applies to the calling thread; threads it starts afterwards inherit it
+            os.sched_setaffinity(0, cores)
+        except OSError as e:
+            logger.warning(f"Could not pin to cores {cores}: {e}")
+
+
+def apply_to_process(assignment: Dict[str, Any]):
+    """
+    Applies an assignment to a whole process, such as a worker, before it
+    starts any torch work: affinity, intra-op and inter-op threads.
+    """
+    _set_affinity(assignment.get('cores'))
+    if assignment.get('threads'):
+        torch.set_num_threads(assignment['threads'])
+    if assignment.get('interop_threads'):
+        try:
+            torch.set_num_interop_threads(assignment['interop_threads'])
+        except RuntimeError as e:
+            # Only possible before the inter-op pool has been used
+            logger.warning(f"Could not set inter-op threads: {e}")
+
+
+def apply_to_thread(assignment: Optional[Dict[str, Any]]):
+    """
+    Applies an assignment to the calling generation thread: its affinity,
+    inherited by the OpenMP threads it starts, and its intra-op thread count.
+    Inter-op threads are shared by the process and are set by the pool.
+    """
+    if not assignment:
+        return
+    # The first torch call of a thread resets its thread count to the
+    # process default, so settle that before overriding it
+    torch.get_num_threads()
+    if assignment.get('threads'):
+        torch.set_num_threads(assignment['threads'])
+    _set_affinity(assignment.get('cores'))
@@ -0,0 +1,163 @@
+# app/models/history.py
+import hashlib
+import logging
+import re
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Tokens the chat template adds around every turn (role header and end-of-turn markers)
+TURN_OVERHEAD_TOKENS = 4
+
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s")
+
+
+def _digest(*parts: str) -> str:
+    sha = hashlib.sha256()
+    for part in parts:
+        sha.update(part.encode("utf-8"))
+        sha.update(b"\0")
+    return sha.hexdigest()
+
+
+class HistoryManager:
+    """
+    Keeps conversation history as chat turns within a per-request token budget.
+
+    Turn token counts are cached by content, so a turn is tokenized once no
+    matter how many later requests carry it. The most recent turns that fit
+    the budget are kept verbatim; older ones are optionally collapsed into a
+    short extractive summary, which is cached so that consecutive requests of
+    a conversation share the same summary (and prompt prefix) until more turns
+    fall out of the budget.
+    """
+    def __init__(
+        self,
+        tokenizer,
+        max_tokens: Optional[int] = None,
+        summarize: bool = True,
+        summary_max_tokens: int = 256,
+        cache_size: int = 4096
+    ):
+        """
+        Args:
+            tokenizer: Tokenizer of the served model.
+            max_tokens (Optional[int]): Token budget for the history turns; None keeps every turn.
+            summarize (bool): Collapse turns beyond the budget into a summary instead of dropping them.
+            summary_max_tokens (int): Token budget of the summary.
+            cache_size (int): Number of turn token counts and summaries kept.
+        """
+        self.tokenizer = tokenizer
+        self.max_tokens = max_tokens
+        self.summarize = summarize
+        self.summary_max_tokens = summary_max_tokens
+        self.cache_size = cache_size
+        self._token_counts: "OrderedDict[str, int]" = OrderedDict()
+        self._summaries: "OrderedDict[str, str]" = OrderedDict()
+        self.stats = {'turns_dropped': 0, 'turns_summarized': 0, 'summary_hits': 0}
+
+    def _remember(self, cache: OrderedDict, key: str, value):
+        cache[key] = value
+        if len(cache) > self.cache_size:
+            cache.popitem(last=False)
+
+    def count_tokens(self, message: Dict[str, Any]) -> int:
+        """
+        Returns the tokens a turn takes in the prompt, tokenizing it only once.
+        """
+        role = str(message.get('role', ''))
+        content = str(message.get('content', ''))
+        key = _digest(role, content)
+        count = self._token_counts.get(key)
+        if count is None:
+            count = len(self.tokenizer.encode(content, add_special_tokens=False)) + TURN_OVERHEAD_TOKENS
+            self._remember(self._token_counts, key, count)
+        else:
+            self._token_counts.move_to_end(key)
+        return count
+
+    def compact(
+        self,
+        history_messages: Optional[List[Dict[str, Any]]]
+    ) -> Tuple[List[Dict[str, Any]], Optional[str], Dict[str, Any]]:
+        """
+        Fits a conversation's history into the token budget.
+
+        Args:
+            history_messages (Optional[List[Dict[str, Any]]]): Turns in chronological order.
+
+        Returns:
+            Tuple[List[Dict[str, Any]], Optional[str], Dict[str, Any]]: The turns kept
+            verbatim, a summary of the older turns (or None), and a report.
+        """
+        turns = [message for message in (history_messages or []) if isinstance(message, dict)]
+        if self.max_tokens is None:
+            return turns, None, {'turns': len(turns), 'kept': len(turns), 'summarized': 0, 'dropped': 0}
+
+        used = 0
+        start = len(turns)
+        while start > 0:
+            tokens = self.count_tokens(turns[start - 1])
+            if used + tokens > self.max_tokens:
+                break
+            used += tokens
+            start -= 1
+
+        older, kept = turns[:start], turns[start:]
+        summary = self._summary(older) if older and self.summarize else None
+        report = {
+            'turns': len(turns),
+            'kept': len(kept),
+            'summarized': len(older) if summary else 0,
+            'dropped': 0 if summary else len(older),
+            'tokens': used,
+        }
+        self.stats['turns_summarized'] += report['summarized']
+        self.stats['turns_dropped'] += report['dropped']
+        return kept, summary, report
+
+    def _summary(self, turns: List[Dict[str, Any]]) -> Optional[str]:
+        """
+        Builds (or reuses) an extractive summary: the first sentence of each
+        turn, newest first until the summary budget is spent.
+        """
+        key = _digest(*(f"{turn.get('role', '')}:{turn.get('content', '')}" for turn in turns))
+        summary = self._summaries.get(key)
+        if summary is not None:
+            self._summaries.move_to_end(key)
+            self.stats['summary_hits'] += 1
+            return summary
+
+        header = "Summary of the earlier conversation:"
+        budget = self.summary_max_tokens - len(self.tokenizer.encode(header, add_special_tokens=False))
+        lines = []
+        for turn in reversed(turns):
+            content = " ".join(str(turn.get('content', '')).split())
+            if not content:
+                continue
+            line = f"- {turn.get('role', 'user')}: {_SENTENCE_END.split(content, maxsplit=1)[0]}"
+            tokens = self.tokenizer.encode(line, add_special_tokens=False)
+            if len(tokens) > budget:
+                if not lines and budget > 0:
+                    # Always keep at least the newest summarized turn, truncated
+                    lines.append(self.tokenizer.decode(tokens[:budget]))
+                break
+            lines.append(line)
+            budget -= len(tokens) + 1
+
+        summary = "\n".join([header, *reversed(lines)]) if lines else None
+        if summary is not None:
+            self._remember(self._summaries, key, summary)
+        return summary
+
+    def metrics(self) -> Dict[str, Any]:
+        """
+        Returns compaction counters and cache occupancy.
+        """
+        return {
+            "max_tokens": self.max_tokens,
+            "cached_turn_counts": len(self._token_counts),
+            "cached_summaries": len(self._summaries),
+            **self.stats,
+        }
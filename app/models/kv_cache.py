@@ -0,0 +1,192 @@
+# app/models/kv_cache.py
+import logging
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+import torch
+from transformers import DynamicCache
+
+logger = logging.getLogger(__name__)
+
+
+class PrefixCache:
+    """
+    Past-key-values of a static prompt prefix, computed once per model instance.
+
+    DynamicCache never writes into its tensors in place (new keys and values
+    are concatenated into fresh tensors), so every request can start from a
+    new DynamicCache wrapping the same stored tensors without cloning them.
+    """
+    def __init__(self, token_ids: torch.Tensor, past_key_values: Tuple):
+        self.token_ids = token_ids
+        self.past_key_values = past_key_values
+
+    @classmethod
+    def compute(cls, model, token_ids: torch.Tensor) -> "PrefixCache":
+        """
+        Runs a single forward pass over the prefix to fill its cache.
+
+        Args:
+            model: The causal LM the cache belongs to.
+            token_ids (torch.Tensor): Prefix token ids of shape (1, prefix_len).
+
+        Returns:
+            PrefixCache: The computed prefix cache.
+        """
+        token_ids = token_ids.to(model.device)
+        with torch.no_grad():
+            outputs = model(input_ids=token_ids, use_cache=True)
+        past_key_values = outputs.past_key_values
+        if isinstance(past_key_values, DynamicCache):
+            past_key_values = past_key_values.to_legacy_cache()
+        return cls(token_ids, past_key_values)
+
+    def __len__(self) -> int:
+        return self.token_ids.shape[-1]
+
+    def matches(self, input_ids: torch.Tensor) -> bool:
+        """
+        Checks whether a prompt starts with this prefix and extends past it.
+
+        Args:
+            input_ids (torch.Tensor): Prompt token ids of shape (1, seq_len).
+        """
+        length = len(self)
+        if input_ids.shape[-1] <= length:
+            return False
+        return torch.equal(input_ids[:, :length].to(self.token_ids.device), self.token_ids)
+
+    def new_cache(self) -> DynamicCache:
+        """
+        Returns a fresh DynamicCache that starts from this prefix.
+        """
+        return DynamicCache.from_legacy_cache(self.past_key_values)
+
+
+def find_prefix_cache(
+    prefix_caches: List[PrefixCache],
+    input_ids: torch.Tensor
+) -> Optional[PrefixCache]:
+    """
+    Returns the longest prefix cache the prompt starts with, if any.
+
+    Args:
+        prefix_caches (List[PrefixCache]): Candidate caches for one instance.
+        input_ids (torch.Tensor): Prompt token ids of shape (1, seq_len).
+    """
+    best = None
+    for prefix_cache in prefix_caches:
+        if prefix_cache.matches(input_ids) and (best is None or len(prefix_cache) > len(best)):
+            best = prefix_cache
+    return best
+
+
+def cache_nbytes(past_key_values: Tuple) -> int:
+    """
+    Returns the memory held by a legacy (per-layer key, value) cache.
+    """
+    return sum(key.nbytes + value.nbytes for key, value in past_key_values)
+
+
+def common_prefix_length(a: torch.Tensor, b: torch.Tensor) -> int:
+    """
+    Returns the number of leading tokens two (1, seq_len) id tensors share.
+    """
+    length = min(a.shape[-1], b.shape[-1])
+    if length == 0:
+        return 0
+    mismatch = (a[0, :length].cpu() != b[0, :length].cpu()).nonzero()
+    return int(mismatch[0].item()) if len(mismatch) else length
+
+
+class SessionCache:
+    """
+    LRU store of per-session KV caches, bounded by the memory they hold.
+
+    Each entry keeps the token ids its cache covers (the prompt plus all but
+    the last generated token), so a follow-up turn can reuse the longest
+    common prefix and only prefill what changed.
+    """
+    def __init__(self, max_bytes: int):
+        """
+        Args:
+            max_bytes (int): Memory cap across all cached sessions.
+        """
+        self.max_bytes = max_bytes
+        self.entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self.total_bytes = 0
+
+    def get(self, session_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Returns the cached entry for a session and marks it as recently used.
+        """
+        entry = self.entries.get(session_id)
+        if entry is not None:
+            self.entries.move_to_end(session_id)
+        return entry
+
+    def put(self, session_id: str, token_ids: torch.Tensor, past_key_values: Tuple):
+        """
+        Stores the cache of a finished turn, evicting the least recently used
+        sessions until the store fits under its memory cap.
+
+        Args:
+            session_id (str): The conversation the cache belongs to.
+            token_ids (torch.Tensor): Token ids covered by the cache, shape (1, seq_len).
+            past_key_values (Tuple): Legacy per-layer (key, value) cache.
+        """
+        self.pop(session_id)
+        nbytes = cache_nbytes(past_key_values)
+        if nbytes > self.max_bytes:
+            logger.debug(f"Session {session_id} cache ({nbytes} bytes) exceeds the cap, not stored")
+            return
+
+        self.entries[session_id] = {
+            'token_ids': token_ids,
+            'past_key_values': past_key_values,
+            'nbytes': nbytes
+        }
+        self.total_bytes += nbytes
+        while self.total_bytes > self.max_bytes:
+            evicted_id, _ = next(iter(self.entries.items()))
+            self.pop(evicted_id)
+            logger.debug(f"Evicted session {evicted_id} from the session cache")
+
+    def pop(self, session_id: str):
+        """
+        Removes a session from the store, if present.
+        """
+        entry = self.entries.pop(session_id, None)
+        if entry is not None:
+            self.total_bytes -= entry['nbytes']
+
+    def resume(self, session_id: str, input_ids: torch.Tensor, device) -> Tuple[Optional[DynamicCache], int]:
+        """
+        Builds a cache for a new turn from the session's previous turn.
+
+        Args:
+            session_id (str): The conversation to resume.
+            input_ids (torch.Tensor): Token ids of the new prompt, shape (1, seq_len).
+            device: Device of the instance that serves the new turn.
+
+        Returns:
+            Tuple[Optional[DynamicCache], int]: The cache cropped to the common
+            prefix and the number of prompt tokens it covers, or (None, 0).
+        """
+        entry = self.get(session_id)
+        if entry is None:
+            return None, 0
+
+        # Leave at least one prompt token to prefill so the model produces logits
+        reusable = min(
+            common_prefix_length(entry['token_ids'], input_ids),
+            input_ids.shape[-1] - 1
+        )
+        if reusable <= 0:
+            return None, 0
+
+        cache = DynamicCache.from_legacy_cache(tuple(
+            (key.to(device), value.to(device)) for key, value in entry['past_key_values']
+        ))
+        cache.crop(reusable)
+        return cache, reusable
@@ -0,0 +1,126 @@
+# app/models/memory_manager.py
+import asyncio
+import gc
+import logging
+import time as time_module
+from typing import Any, Dict, List, Optional
+
+import torch
+
+try:
+    import psutil
+except ImportError:  # psutil is optional; CPU memory is then reported as unknown
+    psutil = None
+
+logger = logging.getLogger(__name__)
+
+
+class MemoryManager:
+    """
+    Tracks allocated and reserved memory per device in the background and
+    only trims allocator caches once usage crosses a high-water mark, so
+    requests keep reusing the allocator's cached blocks.
+    """
+    def __init__(self, devices: List[str], high_water: float = 0.9, interval: float = 5.0):
+        """
+        Args:
+            devices (List[str]): Devices to watch, e.g. ["cuda:0", "cpu"].
+            high_water (float): Fraction of device memory above which caches are trimmed.
+            interval (float): Seconds between two checks.
+        """
+        self.devices = list(dict.fromkeys(devices))
+        self.high_water = high_water
+        self.interval = interval
+        self.stats: Dict[str, Dict[str, Any]] = {
+            device: {
+                'allocated': 0,
+                'reserved': 0,
+                'total': 0,
+                'trims': 0,
+                'last_trim_at': None,
+                'last_decision': None,
+            }
+            for device in self.devices
+        }
+        self._task: Optional[asyncio.Task] = None
+
+    def sample(self, device: str) -> Dict[str, int]:
+        """
+        Reads the current memory usage of a device, in bytes.
+        """
+        if device.startswith("cuda") and torch.cuda.is_available():
+            index = torch.device(device).index or 0
+            return {
+                'allocated': torch.cuda.memory_allocated(index),
+                'reserved': torch.cuda.memory_reserved(index),
+                'total': torch.cuda.get_device_properties(index).total_memory,
+            }
+        if psutil is not None:
+            rss = psutil.Process().memory_info().rss
+            return {'allocated': rss, 'reserved': rss, 'total': psutil.virtual_memory().total}
+        return {'allocated': 0, 'reserved': 0, 'total': 0}
+
+    def _trim(self, device: str):
+        gc.collect()
+        if device.startswith("cuda") and torch.cuda.is_available():
+            with torch.cuda.device(torch.device(device)):
+                torch.cuda.empty_cache()
+
+    async def check(self):
+        """
+        Samples every device and trims the ones above the high-water mark.
+        Trimming runs in a worker thread so it never blocks the event loop.
+        """
+        for device in self.devices:
+            usage = self.sample(device)
+            stats = self.stats[device]
+            stats.update(usage)
+
+            if not usage['total'] or usage['reserved'] / usage['total'] < self.high_water:
+                stats['last_decision'] = "keep"
+                continue
+
+            await asyncio.to_thread(self._trim, device)
+            stats['trims'] += 1
+            stats['last_trim_at'] = time_module.time()
+            stats['last_decision'] = "trim"
+            stats.update(self.sample(device))
+            logger.info(
+                f"Trimmed memory on {device}: reserved {usage['reserved']} -> {stats['reserved']} bytes"
+            )
+
+    async def _run(self):
+        while True:
+            try:
+                await self.check()
+            except Exception as e:
+                logger.error(f"Memory check failed: {e}")
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        """
+        Starts the background check loop on the running event loop.
+        """
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """
+        Stops the background check loop.
+        """
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def metrics(self) -> Dict[str, Dict[str, Any]]:
+        """
+        Returns the latest usage and trim decisions per device.
+        """
+        return {
+            device: {**stats, 'high_water': self.high_water}
+            for device, stats in self.stats.items()
+        }
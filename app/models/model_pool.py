@@ -2,30 +2,213 @@
 import asyncio
 import torch
 import logging
-from typing import List, Optional, Dict, Any
+from collections import OrderedDict
+from typing import List, Optional, Dict, Any, Tuple, Union
 from fastapi import HTTPException
-from transformers import AutoModelForCausalLM, AutoTokenizer, TextIteratorStreamer
+from transformers import AutoModelForCausalLM, AutoTokenizer, DynamicCache, StoppingCriteriaList
 import threading
 import time as time_module
 import json
-import gc
+import re
+import itertools
 
+from app.models.batch_scheduler import ContinuousBatchScheduler
+from app.models.cancellation import CancellationStoppingCriteria, CancellationToken
+from app.models.admission import AdmissionController
+from app.models.cpu_topology import CpuTopology, apply_to_thread
+from app.models.memory_manager import MemoryManager
+from app.models.prompt_assembler import PromptAssembler
+from app.models.quantization import CPU_QUANTIZATION_MODES, load_int8_model
+from app.models.history import HistoryManager
+from app.models.kv_cache import PrefixCache, SessionCache, find_prefix_cache
+from app.models.response_cache import ResponseCache, request_key
+from app.models.single_flight import SingleFlight
+from app.models.speculative import DraftAcceptance
+from app.models.streamers import AsyncTextStreamer
+from app.models.worker import WorkerProcess
 from app.handlers.contextHandlers import ContextPreparer
+from app.utils.metrics import ServingMetrics, render_counter, render_gauge
 from app.utils.system_prompt import *
 
 logger = logging.getLogger(__name__)
 
+# Sessions whose worker process is remembered for routing their next turn
+MAX_SESSION_WORKERS = 65536
+
+
+class InstanceRouter:
+    """
+    Routes requests to the instance with the earliest estimated completion.
+
+    Completion is estimated from measured per-device prefill and decode
+    throughput (exponentially smoothed, seeded with coarse priors) and from
+    the load already on each instance, so long prompts gravitate towards the
+    devices that prefill fastest. A request may also pass on every free
+    instance when a busy, faster one is expected to finish it sooner.
+    """
+    # Prior (prefill, decode) tokens/s until a device has been measured
+    DEFAULT_RATES = {"cuda": (2000.0, 30.0), "cpu": (100.0, 5.0)}
+
+    def __init__(
+        self,
+        instances: List[Dict[str, Any]],
+        slots_per_instance: int = 1,
+        smoothing: float = 0.2,
+        max_defer: float = 10.0
+    ):
+        """
+        Args:
+            instances (List[Dict[str, Any]]): The pool's model instances.
+            slots_per_instance (int): Concurrent requests one instance serves.
+            smoothing (float): Weight of the newest measurement in the moving averages.
+            max_defer (float): Longest a request passes on free instances to wait for a faster one.
+        """
+        self.instances = instances
+        self.slots_per_instance = slots_per_instance
+        self.max_defer = max_defer
+        self.smoothing = smoothing
+        self.devices: Dict[str, Dict[str, Any]] = {}
+        self.mean_new_tokens: Optional[float] = None
+        self.deferred = 0  # times a request waited for a faster device
+
+    def _device_stats(self, device: str) -> Dict[str, Any]:
+        if device not in self.devices:
+            prefill, decode = self.DEFAULT_RATES["cuda" if device.startswith("cuda") else "cpu"]
+            self.devices[device] = {'prefill_tps': prefill, 'decode_tps': decode, 'samples': 0, 'routed': 0}
+        return self.devices[device]
+
+    def service_time(self, device: str, request: Optional[Dict[str, Any]]) -> float:
+        """
+        Estimates the seconds a device needs to serve a request on its own.
+        """
+        if not request:
+            return 0.0
+        stats = self._device_stats(device)
+        new_tokens = request.get('max_new_tokens', 0)
+        if self.mean_new_tokens is not None:
+            new_tokens = min(new_tokens, self.mean_new_tokens)
+        return request.get('prompt_tokens', 0) / stats['prefill_tps'] + new_tokens / stats['decode_tps']
+
+    def _eta(self, model_instance: Dict[str, Any], request: Optional[Dict[str, Any]]) -> float:
+        # Batch slots share the instance's decode steps
+        load = model_instance['active_requests'] / self.slots_per_instance
+        return self.service_time(model_instance['device'], request) * (1 + load)
+
+    def select(self, free, request: Optional[Dict[str, Any]], waited: float) -> Optional[Dict[str, Any]]:
+        """
+        Picks a free instance for a request, or None to keep waiting.
+
+        Args:
+            free: Free instance slots of the admission queue.
+            request (Optional[Dict[str, Any]]): 'prompt_tokens' and 'max_new_tokens' of the request,
+                                                and optionally a 'preferred' instance, such as the
+                                                worker holding its session's KV cache, which is
+                                                taken whenever it is free.
+            waited (float): Seconds the request has already been queued.
+        """
+        candidates = list({id(instance): instance for instance in free}.values())
+        preferred = request.get('preferred') if request else None
+        if preferred is not None and any(instance is preferred for instance in candidates):
+            return preferred
+        best = min(candidates, key=lambda instance: self._eta(instance, request))
+        if request and waited < self.max_defer:
+            best_eta = self._eta(best, request)
+            free_ids = {id(instance) for instance in candidates}
+            now = time_module.monotonic()
+            for instance in self.instances:
+                if id(instance) in free_ids or not instance.get('expected_finish'):
+                    continue
+                remaining = max(min(instance['expected_finish']) - now, 0.0)
+                # Counting the time already waited bounds how long a request holds out
+                if waited + remaining + self.service_time(instance['device'], request) < best_eta:
+                    self.deferred += 1
+                    return None
+        return best
+
+    def start(self, model_instance: Dict[str, Any], request: Optional[Dict[str, Any]]):
+        """
+        Records the expected finish of a request that was routed to an instance.
+        """
+        self._device_stats(model_instance['device'])['routed'] += 1
+        model_instance.setdefault('expected_finish', []).append(
+            time_module.monotonic() + self._eta(model_instance, request)
+        )
+
+    def finish(self, model_instance: Dict[str, Any]):
+        """
+        Forgets the earliest expected finish of an instance once a request leaves it.
+        """
+        expected_finish = model_instance.get('expected_finish')
+        if expected_finish:
+            expected_finish.remove(min(expected_finish))
+
+    def observe(self, device: str, prefill_tokens: int, prefill_seconds: float,
+                new_tokens: int, decode_seconds: float):
+        """
+        Folds the measured throughput of a finished request into the device's averages.
+        """
+        stats = self._device_stats(device)
+        weight = 1.0 if stats['samples'] == 0 else self.smoothing
+        if prefill_tokens > 0 and prefill_seconds > 0:
+            stats['prefill_tps'] += weight * (prefill_tokens / prefill_seconds - stats['prefill_tps'])
+        if new_tokens > 1 and decode_seconds > 0:
+            stats['decode_tps'] += weight * ((new_tokens - 1) / decode_seconds - stats['decode_tps'])
+        stats['samples'] += 1
+        if self.mean_new_tokens is None:
+            self.mean_new_tokens = float(new_tokens)
+        else:
+            self.mean_new_tokens += self.smoothing * (new_tokens - self.mean_new_tokens)
+
+    def metrics(self) -> Dict[str, Any]:
+        """
+        Returns the per-device throughput estimates and routing counters.
+        """
+        return {
+            "devices": {device: dict(stats) for device, stats in self.devices.items()},
+            "mean_new_tokens": self.mean_new_tokens,
+            "deferred": self.deferred,
+        }
+
 class ParallelModelPool:
     """
     Manages a pool of model instances for parallel inference across multiple CUDA devices.
-    Utilizes an asyncio.Queue to handle request queuing when all models are busy.
+    Utilizes a bounded, priority-aware AdmissionController to queue requests when all
+    models are busy, and an InstanceRouter to pick the instance each request runs on.
+
+    With `scheduling="continuous"` every instance runs a ContinuousBatchScheduler
+    and the pool holds one free slot per batch slot instead of one per instance.
     """
     def __init__(
         self, 
         model_path: str, 
         num_instances: int = 4, 
         dtype=torch.float16, 
-        devices: Optional[List[str]] = None
+        devices: Optional[List[str]] = None,
+        scheduling: str = "exclusive",
+        max_batch_size: int = 8,
+        cache_system_prefix: bool = True,
+        session_cache_bytes: int = 1 << 30,
+        stream_buffer_size: int = 64,
+        memory_high_water: float = 0.9,
+        share_weights: bool = True,
+        max_queue_depth: int = 64,
+        max_queue_wait: float = 30.0,
+        response_cache_bytes: int = 0,
+        response_cache_ttl: float = 300.0,
+        response_cache_max_temperature: float = 0.0,
+        coalesce_requests: bool = True,
+        coalesce_max_temperature: float = 0.0,
+        context_token_budget: Optional[int] = None,
+        history_token_budget: Optional[int] = None,
+        summarize_history: bool = True,
+        draft_model_path: Optional[str] = None,
+        num_draft_tokens: int = 5,
+        min_draft_acceptance: float = 0.3,
+        cpu_quantization: Optional[str] = None,
+        quantized_cache_dir: Optional[str] = None,
+        worker_processes: bool = False,
+        worker_threads: Optional[int] = None,
+        cpu_topology: Optional[Union[str, Dict[str, Any]]] = None
     ):
         """
         Initializes the model pool.
@@ -36,10 +219,131 @@ class ParallelModelPool:
             dtype: Data type for the model parameters.
             devices (Optional[List[str]]): Specific devices to load models onto. 
                                            If None, all available CUDA devices are used.
+            scheduling (str): "exclusive" hands a whole instance to one request,
+                              "continuous" batches requests inside each instance.
+            max_batch_size (int): Maximum concurrent sequences per instance in continuous mode.
+            cache_system_prefix (bool): Precompute the KV cache of the static system-prompt
+                                        prefix once per instance.
+            session_cache_bytes (int): Memory cap of the per-session KV cache store;
+                                       0 disables session reuse.
+            stream_buffer_size (int): Maximum text chunks buffered per stream before
+                                      the generation thread waits for the client.
+            memory_high_water (float): Fraction of device memory above which the
+                                       memory manager trims allocator caches.
+            share_weights (bool): Load the weights once per device and let every instance
+                                  on that device use them; instances then only differ in
+                                  per-request state such as KV caches and generation threads.
+            max_queue_depth (int): Maximum number of requests waiting for an instance
+                                   before new ones are rejected with 429.
+            max_queue_wait (float): Maximum seconds a request waits for an instance.
+            response_cache_bytes (int): Memory cap of the exact-match response cache;
+                                        0 (the default) disables it.
+            response_cache_ttl (float): Seconds a cached response stays valid.
+            response_cache_max_temperature (float): Highest temperature whose responses
+                                                    are cached; 0 caches greedy requests only.
+            coalesce_requests (bool): Let identical in-flight requests share one generation.
+            coalesce_max_temperature (float): Highest temperature whose requests are
+                                              coalesced; 0 coalesces greedy requests only.
+            context_token_budget (Optional[int]): Maximum tokens of retrieved context per
+                                                  prompt; None for no limit.
+            history_token_budget (Optional[int]): Maximum tokens of conversation history kept
+                                                  verbatim per prompt; None for no limit.
+            summarize_history (bool): Collapse turns beyond the history budget into a short
+                                      extractive summary instead of dropping them.
+            draft_model_path (Optional[str]): Small model sharing the tokenizer, loaded on every
+                                              device to draft tokens for speculative decoding;
+                                              None disables it. Exclusive scheduling only.
+            num_draft_tokens (int): Tokens the draft model proposes per decoding step.
+            min_draft_acceptance (float): Acceptance rate below which a device falls back to
+                                          decoding without the draft model.
+            cpu_quantization (Optional[str]): "int8" loads CPU instances (and draft models) with
+                                              int8 dynamically quantized linear layers in float32;
+                                              None loads the weights in `dtype`.
+            quantized_cache_dir (Optional[str]): Directory where quantized models are kept for
+                                                 fast restarts; None quantizes on every start.
+            worker_processes (bool): Run every instance in its own process, loading its own
+                                     weights, and stream its tokens back over a pipe. Keeps
+                                     decode loops off the server's GIL. Exclusive scheduling only.
+            worker_threads (Optional[int]): torch threads per worker process, overriding the
+                                            CPU topology's count; other than CPU workers keep
+                                            torch's default if None.
+            cpu_topology (Optional[Union[str, Dict[str, Any]]]): How CPU instances share the cores,
+                                                                 as a `CpuTopology` config dict, JSON
+                                                                 string or JSON file path. None splits
+                                                                 the cores evenly, "off" leaves every
+                                                                 instance on torch's defaults.
         """
-        self.tokenizer = AutoTokenizer.from_pretrained(model_path)
-        self.queue = asyncio.Queue(maxsize=num_instances)
+        if scheduling not in ("exclusive", "continuous"):
+            raise ValueError(f"Unknown scheduling mode: {scheduling}")
+        if cpu_quantization is not None and cpu_quantization not in CPU_QUANTIZATION_MODES:
+            raise ValueError(f"Unknown CPU quantization: {cpu_quantization}")
+        if worker_processes and scheduling != "exclusive":
+            raise ValueError("Worker processes require exclusive scheduling")
+
+        self.model_path = model_path
+        self.num_instances = num_instances
+        self.dtype = dtype
+        self.scheduling = scheduling
+        self.max_batch_size = max_batch_size
+        self.cache_system_prefix = cache_system_prefix
+        self.share_weights = share_weights
+        self.stream_buffer_size = stream_buffer_size
+        self.context_token_budget = context_token_budget
+        self.history_token_budget = history_token_budget
+        self.summarize_history = summarize_history
+        if draft_model_path and scheduling == "continuous":
+            logger.warning("Speculative decoding is not supported with continuous scheduling, draft model ignored")
+            draft_model_path = None
+        self.draft_model_path = draft_model_path
+        self.num_draft_tokens = num_draft_tokens
+        self.cpu_quantization = cpu_quantization
+        self.quantized_cache_dir = quantized_cache_dir
+        self.worker_processes = worker_processes
+        self.worker_threads = worker_threads
+        self.cpu_topology = CpuTopology.from_config(cpu_topology)
+        self.speculation = DraftAcceptance(
+            num_draft_tokens=num_draft_tokens,
+            min_acceptance=min_draft_acceptance
+        ) if draft_model_path else None
+        self.slots_per_instance = max_batch_size if scheduling == "continuous" else 1
+        self.tokenizer = None
+        self.history_manager: Optional[HistoryManager] = None
+        self.prompt_assembler: Optional[PromptAssembler] = None
+        self.tokenizer_ready = asyncio.Event()
         self.model_instances = []
+        self.router = InstanceRouter(
+            self.model_instances,
+            slots_per_instance=self.slots_per_instance,
+            max_defer=max_queue_wait / 2
+        )
+        self.admission = AdmissionController(
+            max_queue_depth=max_queue_depth,
+            max_wait=max_queue_wait,
+            select=self.router.select
+        )
+        self.device_models: Dict[str, Dict[str, Any]] = {}
+        self.load_errors: List[str] = []
+        self.loading_task: Optional[asyncio.Task] = None
+        self.stats = {
+            'cancelled_requests': 0,
+            'cancelled_tokens_saved': 0,  # max_new_tokens budget not spent on abandoned requests
+            'context_duplicates_removed': 0,
+            'context_tokens_dropped': 0,
+        }
+        self.session_cache_bytes = session_cache_bytes
+        # Worker that served each recent session, so its next turn can reuse that worker's cache
+        self.session_workers: OrderedDict = OrderedDict()
+        # Worker processes keep their own session caches
+        self.session_cache = (
+            SessionCache(session_cache_bytes) if session_cache_bytes > 0 and not worker_processes else None
+        )
+        self.response_cache = ResponseCache(
+            response_cache_bytes,
+            ttl=response_cache_ttl,
+            max_temperature=response_cache_max_temperature
+        ) if response_cache_bytes > 0 else None
+        self.single_flight = SingleFlight(coalesce_max_temperature) if coalesce_requests else None
+        self.metrics = ServingMetrics()
 
         # Detect available CUDA devices if not specified
         if devices is None:
@@ -49,62 +353,698 @@ class ParallelModelPool:
                 devices = ["cpu"]
 
         logger.info(f"Using devices: {devices}")
+        self.devices = devices
+        self.memory_manager = MemoryManager(devices, high_water=memory_high_water)
+
+    def start_loading(self) -> asyncio.Task:
+        """
+        Starts loading the model instances in the background. The pool serves
+        requests as soon as the first instance is online.
+        """
+        if self.loading_task is None:
+            self.loading_task = asyncio.create_task(self.load())
+        return self.loading_task
 
-        for i in range(num_instances):
+    async def load(self):
+        """
+        Loads the tokenizer and then every model instance, concurrently across
+        devices. Each instance is enqueued as soon as it is ready.
+        """
+        self.tokenizer = await asyncio.to_thread(self._load_tokenizer)
+        self.history_manager = HistoryManager(
+            self.tokenizer,
+            max_tokens=self.history_token_budget,
+            summarize=self.summarize_history
+        )
+        self.prompt_assembler = await asyncio.to_thread(self._prompt_assembler)
+        self.tokenizer_ready.set()
+        prefix_ids = await asyncio.to_thread(self._static_prefix_ids) if self.cache_system_prefix else []
+
+        # Assign devices in a round-robin fashion if instances exceed devices
+        assignments: Dict[str, List[int]] = {}
+        for i in range(self.num_instances):
+            assignments.setdefault(self.devices[i % len(self.devices)], []).append(i)
+
+        # Give every CPU instance its own cores and threads
+        cpu_plan = self.cpu_topology.plan(len(assignments.get("cpu", []))) if self.cpu_topology else []
+        if cpu_plan and not self.worker_processes:
             try:
-                # Assign devices in a round-robin fashion if instances exceed devices
-                device = devices[i % len(devices)]
-                
-                logger.debug(f"Loading model instance {i} on {device}")
-
-                model = AutoModelForCausalLM.from_pretrained(
-                    model_path, 
-                    torch_dtype=dtype
-                ).to(device)
-                
-                model_instance = {
-                    'model': model, 
-                    'device': device
-                }
-                self.model_instances.append(model_instance)
-                
-                # Enqueue the model instance as available
-                self.queue.put_nowait(model_instance)
-                
+                # Inter-op threads are shared by every instance in the process
+                torch.set_num_interop_threads(sum(cpu['interop_threads'] for cpu in cpu_plan))
+            except RuntimeError as e:
+                logger.warning(f"Could not set inter-op threads: {e}")
+        for position, cpu in enumerate(cpu_plan):
+            logger.info(f"CPU instance {position}: {cpu['threads']} threads on cores {cpu['cores']}")
+
+        await asyncio.gather(*(
+            self._load_device(device, indices, prefix_ids, cpu_plan if device == "cpu" else [])
+            for device, indices in assignments.items()
+        ))
+        logger.info(f"Loaded {len(self.model_instances)}/{self.num_instances} model instances")
+
+    async def _load_device(self, device: str, indices: List[int], prefix_ids: List[torch.Tensor],
+                           cpu_plan: List[Dict[str, Any]]):
+        """
+        Loads the instances assigned to one device, one after another.
+        `cpu_plan` holds the cores and threads of each CPU instance.
+        """
+        for position, i in enumerate(indices):
+            cpu = cpu_plan[position] if cpu_plan else None
+            try:
+                if self.worker_processes:
+                    worker = await asyncio.to_thread(self._start_worker, device, prefix_ids, cpu)
+                    self._add_instance(device, {
+                        'model': None, 'worker': worker, 'prefix_caches': [], 'draft_model': None
+                    }, cpu=cpu)
+                    logger.info(f"Loaded and enqueued model instance {i} on {device} in process {worker.info['pid']}")
+                    continue
+
+                # Instances on the same device share one read-only copy of the weights
+                # and the prefix caches computed from them
+                shared = self.device_models.get(device) if self.share_weights else None
+                if shared is None:
+                    logger.debug(f"Loading model weights for instance {i} on {device}")
+                    shared = await asyncio.to_thread(self._load_shared, device, prefix_ids)
+                    self.device_models.setdefault(device, shared)
+                else:
+                    logger.debug(f"Instance {i} shares the model weights already loaded on {device}")
+                self._add_instance(device, shared, cpu=cpu)
                 logger.info(f"Loaded and enqueued model instance {i} on {device}")
             except Exception as e:
                 logger.error(f"Failed to load model instance {i} on {device}: {e}")
+                self.load_errors.append(f"instance {i} on {device}: {e}")
+
+    def _load_shared(self, device: str, prefix_ids: List[torch.Tensor]) -> Dict[str, Any]:
+        """
+        Loads the weights for a device and computes their prefix caches.
+        """
+        model = self._load_model(self.model_path, self.dtype, device)
+        return {
+            'model': model,
+            'draft_model': self._load_draft_model(model, device) if self.draft_model_path else None,
+            'prefix_caches': [PrefixCache.compute(model, ids) for ids in prefix_ids]
+        }
+
+    def _load_draft_model(self, model, device: str):
+        """
+        Loads the draft model for speculative decoding next to a device's weights.
+        The pool keeps serving without it if it cannot be used.
+        """
+        try:
+            draft_model = self._load_model(self.draft_model_path, self.dtype, device)
+        except Exception as e:
+            logger.error(f"Failed to load draft model on {device}, decoding without it: {e}")
+            return None
+        if draft_model.get_input_embeddings().weight.shape[0] != model.get_input_embeddings().weight.shape[0]:
+            logger.error(f"Draft model vocabulary does not match the model's, decoding without it on {device}")
+            return None
+        # A fixed draft length keeps the acceptance rate comparable across requests
+        draft_model.generation_config.num_assistant_tokens = self.num_draft_tokens
+        draft_model.generation_config.num_assistant_tokens_schedule = "constant"
+        draft_model.generation_config.assistant_confidence_threshold = 0.0
+        logger.info(f"Loaded draft model {self.draft_model_path} on {device}")
+        return draft_model
+
+    def _add_instance(self, device: str, shared: Dict[str, Any], cpu: Optional[Dict[str, Any]] = None):
+        """
+        Creates an instance over loaded weights and makes it available.
+        `cpu` is its share of the CPU topology, applied to its generation threads.
+        """
+        model = shared['model']
+        model_instance = {
+            'model': model, 
+            'device': device,
+            'active_requests': 0,
+            'prefix_caches': shared['prefix_caches'],
+            'draft_model': shared.get('draft_model'),
+            'worker': shared.get('worker'),
+            'cpu': cpu,
+            'throughput': {
+                'requests': 0,
+                'prompt_tokens': 0,
+                'cached_prompt_tokens': 0,
+                'prefill_tokens': 0,
+                'prefill_seconds': 0.0,
+                'generated_tokens': 0,
+                'decode_tokens': 0,
+                'decode_seconds': 0.0,
+            }
+        }
+        if self.scheduling == "continuous":
+            model_instance['scheduler'] = ContinuousBatchScheduler(
+                model,
+                eos_token_ids=self._eos_token_ids(model),
+                max_batch_size=self.max_batch_size,
+                thread_init=(lambda: apply_to_thread(cpu)) if cpu else None
+            )
+        self.model_instances.append(model_instance)
+
+        # Make the model instance available, once per batch slot
+        for _ in range(self.slots_per_instance):
+            self.admission.add(model_instance)
+
+    def _worker_kwargs(self, device: str) -> Dict[str, Any]:
+        """
+        Arguments of the pool a worker process builds to load its instance.
+        """
+        return {
+            'model_path': self.model_path,
+            'num_instances': 0,
+            'dtype': self.dtype,
+            'devices': [device],
+            'cache_system_prefix': self.cache_system_prefix,
+            # Each worker caches the sessions it served, within its share of the budget
+            'session_cache_bytes': self.session_cache_bytes // max(self.num_instances, 1),
+            'coalesce_requests': False,
+            'draft_model_path': self.draft_model_path,
+            'num_draft_tokens': self.num_draft_tokens,
+            'cpu_quantization': self.cpu_quantization,
+            'quantized_cache_dir': self.quantized_cache_dir,
+            # The worker process is configured as a whole before it loads
+            'cpu_topology': "off",
+        }
+
+    def _start_worker(self, device: str, prefix_ids: List[torch.Tensor],
+                      cpu: Optional[Dict[str, Any]]) -> WorkerProcess:
+        """
+        Starts the worker process of one instance and waits until it is loaded.
+
+        Args:
+            device (str): Device of the instance.
+            prefix_ids (List[torch.Tensor]): Static prompt prefixes to precompute KV caches for.
+            cpu (Optional[Dict[str, Any]]): The instance's share of the CPU topology, if any.
+        """
+        cpu = dict(cpu or {})
+        if self.worker_threads:
+            cpu['threads'] = self.worker_threads
+        worker = WorkerProcess(
+            type(self), self._worker_kwargs(device), device, self.tokenizer, prefix_ids, cpu=cpu or None
+        )
+        worker.start()
+        return worker
+
+    def readiness(self) -> Dict[str, Any]:
+        """
+        Reports which instances are online while the pool is loading.
+        """
+        return {
+            "ready": len(self.model_instances) > 0,
+            "loading": self.loading_task is not None and not self.loading_task.done(),
+            "loaded_instances": len(self.model_instances),
+            "expected_instances": self.num_instances,
+            "instances": [
+                {
+                    'device': instance['device'],
+                    **({'pid': instance['worker'].info['pid']} if instance['worker'] is not None else {}),
+                    **({'cores': instance['cpu']['cores'], 'threads': instance['cpu']['threads']}
+                       if instance['cpu'] else {})
+                }
+                for instance in self.model_instances
+            ],
+            "errors": self.load_errors,
+        }
+
+    def _load_tokenizer(self):
+        """
+        Loads the tokenizer of the served model.
+        """
+        return AutoTokenizer.from_pretrained(self.model_path)
+
+    def _load_model(self, model_path: str, dtype, device: str):
+        """
+        Loads the model weights onto a device for inference only.
+        """
+        if device == "cpu" and self.cpu_quantization == "int8":
+            return load_int8_model(model_path, cache_dir=self.quantized_cache_dir)
+
+        # safetensors checkpoints are memory-mapped and materialized directly on the device
+        model = AutoModelForCausalLM.from_pretrained(
+            model_path, 
+            torch_dtype=dtype,
+            low_cpu_mem_usage=True,
+            device_map={"": device}
+        )
+        model.eval()
+        model.requires_grad_(False)
+        return model
+
+    def prepare_messages(
+        self,
+        query: str,
+        context,
+        history_messages: Optional[List[Dict]] = None
+    ) -> Tuple[List[Dict], Optional[Dict[str, Any]]]:
+        """
+        Builds the chat messages of a request: the query with its assembled
+        context, and the history compacted to its token budget.
+
+        Returns:
+            Tuple[List[Dict], Optional[Dict[str, Any]]]: The messages and, when
+            the request has context, what context assembly kept and dropped.
+        """
+        # Prepare context string using ContextPreparer; duplicates are removed
+        # and the context is cut to its token budget
+        context_preparer = ContextPreparer(tokenizer=self.tokenizer, max_tokens=self.context_token_budget)
+        context_str, context_report = context_preparer.assemble(context)
+        self.stats['context_duplicates_removed'] += context_report['duplicates']
+        self.stats['context_tokens_dropped'] += context_report['dropped_tokens']
+        if context_report['dropped']:
+            logger.info(
+                f"Context cut to {context_report['tokens']} tokens: dropped {context_report['dropped']} "
+                f"of {context_report['entries']} entries ({context_report['dropped_tokens']} tokens)"
+            )
+
+        logger.debug(f"context_Str: {context_str}")
+
+        user_message = self._build_user_message(query, context_str) if context else query
+        # Keep the most recent turns within the history budget, older ones as a summary
+        history_turns, history_summary, history_report = self.history_manager.compact(history_messages)
+        if history_report['kept'] < history_report['turns']:
+            logger.debug(f"History compacted: {history_report}")
+        messages = self._build_messages(user_message, history_turns, history_summary)
+        return messages, context_report if context else None
+
+    def _build_user_message(self, query: str, context_str: str) -> str:
+        """
+        Wraps the query and its context in the citation instructions.
+        """
+        # Prepare the user message with constraints and instructions
+        user_message = rag_user_prompt_template.substitute(query=query, context_str=context_str)
+        return user_message
+
+    def _build_messages(
+        self,
+        user_message: str,
+        history_messages: Optional[List[Dict]],
+        history_summary: Optional[str] = None
+    ) -> List[Dict]:
+        """
+        Assembles the chat messages sent to the model.
+
+        The history is kept as real chat turns, so consecutive requests of a
+        conversation share a token prefix; turns that no longer fit the history
+        budget are represented by `history_summary`.
+        """
+        messages = [{"role": "system", "content": agentic_prompt}]
+        if history_summary:
+            messages.append({"role": "system", "content": history_summary})
+        # {"role": "system", "content": f"Context Information: {context}"},
+        return [*messages, *(history_messages or []), {"role": "user", "content": user_message}]
+
+    def _prompt_assembler(self) -> PromptAssembler:
+        """
+        Creates the prompt assembler with the constant prompt texts (the system
+        prompt and the RAG instructions between their placeholders) and checks
+        it against sample prompts of every shape the pool builds.
+        """
+        static_texts = [agentic_prompt, *re.split(r"\$\w+", rag_user_prompt_template.template)]
+        history = [
+            {"role": "user", "content": "What did the résumé say about Python?"},
+            {"role": "assistant", "content": "It lists 5 years of Python [Resume.pdf](cv.pdf)(page 1)."},
+        ]
+        context = "\n- name: Resume.pdf\n  page: 1\n  url: cv.pdf\n  text: Ünïcode, 日本語 and  spaces\t.\n"
+        samples = [
+            self._build_messages("Hello!", None),
+            self._build_messages(self._build_user_message("Summarize the candidate.", context), None),
+            self._build_messages(self._build_user_message(" 2024?", ""), history, "Summary of the earlier conversation:"),
+        ]
+        return PromptAssembler(self.tokenizer, static_texts=static_texts, samples=samples)
+
+    def _static_prefix_ids(self) -> List[torch.Tensor]:
+        """
+        Tokenizes the prompt prefixes that are identical for every request:
+        the system prompt up to the first chat turn, and additionally the RAG
+        instruction block up to the question when there is no history.
+
+        The prefixes are cut from fully rendered prompts and their last token
+        is dropped, so that it cannot merge differently with the text that
+        follows it in a real prompt.
+        """
+        sentinel = "\u2063PREFIX_END\u2063"
+        prompts = [
+            self._build_messages(sentinel, None),
+            self._build_messages(self._build_user_message(sentinel, sentinel), None),
+        ]
+        prefix_ids = []
+        for messages in prompts:
+            text = self.tokenizer.apply_chat_template(
+                messages,
+                add_generation_prompt=True,
+                tokenize=False
+            )
+            text = text[:text.index(sentinel)]
+            token_ids = self.tokenizer(
+                text,
+                add_special_tokens=False,
+                return_tensors="pt"
+            )['input_ids'][:, :-1]
+            if token_ids.shape[-1] > 0:
+                prefix_ids.append(token_ids)
+        return prefix_ids
+
+    def _resume_cache(self, model_instance: Dict[str, Any], input_ids: torch.Tensor,
+                      session_id: Optional[str]) -> Tuple[Optional[Any], int]:
+        """
+        Finds the KV cache covering the longest prefix of a prompt on an instance:
+        the precomputed static prefix, or the previous turn of the session.
+
+        Args:
+            model_instance (Dict[str, Any]): Instance the prompt runs on.
+            input_ids (torch.Tensor): Prompt ids, on the instance's device.
+            session_id (Optional[str]): Session whose KV cache is resumed, if any.
+
+        Returns:
+            Tuple[Optional[Any], int]: The cache to start from, or None, and the prompt tokens it covers.
+        """
+        # Start from the precomputed static prefix so only the suffix is prefilled
+        past_key_values = None
+        cached_tokens = 0
+        prefix_cache = find_prefix_cache(model_instance['prefix_caches'], input_ids)
+        if prefix_cache is not None:
+            past_key_values = prefix_cache.new_cache()
+            cached_tokens = len(prefix_cache)
+
+        # A previous turn of the same session may cover more of the prompt
+        if session_id is not None:
+            session_cache, session_tokens = self.session_cache.resume(
+                session_id, input_ids, model_instance['model'].device
+            )
+            if session_tokens > cached_tokens:
+                past_key_values = session_cache
+                cached_tokens = session_tokens
+            elif past_key_values is None:
+                # Pass an empty cache so it can be stored after generation
+                past_key_values = DynamicCache()
+        return past_key_values, cached_tokens
+
+    def _generation_kwargs(
+        self,
+        model_instance: Dict[str, Any],
+        inputs: Dict[str, torch.Tensor],
+        streamer,
+        cancel_token: CancellationToken,
+        max_new_tokens: int,
+        temperature: float,
+        top_p: float,
+        past_key_values: Optional[Any],
+        speculative: bool
+    ) -> Dict[str, Any]:
+        """
+        Builds the `model.generate` arguments of one request on an exclusive instance.
+        """
+        generation_kwargs = {
+            **inputs,
+            'streamer': streamer,
+            'max_new_tokens': max_new_tokens,
+            # Temperature 0 decodes greedily, so repeated requests give the same answer
+            'do_sample': temperature > 0,
+            'pad_token_id': self.tokenizer.eos_token_id,
+            'stopping_criteria': StoppingCriteriaList([CancellationStoppingCriteria(cancel_token)]),
+        }
+        if temperature > 0:
+            generation_kwargs.update(temperature=temperature, top_p=top_p)
+        if past_key_values is not None:
+            generation_kwargs['past_key_values'] = past_key_values
+        if speculative:
+            # Assisted generation: the draft model proposes tokens that one target pass verifies
+            generation_kwargs['assistant_model'] = model_instance['draft_model']
+        return generation_kwargs
+
+    def _store_session(self, session_id: str, prompt_ids: torch.Tensor, sequence,
+                       output_ids: Optional[torch.Tensor], past_key_values: Optional[DynamicCache]):
+        """
+        Keeps the KV cache of a finished turn for the next turn of the session.
+        The cache covers the prompt and every generated token except the last.
+        """
+        if sequence is not None:
+            cache = sequence.past_key_values
+            token_ids = torch.cat([
+                prompt_ids.cpu(),
+                torch.tensor([sequence.generated_ids], dtype=prompt_ids.dtype)
+            ], dim=-1)
+        elif output_ids is not None and past_key_values is not None:
+            cache = past_key_values.to_legacy_cache()
+            token_ids = output_ids.cpu()
+        else:
+            return
+        if not cache:
+            return
+        token_ids = token_ids[:, :cache[0][0].shape[-2]]
+        self.session_cache.put(session_id, token_ids, cache)
+
+    def _eos_token_ids(self, model) -> List[int]:
+        """
+        Collects the token ids that end generation for a model.
+        """
+        eos_token_ids = model.generation_config.eos_token_id
+        if eos_token_ids is None:
+            eos_token_ids = []
+        elif isinstance(eos_token_ids, int):
+            eos_token_ids = [eos_token_ids]
+        if self.tokenizer.eos_token_id is not None:
+            eos_token_ids = [*eos_token_ids, self.tokenizer.eos_token_id]
+        return list(eos_token_ids)
+
+    def _record_throughput(
+        self,
+        model_instance: Dict[str, Any],
+        prompt_tokens: int,
+        cached_tokens: int,
+        token_times: List[float],
+        submitted_at: float
+    ) -> Dict[str, Any]:
+        """
+        Splits a finished request into its prefill and decode phases and adds
+        them to the instance's throughput counters.
+
+        The prefill phase runs from submission to the first generated token and
+        covers the prompt tokens not served from a KV cache; the decode phase
+        covers every generated token after the first.
+
+        Args:
+            model_instance (Dict[str, Any]): The instance that served the request.
+            prompt_tokens (int): Tokens in the prompt.
+            cached_tokens (int): Prompt tokens reused from a KV cache.
+            token_times (List[float]): perf_counter() arrival time of each generated token.
+            submitted_at (float): perf_counter() time the prompt was handed to the instance.
+
+        Returns:
+            Dict[str, Any]: Token counts, durations and tokens/s of both phases.
+        """
+        generated_tokens = len(token_times)
+        prefill_tokens = prompt_tokens - cached_tokens
+        prefill_seconds = token_times[0] - submitted_at if token_times else 0.0
+        decode_tokens = max(generated_tokens - 1, 0)
+        decode_seconds = token_times[-1] - token_times[0] if token_times else 0.0
+
+        device = model_instance['device']
+        if token_times:
+            self.router.observe(device, prefill_tokens, prefill_seconds, generated_tokens, decode_seconds)
+            self.metrics.time_to_first_token.observe(prefill_seconds, device=device)
+            # Tokens that arrived together (a speculative step, a worker's chunk) share one
+            # timestamp; record each arrival once, with its gap spread over its tokens
+            arrivals = [(time, len(list(tokens))) for time, tokens in itertools.groupby(token_times)]
+            for (previous, _), (current, num_tokens) in zip(arrivals, arrivals[1:]):
+                self.metrics.inter_token_latency.observe((current - previous) / num_tokens, device=device)
+
+        counters = model_instance['throughput']
+        counters['requests'] += 1
+        counters['prompt_tokens'] += prompt_tokens
+        counters['cached_prompt_tokens'] += cached_tokens
+        counters['prefill_tokens'] += prefill_tokens
+        counters['prefill_seconds'] += prefill_seconds
+        counters['generated_tokens'] += generated_tokens
+        counters['decode_tokens'] += decode_tokens
+        counters['decode_seconds'] += decode_seconds
+
+        return {
+            "generated_tokens": generated_tokens,
+            "prefill_tokens": prefill_tokens,
+            "prefill_seconds": prefill_seconds,
+            "prefill_tokens_per_second": prefill_tokens / prefill_seconds if prefill_seconds > 0 else 0,
+            "decode_tokens": decode_tokens,
+            "decode_seconds": decode_seconds,
+            "decode_tokens_per_second": decode_tokens / decode_seconds if decode_seconds > 0 else 0,
+        }
+
+    def throughput(self, model_instance: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Returns an instance's aggregated token counters with the prefill and
+        decode throughput they imply.
+        """
+        counters = dict(model_instance['throughput'])
+        counters['prefill_tokens_per_second'] = (
+            counters['prefill_tokens'] / counters['prefill_seconds'] if counters['prefill_seconds'] > 0 else 0
+        )
+        counters['decode_tokens_per_second'] = (
+            counters['decode_tokens'] / counters['decode_seconds'] if counters['decode_seconds'] > 0 else 0
+        )
+        return counters
+
+    def metrics_text(self) -> str:
+        """
+        Renders the latency histograms, live pool gauges and token counters for Prometheus.
+        """
+        busy: Dict[str, int] = {}
+        total: Dict[str, int] = {}
+        for model_instance in self.model_instances:
+            device = model_instance['device']
+            total[device] = total.get(device, 0) + 1
+            busy[device] = busy.get(device, 0) + (model_instance['active_requests'] > 0)
+
+        memory = []
+        for device in self.memory_manager.devices:
+            usage = self.memory_manager.sample(device)
+            memory.extend(
+                ({'device': device, 'kind': kind}, usage[kind]) for kind in ('allocated', 'reserved', 'total')
+            )
+
+        gauges = [
+            render_gauge("llm_instances", "Model instances online.",
+                         [({'device': device}, count) for device, count in total.items()]),
+            render_gauge("llm_instances_busy", "Model instances serving at least one request.",
+                         [({'device': device}, count) for device, count in busy.items()]),
+            render_gauge("llm_active_requests", "Requests currently being generated.",
+                         [({}, sum(instance['active_requests'] for instance in self.model_instances))]),
+            render_gauge("llm_queue_depth", "Requests waiting in the admission queue.",
+                         [({}, self.admission.waiting)]),
+            render_gauge("llm_device_memory_bytes", "Device memory usage.", memory),
+        ]
+        counters = {}
+        for model_instance in self.model_instances:
+            totals = counters.setdefault(model_instance['device'], {})
+            for key, value in model_instance['throughput'].items():
+                totals[key] = totals.get(key, 0) + value
+        for key, documentation in (
+            ('prompt_tokens', "Prompt tokens of finished requests."),
+            ('cached_prompt_tokens', "Prompt tokens served from a KV cache."),
+            ('generated_tokens', "Tokens generated for finished requests."),
+            ('prefill_seconds', "Time spent in prefill by finished requests."),
+            ('decode_seconds', "Time spent decoding by finished requests."),
+        ):
+            gauges.append(render_counter(
+                f"llm_{key}_total", documentation,
+                [({'device': device}, totals[key]) for device, totals in counters.items()]
+            ))
+        if self.speculation is not None:
+            devices = self.speculation.devices
+            for key, documentation in (
+                ('draft_tokens', "Tokens proposed by the draft model."),
+                ('accepted_tokens', "Draft tokens accepted by the model."),
+            ):
+                gauges.append(render_counter(
+                    f"llm_speculative_{key}_total", documentation,
+                    [({'device': device}, stats[key]) for device, stats in devices.items()]
+                ))
+            gauges.append(render_gauge(
+                "llm_speculative_acceptance_rate", "Smoothed share of draft tokens accepted.",
+                [({'device': device}, stats['acceptance_rate']) for device, stats in devices.items()
+                 if stats['acceptance_rate'] is not None]
+            ))
+        if self.response_cache is not None:
+            for key in ('hits', 'misses'):
+                gauges.append(render_counter(
+                    f"llm_response_cache_{key}_total", f"Response cache {key}.",
+                    [({}, self.response_cache.stats[key])]
+                ))
+        return self.metrics.render(gauges)
+
+    def shutdown(self):
+        """
+        Stops loading, the continuous batching schedulers and worker processes, if any.
+        """
+        if self.loading_task is not None:
+            self.loading_task.cancel()
+        for model_instance in self.model_instances:
+            scheduler = model_instance.get('scheduler')
+            if scheduler is not None:
+                scheduler.shutdown()
+            if model_instance['worker'] is not None:
+                model_instance['worker'].stop()
+
+    async def _stop_generation(
+        self,
+        generation_done: Optional[threading.Event],
+        cancel_token: CancellationToken,
+        max_new_tokens: int,
+        streamer: Optional[AsyncTextStreamer]
+    ):
+        """
+        Cancels a generation that is still running and waits until it has
+        stopped, so an instance is never released while it is still decoding.
+
+        Args:
+            generation_done (Optional[threading.Event]): Set when decoding has ended.
+            cancel_token (CancellationToken): The request's cancellation token.
+            max_new_tokens (int): Token budget of the request.
+            streamer (Optional[AsyncTextStreamer]): The request's streamer.
+        """
+        if generation_done is None or generation_done.is_set():
+            return
 
-    async def get_free_model(self, timeout: Optional[float] = None):
+        cancel_token.cancel()
+        generated = streamer.num_tokens if streamer is not None else 0
+        self.stats['cancelled_requests'] += 1
+        self.stats['cancelled_tokens_saved'] += max(max_new_tokens - generated, 0)
+        async def wait_stopped():
+            while not generation_done.is_set():
+                await asyncio.sleep(0.005)
+
+        waiter = asyncio.ensure_future(wait_stopped())
+        cancelled = False
+        while not waiter.done():
+            try:
+                await asyncio.shield(waiter)
+            except asyncio.CancelledError:
+                if waiter.cancelled():
+                    raise
+                # Cancelled again while waiting: keep waiting without blocking the event loop
+                cancelled = True
+        if cancelled:
+            raise asyncio.CancelledError()
+        logger.debug(f"Generation cancelled after {generated} tokens")
+
+    async def get_free_model(
+        self,
+        timeout: Optional[float] = None,
+        priority: str = "normal",
+        request: Optional[Dict[str, Any]] = None
+    ):
         """
-        Retrieves a free model instance from the queue.
-        Waits until a model becomes available or until timeout.
+        Retrieves a free model instance through the admission queue.
+        Waits until a model becomes available, in priority order, or until timeout.
 
         Args:
-            timeout (Optional[float]): Maximum time to wait for a model.
+            timeout (Optional[float]): Maximum time to wait for a model; defaults to
+                                       the pool's max_queue_wait.
+            priority (str): Priority class of the request: "high", "normal" or "low".
+            request (Optional[Dict[str, Any]]): 'prompt_tokens' and 'max_new_tokens' of the
+                                                request, used to route it to the instance
+                                                expected to finish it first.
 
         Returns:
             dict: A dictionary containing the model and its device.
 
         Raises:
-            HTTPException: If no model becomes available within the timeout.
+            HTTPException: 429 with Retry-After if the queue is full or no model
+                           becomes available within the timeout.
         """
-        try:
-            model_instance = await asyncio.wait_for(self.queue.get(), timeout=timeout)
-            logger.debug(f"Acquired model on {model_instance['device']}")
-            return model_instance
-        except asyncio.TimeoutError:
-            logger.warning("No model instances available and timeout reached.")
-            raise HTTPException(503, "No model instances available. Please try again later.")
+        model_instance = await self.admission.acquire(priority=priority, timeout=timeout, request=request)
+        self.router.start(model_instance, request)
+        model_instance['active_requests'] += 1
+        logger.debug(f"Acquired model on {model_instance['device']}")
+        return model_instance
 
     async def release_model(self, model_instance):
         """
-        Releases a model instance back to the queue.
+        Releases a model instance back to the admission queue.
 
         Args:
             model_instance (dict): The model instance to release.
         """
-        await self.queue.put(model_instance)
+        model_instance['active_requests'] -= 1
+        self.router.finish(model_instance)
+        self.admission.release(model_instance)
         logger.debug(f"Released model on {model_instance['device']} back to the queue")
 
     async def generate_text_stream(
@@ -115,7 +1055,9 @@ class ParallelModelPool:
         max_new_tokens: int = 1024, 
         temperature: float = 0.7, 
         top_p: float = 0.9,
-        timeout: Optional[float] = None  # Optional timeout for acquiring a model
+        timeout: Optional[float] = None,  # Optional timeout for acquiring a model
+        session_id: Optional[str] = None,
+        priority: str = "normal"
     ):
         """
         Generates text in a streaming fashion using an available model instance.
@@ -128,184 +1070,298 @@ class ParallelModelPool:
             temperature (float): Sampling temperature.
             top_p (float): Top-p sampling threshold.
             timeout (Optional[float]): Maximum time to wait for a model instance.
+            session_id (Optional[str]): Conversation id; the KV cache of each turn is kept
+                                        so the next turn only prefills what is new.
+            priority (str): Admission priority class: "high", "normal" or "low".
 
         Yields:
             str: Generated text chunks and metrics as Server-Sent Events (SSE).
         """
-        model_instance = await self.get_free_model(timeout=timeout)
+        request_start = time_module.perf_counter()
+        stream = None
         try:
             # messages = [
             #     {"role": "system", "content": "You are a helpful assistant."}, 
             #     *(history_messages or []), 
             #     {"role": "user", "content": query}
             # ]
-            history_messages = history_messages if history_messages else ""
-   
-
-            # Prepare context string using ContextPreparer
-            context_preparer = ContextPreparer()
-            context_str = context_preparer.prepare_context(context)
-
-            logger.info(f"context_Str: {context_str}")
-
-            # Prepare the user message with constraints and instructions
-            user_message = f"""
-            Please answer the following question using **only** the provided context and function call responses. **Do not use any external information or your own knowledge.**
-
-            When you reference information from the context or function call responses, you **must** cite the source from the provided metadata by including an inline citation in the format `[Document Name](URL)(Page X)` for documents, or `[Function Name](Reference)` for function calls.
-
-            ### Example of metadata in the retrieved documents:
-
-            {{"Subquery-1": {{"Source": [{{"name": "Resume.pdf", "page":1, "url": "user_data/Candidate/Resume.pdf", "text": "Document Content"}}], "Type": "RAG"}}}}
-
-            The format of the citation becomes `[Resume.pdf](user_data/Candidate/Resume.pdf)(page 1)`
-
-            ### Example of metadata in the function call responses:
+            use_session = session_id is not None and self.session_cache_bytes > 0
 
-            {{'Subquery-1': {{'Source': [{{'FunctionName': [{{'name': 'google_search', 'arguments': {{'query': '2024 US election', 'num_results': '10'}}}}], 'Output': 'output of the function call'}}], 'Type': 'Action'}}}}
-
-            The format of the citation becomes `[google_search](query: '2024 US election', num_results: '10')`
-
-            Ensure that the citations are properly formatted as clickable links in Markdown.
-
-            If the context and function call responses do not contain enough information to answer the question, politely inform the user of this limitation.
-
-            ---
-
-            **Question:**
-
-            {query}
-
-            ---
-
-            **Context:**
-
-            {context_str}
-
-            ---
-
-            **Instructions:**
-
-            - Provide a clear and concise answer to the question.
-            - Do not include any information that is not in the provided context or function call responses.
-            - If the answer cannot be found in the context or function call responses, state that the information is not available.
-            - **Every time** you use information from the context or function call responses, include an inline citation immediately after the information.
-            - Always prioritize the most recent information if there are conflicting information from the context or function call responses.
+            # The tokenizer is loaded before any instance comes online
+            if self.tokenizer is None:
+                try:
+                    await asyncio.wait_for(self.tokenizer_ready.wait(), timeout or self.admission.max_wait)
+                except asyncio.TimeoutError:
+                    raise HTTPException(503, "Model pool is still loading. Please try again later.")
 
-            **Example:**
+            messages, context_report = self.prepare_messages(query, context, history_messages)
+            logger.info(f"Generating text for messages: {messages}")
 
-            "According to [Resume.pdf](user_data/Candidate/Resume.pdf)(page 1), ..."
+            # Identical deterministic requests are answered from the response cache
+            cache_key = None
+            if self.response_cache is not None and self.response_cache.cacheable(temperature):
+                cache_key = request_key(messages, max_new_tokens=max_new_tokens, temperature=temperature, top_p=top_p)
+                cached_response = self.response_cache.get(cache_key)
+                if cached_response is not None:
+                    for chunk in cached_response['chunks']:
+                        yield f"data: {chunk}\n\n"
+                    metrics = {
+                        "metrics": {
+                            "latency": time_module.perf_counter() - request_start,
+                            "tokens": cached_response['generated_tokens'],
+                            "chunks": len(cached_response['chunks']),
+                            "cached_response": True
+                        }
+                    }
+                    yield f"data: {json.dumps(metrics)}\n\n"
+                    return
 
-            "As provided by [Function Name], ..."
+            def start():
+                return self._generate_stream(
+                    messages,
+                    max_new_tokens=max_new_tokens,
+                    temperature=temperature,
+                    top_p=top_p,
+                    timeout=timeout,
+                    session_id=session_id if use_session else None,
+                    priority=priority,
+                    cache_key=cache_key,
+                    request_start=request_start,
+                    context_report=context_report
+                )
 
-            **Citation Format requirement:**
-            - Citation Format: `[Document Name](URL)(page X)`
-            - Place citation IMMEDIATELY after used information
-            - Use metadata from the context to get the right page number
-                
-            **Validation:**
-            - Don't cite Document Name that does not have a page number.
-            - Double check if you have cited the correct document.
+            # Identical deterministic requests in flight share one generation
+            if self.single_flight is not None and self.single_flight.coalescable(temperature):
+                flight_key = request_key(
+                    messages, session_id=session_id, max_new_tokens=max_new_tokens,
+                    temperature=temperature, top_p=top_p
+                )
+                stream = self.single_flight.join(flight_key, start)
+            else:
+                stream = start()
 
-            ---
+            async for chunk in stream:
+                yield chunk
+        except (asyncio.CancelledError, GeneratorExit):
+            raise
+        except HTTPException:
+            raise
+        except Exception as e:
+            logger.error(f"Generation error: {e}")
+            raise HTTPException(500, f"Generation error: {e}")
+        finally:
+            # Closing the stream stops its generation, or leaves a shared one
+            if stream is not None:
+                await stream.aclose()
 
-            **Answer:**
-            """
+    async def _generate_stream(
+        self,
+        messages: List[Dict],
+        max_new_tokens: int,
+        temperature: float,
+        top_p: float,
+        timeout: Optional[float],
+        session_id: Optional[str],
+        priority: str,
+        cache_key: Optional[str],
+        request_start: float,
+        context_report: Optional[Dict[str, Any]] = None
+    ):
+        """
+        Runs one generation for prepared chat messages on an available model
+        instance and streams it as Server-Sent Events.
 
+        Args:
+            messages (List[Dict]): Chat messages to generate a reply for.
+            max_new_tokens (int): Maximum number of tokens to generate.
+            temperature (float): Sampling temperature; 0 decodes greedily.
+            top_p (float): Top-p sampling threshold.
+            timeout (Optional[float]): Maximum time to wait for a model instance.
+            session_id (Optional[str]): Session whose KV cache is resumed and updated, if any.
+            priority (str): Admission priority class.
+            cache_key (Optional[str]): Response cache key the finished response is stored under.
+            request_start (float): perf_counter() time the request was received.
+            context_report (Optional[Dict[str, Any]]): What context assembly kept and dropped,
+                                                       reported in the metrics event.
 
-            user_message = user_message if context else query
-            messages = [
-                {"role": "system", "content": agentic_prompt},
-                {"role": "system", "content": f"Message history: {history_messages}"},
-                # {"role": "system", "content": f"Context Information: {context}"},
-                {"role": "user", "content": user_message}
-            ]
-            logger.info(f"Generating text for messages: {messages}")
+        Yields:
+            str: Generated text chunks and metrics as Server-Sent Events (SSE).
+        """
+        use_session = session_id is not None
+        model_instance = None
+        worker_request = None
+        streamer = None
+        cancel_token = CancellationToken()
+        generation_done = None  # set once the instance has stopped decoding for this request
+        try:
+            # Prepare inputs using tokenizer; the prompt length is known before routing
+            tokenize_start = time_module.perf_counter()
+            input_ids = self.prompt_assembler.encode(messages)
+            prompt_tokens = input_ids['input_ids'].shape[-1]
+            tokenize_seconds = time_module.perf_counter() - tokenize_start
 
-            # Prepare inputs using tokenizer
-            input_ids = self.tokenizer.apply_chat_template(
-                messages, 
-                add_generation_prompt=True, 
-                return_tensors="pt", 
-                return_dict=True
+            queue_start = time_module.perf_counter()
+            model_instance = await self.get_free_model(
+                timeout=timeout,
+                priority=priority,
+                request={
+                    'prompt_tokens': prompt_tokens,
+                    'max_new_tokens': max_new_tokens,
+                    'preferred': self.session_workers.get(session_id) if use_session else None
+                }
             )
-            inputs = {k: v.to(model_instance['model'].device) for k, v in input_ids.items()}
-            streamer = TextIteratorStreamer(
-                self.tokenizer, 
-                skip_prompt=True, 
+            device = model_instance['device']
+            self.metrics.queue_wait.observe(time_module.perf_counter() - queue_start, device=device)
+            self.metrics.tokenization.observe(tokenize_seconds, device=device)
+            scheduler = model_instance.get('scheduler')
+            worker = model_instance['worker']
+            inputs = None
+            cached_tokens = 0
+            if worker is None:
+                inputs = {k: v.to(model_instance['model'].device) for k, v in input_ids.items()}
+                past_key_values, cached_tokens = self._resume_cache(
+                    model_instance, inputs['input_ids'], session_id if use_session else None
+                )
+                logger.debug(f"Reusing {cached_tokens}/{prompt_tokens} prompt tokens from the KV cache")
+
+            streamer = AsyncTextStreamer(
+                self.tokenizer,
+                loop=asyncio.get_running_loop(),
+                skip_prompt=scheduler is None,
+                # A shared batch step loop must never wait on a single slow client
+                max_buffer=self.stream_buffer_size if scheduler is None else None,
                 skip_special_tokens=True
             )
 
-            # Define generation parameters
-            generation_kwargs = {
-                **inputs,
-                'streamer': streamer,
-                'max_new_tokens': max_new_tokens,
-                'temperature': temperature,
-                'top_p': top_p,
-                'do_sample': True,
-                'pad_token_id': self.tokenizer.eos_token_id,
-            }
+            generation_thread = None
+            generation_output = {}
+            speculative = False
+            submitted_at = time_module.perf_counter()
+            if scheduler is not None:
+                # Join the instance's running batch; the scheduler only streams new tokens
+                sequence = scheduler.submit(
+                    inputs['input_ids'],
+                    streamer,
+                    past_key_values=past_key_values,
+                    keep_cache=use_session,
+                    cancel_token=cancel_token,
+                    max_new_tokens=max_new_tokens,
+                    temperature=temperature,
+                    top_p=top_p
+                )
+                generation_done = sequence.done
+                logger.debug(f"Submitted sequence to batch scheduler on {model_instance['device']}")
+            elif worker is not None:
+                # The worker process resolves KV caches, generates and decodes; its text arrives in the streamer
+                speculative = worker.info['draft_model'] and self.speculation.use_draft(device)
+                worker_request = worker.submit(
+                    input_ids['input_ids'][0].tolist(),
+                    streamer,
+                    cancel_token,
+                    max_new_tokens=max_new_tokens,
+                    temperature=temperature,
+                    top_p=top_p,
+                    session_id=session_id if use_session else None,
+                    speculative=speculative
+                )
+                generation_done = worker_request.done
+                logger.debug(f"Submitted request to worker process {worker.info['pid']}")
+                if use_session:
+                    self.session_workers[session_id] = model_instance
+                    self.session_workers.move_to_end(session_id)
+                    while len(self.session_workers) > MAX_SESSION_WORKERS:
+                        self.session_workers.popitem(last=False)
+            else:
+                speculative = model_instance['draft_model'] is not None and self.speculation.use_draft(device)
+                generation_kwargs = self._generation_kwargs(
+                    model_instance, inputs, streamer, cancel_token, max_new_tokens,
+                    temperature, top_p, past_key_values, speculative
+                )
 
-            # Start model generation in a separate thread
-            generation_thread = threading.Thread(
-                target=model_instance['model'].generate, 
-                kwargs=generation_kwargs
-            )
-            generation_thread.start()
-            logger.debug(f"Started generation thread on {model_instance['device']}")
+                generation_done = threading.Event()
 
-            loop = asyncio.get_event_loop()
+                def run_generation():
+                    try:
+                        apply_to_thread(model_instance['cpu'])
+                        generation_output['sequences'] = model_instance['model'].generate(**generation_kwargs)
+                    except Exception as e:
+                        generation_output['error'] = e
+                    finally:
+                        generation_done.set()
+                        # `generate` only ends the stream when it returns; end it on errors too
+                        if 'error' in generation_output:
+                            streamer.end()
 
-            # Define a synchronous function to get the next chunk
-            def get_next_chunk():
-                try:
-                    return next(streamer)
-                except StopIteration:
-                    return None  # Indicate the end of the stream
+                # Start model generation in a separate thread
+                generation_thread = threading.Thread(target=run_generation)
+                generation_thread.start()
+                logger.debug(f"Started generation thread on {model_instance['device']}")
 
-            token_count = 0
             start_time = time_module.perf_counter()
+            chunks = []
 
             # Stream response using an asynchronous generator
-            while True:
-                next_text = await loop.run_in_executor(None, get_next_chunk)
-                if next_text is None:
-                    break
+            async for next_text in streamer:
                 yield f"data: {next_text}\n\n"  # SSE format
-                token_count += 1
+                chunks.append(next_text)
 
             # Ensure the generation thread has finished
-            generation_thread.join()
+            if generation_thread is not None:
+                generation_thread.join()
+                if 'error' in generation_output:
+                    raise generation_output['error']
+            elif worker_request is not None:
+                if worker_request.error is not None:
+                    raise worker_request.error
+                cached_tokens = worker_request.result['cached_tokens']
+            elif sequence.error is not None:
+                raise sequence.error
+
+            if use_session and worker_request is None:
+                self._store_session(session_id, inputs['input_ids'], sequence if scheduler else None,
+                                    generation_output.get('sequences'), past_key_values)
 
-            # Cleanup
+            # Cleanup; allocator caches are trimmed by the memory manager when needed
             del input_ids
             del inputs
-            del streamer
             del generation_thread
 
-            # Force garbage collection
-            gc.collect()
-            torch.cuda.empty_cache()
-
-            # Compute metrics
+            # Compute metrics from token counts, not from streamed text chunks
             end_time = time_module.perf_counter()
+            throughput = self._record_throughput(
+                model_instance, prompt_tokens, cached_tokens, streamer.token_times, submitted_at
+            )
+            self.metrics.request_latency.observe(end_time - request_start, device=device)
             latency = end_time - start_time
-            tokens_per_second = token_count / latency if latency > 0 else 0
+            generated_tokens = throughput['generated_tokens']
+            tokens_per_second = generated_tokens / latency if latency > 0 else 0
 
             # Create metrics dict
             metrics = {
                 "metrics": {
                     "latency": latency,
-                    "tokens": token_count,
-                    "tokens_per_second": tokens_per_second
+                    "tokens": generated_tokens,
+                    "chunks": len(chunks),
+                    "prompt_tokens": prompt_tokens,
+                    "cached_prompt_tokens": cached_tokens,
+                    "tokens_per_second": tokens_per_second,
+                    **throughput
                 }
             }
+            if context_report is not None:
+                metrics["metrics"]["context"] = context_report
+            if speculative:
+                metrics["metrics"]["speculative"] = self.speculation.observe(
+                    device, streamer.num_steps, streamer.num_tokens
+                )
+
+            if cache_key is not None:
+                self.response_cache.put(cache_key, chunks, generated_tokens)
 
             # Send metrics as a JSON string
             yield f"data: {json.dumps(metrics)}\n\n"
-        except asyncio.CancelledError:
-            logger.info("Client disconnected. Releasing model instance.")
+        except (asyncio.CancelledError, GeneratorExit):
+            logger.info("Client disconnected. Stopping generation and releasing model instance.")
             raise  # Ensures the finally block executes
         except HTTPException as he:
             # Re-raise HTTP exceptions to be handled by FastAPI
@@ -314,5 +1370,13 @@ class ParallelModelPool:
             logger.error(f"Generation error: {e}")
             raise HTTPException(500, f"Generation error: {e}")
         finally:
+            # Unblock a generation thread still waiting on the stream buffer
+            if streamer is not None:
+                streamer.close()
+            if worker_request is not None and not worker_request.done.is_set():
+                model_instance['worker'].cancel(worker_request)
+            # Stop a generation that is still decoding before the instance is reused
+            await self._stop_generation(generation_done, cancel_token, max_new_tokens, streamer)
             # Release the model instance back to the queue regardless of success or failure
-            await self.release_model(model_instance)
+            if model_instance is not None:
+                await self.release_model(model_instance)
@@ -0,0 +1,262 @@
+# app/models/prompt_assembler.py
+import logging
+import re
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Sequence
+
+import torch
+from tokenizers import normalizers
+
+logger = logging.getLogger(__name__)
+
+# Text put around a static segment to find where its tokenization does not
+# depend on what surrounds it
+_PROBES = ("", "a", "Z.", "7", " ", "\n", "?", "é", "日本", "x y", "\t", "`", "-", "**")
+
+# Characters of a static core tokenized along with the text before it, for
+# pre-tokenizers that look ahead (e.g. whitespace not followed by a word)
+_LOOKAHEAD_CHARS = 16
+
+
+class _StaticSegment:
+    """
+    A constant prompt text split into a context-sensitive head and tail and a
+    core whose token ids are the same wherever the text appears.
+    """
+    def __init__(self, text: str, head: str, core_ids: List[int], tail: str):
+        self.text = text
+        self.head = head
+        self.core_ids = core_ids
+        self.tail = tail
+
+
+class PromptAssembler:
+    """
+    Tokenizes rendered chat prompts from cached pieces instead of running the
+    tokenizer over the whole text for every request.
+
+    The rendered prompt is split at special tokens, which the tokenizer never
+    merges across. Each plain-text piece is looked up in an LRU cache (system
+    prompts, template scaffolding and history turns repeat across requests).
+    On a miss, registered static texts such as the RAG instruction block are
+    located in the piece and their pre-tokenized core is spliced in, so only
+    the dynamic text around them is tokenized.
+
+    The assembler checks at start-up that it reproduces the tokenizer's output
+    on sample prompts and falls back to plain tokenization otherwise.
+    """
+    def __init__(
+        self,
+        tokenizer,
+        static_texts: Sequence[str] = (),
+        samples: Sequence[List[Dict[str, Any]]] = (),
+        cache_size: int = 4096,
+        max_piece_chars: int = 8192
+    ):
+        """
+        Args:
+            tokenizer: Fast tokenizer of the served model.
+            static_texts (Sequence[str]): Constant texts that appear inside prompts.
+            samples (Sequence[List[Dict[str, Any]]]): Chat messages used to verify the assembler.
+            cache_size (int): Number of plain-text pieces whose token ids are kept.
+            max_piece_chars (int): Longest piece that is cached.
+        """
+        self.tokenizer = tokenizer
+        self.cache_size = cache_size
+        self.max_piece_chars = max_piece_chars
+        self._pieces: "OrderedDict[str, List[int]]" = OrderedDict()
+        self.stats = {
+            'piece_hits': 0,
+            'piece_misses': 0,
+            'static_hits': 0,
+            'static_misses': 0,  # the text before a static core did not end on a token boundary
+            'tokenized_chars': 0,
+            'total_chars': 0,
+        }
+
+        self.enabled = self._splittable()
+        self.segments: List[_StaticSegment] = []
+        if not self.enabled:
+            logger.info("Tokenizer cannot be split at special tokens, prompts are tokenized whole")
+            return
+
+        added_tokens = sorted(tokenizer.added_tokens_encoder, key=len, reverse=True)
+        self._special = re.compile("(" + "|".join(re.escape(token) for token in added_tokens) + ")")
+        self.segments = [
+            segment for segment in (self._prepare_static(text) for text in static_texts if text.strip())
+            if segment is not None
+        ]
+
+        if not all(self._verify(messages) for messages in samples):
+            logger.warning("Assembled prompts differ from the tokenizer's output, prompts are tokenized whole")
+            self.enabled = False
+        self._pieces.clear()
+
+    def _splittable(self) -> bool:
+        """
+        Checks that tokenizing pieces between special tokens separately
+        cannot change the result.
+        """
+        if not getattr(self.tokenizer, "is_fast", False):
+            return False
+        normalizer = self.tokenizer.backend_tokenizer.normalizer
+        if normalizer is not None and not isinstance(normalizer, normalizers.NFC):
+            return False
+        # Added tokens that strip surrounding whitespace change the text of their neighbours
+        return not any(token.lstrip or token.rstrip for token in self.tokenizer.added_tokens_decoder.values())
+
+    def _tokenize(self, text: str) -> List[int]:
+        if not text:
+            return []
+        self.stats['tokenized_chars'] += len(text)
+        return self.tokenizer(text, add_special_tokens=False)['input_ids']
+
+    def _prepare_static(self, text: str) -> Optional[_StaticSegment]:
+        """
+        Finds the core of a static text whose token boundaries hold under
+        every probe context and pre-tokenizes it.
+        """
+        encoding = self.tokenizer(text, add_special_tokens=False, return_offsets_mapping=True)
+        boundaries = {start for start, _ in encoding['offset_mapping']}
+        cores = []
+        for probe in _PROBES:
+            probed = self.tokenizer(probe + text + probe, add_special_tokens=False, return_offsets_mapping=True)
+            spans = [
+                (start - len(probe), end - len(probe), token_id)
+                for (start, end), token_id in zip(probed['offset_mapping'], probed['input_ids'])
+            ]
+            boundaries &= {start for start, _, _ in spans}
+            cores.append(spans)
+
+        stable = sorted(boundary for boundary in boundaries if 0 < boundary < len(text))
+        if len(stable) < 2:
+            return None
+        head_end, tail_start = stable[0], stable[-1]
+
+        core_ids = self.tokenizer(text[head_end:tail_start], add_special_tokens=False)['input_ids']
+        for spans in cores:
+            probed_core = [token_id for start, end, token_id in spans if start >= head_end and end <= tail_start]
+            if probed_core != core_ids:
+                return None
+        return _StaticSegment(text, text[:head_end], core_ids, text[tail_start:])
+
+    def _tokenize_before(self, text: str, following: str) -> Optional[List[int]]:
+        """
+        Tokenizes text that a static core follows, letting the pre-tokenizer
+        see the core's first characters.
+
+        Returns:
+            Optional[List[int]]: The ids of `text`, or None when a token would
+            span the end of `text`.
+        """
+        if not text:
+            return []
+        self.stats['tokenized_chars'] += len(text)
+        encoding = self.tokenizer(
+            text + following[:_LOOKAHEAD_CHARS],
+            add_special_tokens=False,
+            return_offsets_mapping=True
+        )
+        ids = []
+        for (start, end), token_id in zip(encoding['offset_mapping'], encoding['input_ids']):
+            if end <= len(text):
+                ids.append(token_id)
+            elif start < len(text):
+                return None
+        return ids
+
+    def _encode_piece(self, piece: str) -> List[int]:
+        """
+        Tokenizes text between special tokens, splicing in static segments.
+        """
+        ids = self._pieces.get(piece)
+        if ids is not None:
+            self._pieces.move_to_end(piece)
+            self.stats['piece_hits'] += 1
+            return ids
+        self.stats['piece_misses'] += 1
+
+        ids = []
+        pending = ""
+        position = 0
+        while True:
+            found = None
+            for segment in self.segments:
+                start = piece.find(segment.text, position)
+                if start >= 0 and (found is None or start < found[0]):
+                    found = (start, segment)
+            if found is None:
+                break
+            start, segment = found
+            core_start = start + len(segment.head)
+            before = self._tokenize_before(pending + piece[position:core_start], piece[core_start:])
+            if before is None:
+                # Keep the core's text for plain tokenization with what follows
+                self.stats['static_misses'] += 1
+                pending += piece[position:start + len(segment.text)]
+            else:
+                ids.extend(before)
+                ids.extend(segment.core_ids)
+                self.stats['static_hits'] += 1
+                pending = segment.tail
+            position = start + len(segment.text)
+        ids.extend(self._tokenize(pending + piece[position:]))
+
+        if len(piece) <= self.max_piece_chars:
+            self._pieces[piece] = ids
+            if len(self._pieces) > self.cache_size:
+                self._pieces.popitem(last=False)
+        return ids
+
+    def encode_text(self, text: str) -> List[int]:
+        """
+        Tokenizes a rendered prompt; equivalent to the tokenizer without added special tokens.
+        """
+        self.stats['total_chars'] += len(text)
+        if not self.enabled:
+            return self._tokenize(text)
+
+        ids = []
+        added_tokens = self.tokenizer.added_tokens_encoder
+        for piece in self._special.split(text):
+            if not piece:
+                continue
+            token_id = added_tokens.get(piece)
+            if token_id is not None:
+                ids.append(token_id)
+            else:
+                ids.extend(self._encode_piece(piece))
+        return ids
+
+    def encode(self, messages: List[Dict[str, Any]]) -> Dict[str, torch.Tensor]:
+        """
+        Renders and tokenizes chat messages like `apply_chat_template(..., return_dict=True)`.
+
+        Args:
+            messages (List[Dict[str, Any]]): Chat messages.
+
+        Returns:
+            Dict[str, torch.Tensor]: 'input_ids' and 'attention_mask' of shape (1, seq_len).
+        """
+        text = self.tokenizer.apply_chat_template(messages, add_generation_prompt=True, tokenize=False)
+        input_ids = torch.tensor([self.encode_text(text)], dtype=torch.long)
+        return {'input_ids': input_ids, 'attention_mask': torch.ones_like(input_ids)}
+
+    def _verify(self, messages: List[Dict[str, Any]]) -> bool:
+        text = self.tokenizer.apply_chat_template(messages, add_generation_prompt=True, tokenize=False)
+        # Twice, so both the piece cache miss and hit paths are checked
+        expected = self.tokenizer(text, add_special_tokens=False)['input_ids']
+        return self.encode_text(text) == expected and self.encode_text(text) == expected
+
+    def metrics(self) -> Dict[str, Any]:
+        """
+        Returns cache counters and the share of prompt text that was actually tokenized.
+        """
+        total = self.stats['total_chars']
+        return {
+            "enabled": self.enabled,
+            "static_segments": len(self.segments),
+            "cached_pieces": len(self._pieces),
+            **self.stats,
+            "tokenized_share": self.stats['tokenized_chars'] / total if total else 0.0,
+        }
@@ -0,0 +1,91 @@
+# app/models/quantization.py
+import hashlib
+import json
+import logging
+import os
+import time as time_module
+from typing import Optional
+
+import torch
+import transformers
+from transformers import AutoConfig, AutoModelForCausalLM
+
+logger = logging.getLogger(__name__)
+
+CPU_QUANTIZATION_MODES = ("int8",)
+
+
+def _cache_key(model_path: str) -> str:
+    """
+    Identifies a quantized checkpoint: the model's config and files, and the
+    library versions whose pickled modules the cache holds.
+    """
+    sha = hashlib.sha256()
+    config = AutoConfig.from_pretrained(model_path)
+    sha.update(config.to_json_string().encode("utf-8"))
+    if os.path.isdir(model_path):
+        for name in sorted(os.listdir(model_path)):
+            stat = os.stat(os.path.join(model_path, name))
+            sha.update(f"{name}:{stat.st_size}:{stat.st_mtime_ns}".encode("utf-8"))
+    sha.update(json.dumps([
+        model_path, torch.__version__, transformers.__version__, torch.backends.quantized.engine
+    ]).encode("utf-8"))
+    return sha.hexdigest()[:32]
+
+
+def quantize_int8(model):
+    """
+    Replaces every linear layer with an int8 dynamically quantized one: weights
+    are stored as int8 and activations are quantized on the fly per batch.
+    Embeddings and norms stay in float32.
+    """
+    return torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+
+def load_int8_model(model_path: str, cache_dir: Optional[str] = None):
+    """
+    Loads a model for CPU inference with int8 dynamically quantized linear layers.
+
+    Quantizing requires the float32 weights and takes a while for larger
+    models, so the quantized model is kept in `cache_dir` and later starts
+    load it directly. The cache holds pickled modules and must only be
+    shared between trusted processes.
+
+    Args:
+        model_path (str): Path or name of the pretrained model.
+        cache_dir (Optional[str]): Directory of quantized models; None disables the disk cache.
+
+    Returns:
+        The quantized model, in eval mode.
+    """
+    cache_path = None
+    if cache_dir:
+        cache_path = os.path.join(cache_dir, f"{_cache_key(model_path)}.int8.pt")
+        if os.path.exists(cache_path):
+            start = time_module.perf_counter()
+            try:
+                model = torch.load(cache_path, weights_only=False)
+                logger.info(f"Loaded int8 model from {cache_path} in {time_module.perf_counter() - start:.1f}s")
+                return model
+            except Exception as e:
+                logger.warning(f"Ignoring unreadable quantized model cache {cache_path}: {e}")
+
+    start = time_module.perf_counter()
+    # Dynamic quantization works on float32 weights
+    model = AutoModelForCausalLM.from_pretrained(model_path, torch_dtype=torch.float32, low_cpu_mem_usage=True)
+    model.eval()
+    model.requires_grad_(False)
+    model = quantize_int8(model)
+    logger.info(f"Quantized {model_path} to int8 in {time_module.perf_counter() - start:.1f}s")
+
+    if cache_path is not None:
+        try:
+            os.makedirs(cache_dir, exist_ok=True)
+            partial_path = f"{cache_path}.{os.getpid()}.tmp"
+            torch.save(model, partial_path)
+            # Concurrent loaders may race; whichever file lands last is complete
+            os.replace(partial_path, cache_path)
+            logger.info(f"Cached int8 model at {cache_path}")
+        except OSError as e:
+            logger.warning(f"Could not cache the int8 model in {cache_dir}: {e}")
+    return model
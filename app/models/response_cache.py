@@ -0,0 +1,125 @@
+# app/models/response_cache.py
+import hashlib
+import json
+import logging
+import re
+import time as time_module
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+def _normalize(text: str) -> str:
+    # Leading/trailing and repeated whitespace do not change what a prompt asks for
+    return re.sub(r"\s+", " ", text).strip()
+
+
+def request_key(messages: List[Dict[str, Any]], **params) -> str:
+    """
+    Builds the key identifying a request's output: a hash of the normalized
+    chat messages and the parameters that change what is generated.
+
+    Args:
+        messages (List[Dict[str, Any]]): Chat messages sent to the model.
+        params: Generation parameters, e.g. max_new_tokens and temperature.
+    """
+    normalized = [
+        {field: _normalize(value) if isinstance(value, str) else value for field, value in message.items()}
+        for message in messages
+    ]
+    payload = json.dumps({'messages': normalized, 'params': params}, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """
+    Exact-match cache of complete responses, keyed on the normalized chat
+    messages and the sampling parameters.
+
+    Only requests whose temperature is at most `max_temperature` are cached,
+    so a replayed answer is one the model would (near-)deterministically have
+    produced again. Entries expire after `ttl` seconds and the least recently
+    used ones are evicted to stay under `max_bytes`.
+    """
+    def __init__(self, max_bytes: int, ttl: float = 300.0, max_temperature: float = 0.0):
+        """
+        Args:
+            max_bytes (int): Memory cap of the stored response text.
+            ttl (float): Seconds an entry stays valid.
+            max_temperature (float): Highest temperature whose responses are cached;
+                                     0 caches greedy requests only.
+        """
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.max_temperature = max_temperature
+        self.entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self.total_bytes = 0
+        self.stats = {'hits': 0, 'misses': 0, 'stores': 0, 'evictions': 0, 'expirations': 0}
+
+    def cacheable(self, temperature: float) -> bool:
+        return temperature <= self.max_temperature
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """
+        Returns a live entry and marks it as recently used.
+        """
+        entry = self.entries.get(key)
+        if entry is not None and time_module.monotonic() - entry['stored_at'] > self.ttl:
+            self.pop(key)
+            self.stats['expirations'] += 1
+            entry = None
+        if entry is None:
+            self.stats['misses'] += 1
+            return None
+        self.entries.move_to_end(key)
+        self.stats['hits'] += 1
+        return entry
+
+    def put(self, key: str, chunks: List[str], generated_tokens: int):
+        """
+        Stores a finished response, evicting the least recently used entries
+        until the cache fits under its memory cap.
+
+        Args:
+            key (str): Cache key from `request_key`.
+            chunks (List[str]): Streamed text chunks, in order.
+            generated_tokens (int): Tokens the response took to generate.
+        """
+        self.pop(key)
+        nbytes = sum(len(chunk.encode("utf-8")) for chunk in chunks)
+        if nbytes > self.max_bytes:
+            logger.debug(f"Response ({nbytes} bytes) exceeds the response cache cap, not stored")
+            return
+
+        self.entries[key] = {
+            'chunks': chunks,
+            'generated_tokens': generated_tokens,
+            'nbytes': nbytes,
+            'stored_at': time_module.monotonic()
+        }
+        self.total_bytes += nbytes
+        self.stats['stores'] += 1
+        while self.total_bytes > self.max_bytes:
+            evicted_key, _ = next(iter(self.entries.items()))
+            self.pop(evicted_key)
+            self.stats['evictions'] += 1
+
+    def pop(self, key: str):
+        """
+        Removes an entry, if present.
+        """
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.total_bytes -= entry['nbytes']
+
+    def metrics(self) -> Dict[str, Any]:
+        """
+        Returns occupancy and hit counters.
+        """
+        return {
+            "entries": len(self.entries),
+            "bytes": self.total_bytes,
+            "max_bytes": self.max_bytes,
+            **self.stats,
+        }
@@ -0,0 +1,139 @@
+# app/models/single_flight.py
+import asyncio
+import logging
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional
+
+from fastapi import HTTPException
+
+logger = logging.getLogger(__name__)
+
+
+class InFlightGeneration:
+    """
+    One running generation whose output stream any number of subscribers
+    follow. Every produced chunk is kept, so a subscriber that joins late
+    first receives everything produced so far and then follows live.
+
+    The generation runs in its own task, so it outlives the subscriber that
+    started it; it is cancelled once the last subscriber has gone.
+    """
+    def __init__(self, key: str, stream: AsyncIterator[str], on_done: Callable[["InFlightGeneration"], None]):
+        """
+        Args:
+            key (str): Request key the generation is registered under.
+            stream (AsyncIterator[str]): The generation's output stream.
+            on_done (Callable): Called once the stream has ended, failed or was cancelled.
+        """
+        self.key = key
+        self.chunks: List[str] = []
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self.subscribers = 0
+        self._changed = asyncio.Event()
+        self._on_done = on_done
+        self.task = asyncio.create_task(self._run(stream))
+
+    def _notify(self):
+        # Wakes every current waiter; later waiters wait for the next change
+        self._changed.set()
+        self._changed.clear()
+
+    async def _run(self, stream: AsyncIterator[str]):
+        try:
+            async for chunk in stream:
+                self.chunks.append(chunk)
+                self._notify()
+        except asyncio.CancelledError:
+            self.error = HTTPException(503, "Generation was cancelled.")
+            raise
+        except Exception as e:
+            self.error = e
+        finally:
+            await stream.aclose()
+            self.done = True
+            self._on_done(self)
+            self._notify()
+
+    async def subscribe(self) -> AsyncIterator[str]:
+        """
+        Yields the generation's chunks from the first one, then live until it ends.
+
+        Raises:
+            Exception: The error the generation failed with, for every subscriber.
+        """
+        self.subscribers += 1
+        index = 0
+        try:
+            while True:
+                while index < len(self.chunks):
+                    yield self.chunks[index]
+                    index += 1
+                if self.done:
+                    if self.error is not None:
+                        raise self.error
+                    return
+                await self._changed.wait()
+        finally:
+            self.subscribers -= 1
+            if self.subscribers == 0 and not self.done:
+                logger.debug("Last subscriber left, cancelling the shared generation")
+                self.task.cancel()
+
+
+class SingleFlight:
+    """
+    Coalesces identical in-flight requests: the first one starts a
+    generation and later ones with the same key subscribe to it instead of
+    taking another instance.
+
+    Only deterministic requests (temperature at most `max_temperature`) are
+    coalesced, since every subscriber receives the same output.
+    """
+    def __init__(self, max_temperature: float = 0.0):
+        """
+        Args:
+            max_temperature (float): Highest temperature whose requests are coalesced;
+                                     0 coalesces greedy requests only.
+        """
+        self.max_temperature = max_temperature
+        self.flights: Dict[str, InFlightGeneration] = {}
+        self.stats = {'started': 0, 'joined': 0}
+
+    def coalescable(self, temperature: float) -> bool:
+        return temperature <= self.max_temperature
+
+    def join(self, key: str, start: Callable[[], AsyncIterator[str]]) -> AsyncIterator[str]:
+        """
+        Subscribes to the in-flight generation for `key`, starting it if needed.
+
+        Args:
+            key (str): Request key, see `request_key`.
+            start (Callable[[], AsyncIterator[str]]): Creates the generation stream
+                                                      when no identical request is in flight.
+
+        Returns:
+            AsyncIterator[str]: The subscriber's view of the shared stream.
+        """
+        flight = self.flights.get(key)
+        if flight is None:
+            flight = InFlightGeneration(key, start(), on_done=self._finished)
+            self.flights[key] = flight
+            self.stats['started'] += 1
+        else:
+            self.stats['joined'] += 1
+            logger.debug(f"Joined in-flight generation after {len(flight.chunks)} chunks")
+        return flight.subscribe()
+
+    def _finished(self, flight: InFlightGeneration):
+        if self.flights.get(flight.key) is flight:
+            del self.flights[flight.key]
+
+    def metrics(self) -> Dict[str, Any]:
+        """
+        Returns the number of generations in flight and coalescing counters.
+        """
+        return {
+            "in_flight": len(self.flights),
+            "subscribers": sum(flight.subscribers for flight in self.flights.values()),
+            **self.stats,
+        }
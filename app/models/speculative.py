@@ -0,0 +1,116 @@
+# app/models/speculative.py
+import logging
+from typing import Any, Dict
+
+logger = logging.getLogger(__name__)
+
+
+class DraftAcceptance:
+    """
+    Tracks how many draft tokens the target model accepts, per device, and
+    switches speculative decoding off where it does not pay.
+
+    With a constant number of draft tokens per step, each target forward pass
+    yields the accepted draft tokens plus one token of its own, so a finished
+    request's acceptance follows from its generated tokens and decoding steps.
+    Once a device's smoothed acceptance falls below `min_acceptance`, its
+    requests run without the draft model; after `retry_after` such requests
+    speculation is tried again, since acceptance depends on the workload.
+    """
+    def __init__(
+        self,
+        num_draft_tokens: int = 5,
+        min_acceptance: float = 0.3,
+        smoothing: float = 0.2,
+        warmup_requests: int = 4,
+        retry_after: int = 50
+    ):
+        """
+        Args:
+            num_draft_tokens (int): Tokens the draft model proposes per step.
+            min_acceptance (float): Smoothed acceptance rate below which speculation is turned off.
+            smoothing (float): Weight of the newest request in the smoothed acceptance rate.
+            warmup_requests (int): Speculative requests observed before speculation can be turned off.
+            retry_after (int): Requests served without the draft model before trying it again.
+        """
+        self.num_draft_tokens = num_draft_tokens
+        self.min_acceptance = min_acceptance
+        self.smoothing = smoothing
+        self.warmup_requests = warmup_requests
+        self.retry_after = retry_after
+        self.devices: Dict[str, Dict[str, Any]] = {}
+
+    def _device_stats(self, device: str) -> Dict[str, Any]:
+        return self.devices.setdefault(device, {
+            'acceptance_rate': None,
+            'requests': 0,
+            'observed': 0,  # speculative requests since speculation was last turned on
+            'fallback_requests': 0,
+            'fallback_remaining': 0,
+            'fallbacks': 0,
+            'draft_tokens': 0,
+            'accepted_tokens': 0,
+        })
+
+    def use_draft(self, device: str) -> bool:
+        """
+        Decides whether the next request on `device` decodes speculatively.
+        """
+        stats = self._device_stats(device)
+        if stats['fallback_remaining'] > 0:
+            stats['fallback_remaining'] -= 1
+            stats['fallback_requests'] += 1
+            if stats['fallback_remaining'] == 0:
+                logger.info(f"Retrying speculative decoding on {device}")
+                stats['observed'] = 0
+                stats['acceptance_rate'] = None
+            return False
+        return True
+
+    def observe(self, device: str, steps: int, generated_tokens: int) -> Dict[str, Any]:
+        """
+        Records a finished speculative request.
+
+        Args:
+            device (str): Device that served the request.
+            steps (int): Target model decoding steps, i.e. streamer updates.
+            generated_tokens (int): Tokens generated over those steps.
+
+        Returns:
+            Dict[str, Any]: The request's draft, accepted tokens and acceptance rate.
+        """
+        stats = self._device_stats(device)
+        draft_tokens = steps * self.num_draft_tokens
+        accepted_tokens = max(generated_tokens - steps, 0)
+        if draft_tokens == 0:
+            return {"draft_tokens": 0, "accepted_tokens": 0, "acceptance_rate": None}
+        rate = min(accepted_tokens / draft_tokens, 1.0)
+
+        stats['requests'] += 1
+        stats['observed'] += 1
+        stats['draft_tokens'] += draft_tokens
+        stats['accepted_tokens'] += accepted_tokens
+        previous = stats['acceptance_rate']
+        stats['acceptance_rate'] = rate if previous is None else (1 - self.smoothing) * previous + self.smoothing * rate
+
+        if stats['observed'] >= self.warmup_requests and stats['acceptance_rate'] < self.min_acceptance:
+            logger.warning(
+                f"Draft acceptance on {device} is {stats['acceptance_rate']:.2f}, "
+                f"decoding without the draft model for {self.retry_after} requests"
+            )
+            stats['fallback_remaining'] = self.retry_after
+            stats['fallbacks'] += 1
+        return {"draft_tokens": draft_tokens, "accepted_tokens": accepted_tokens, "acceptance_rate": rate}
+
+    def metrics(self) -> Dict[str, Any]:
+        """
+        Returns per-device acceptance and fallback counters.
+        """
+        return {
+            "num_draft_tokens": self.num_draft_tokens,
+            "min_acceptance": self.min_acceptance,
+            "devices": {
+                device: {**stats, "speculating": stats['fallback_remaining'] == 0}
+                for device, stats in self.devices.items()
+            },
+        }
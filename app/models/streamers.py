@@ -0,0 +1,179 @@
+# app/models/streamers.py
+import asyncio
+import threading
+import time as time_module
+from typing import List, Optional
+
+from transformers import TextStreamer
+
+# A UTF-8 character has at most 4 bytes, so it is complete within as many
+# tokens; text still ending in U+FFFD after that is invalid and emitted as is
+MAX_PENDING_TOKENS = 4
+
+
+class IncrementalDetokenizer:
+    """
+    Turns a stream of token ids into text at a constant cost per token.
+
+    `TextStreamer` decodes every token since the last line break on each
+    step, so the cost of a token grows with the length of its line. Here only
+    a short window is decoded: the tokens of the previous step, whose text is
+    already emitted, followed by the new ones. The difference between the two
+    decodes is the new text, including spaces or merges that depend on the
+    preceding token. Text that ends in an incomplete UTF-8 sequence is held
+    back until the following tokens complete the character.
+    """
+    def __init__(self, tokenizer, **decode_kwargs):
+        """
+        Args:
+            tokenizer: Tokenizer used to decode the ids.
+            decode_kwargs: Passed on to `tokenizer.decode`.
+        """
+        self.tokenizer = tokenizer
+        self.decode_kwargs = decode_kwargs
+        self.token_ids: List[int] = []
+        self.prefix_offset = 0  # start of the decoded window
+        self.read_offset = 0  # end of the tokens whose text was emitted
+
+    def _decode(self, start: int, end: Optional[int] = None) -> str:
+        return self.tokenizer.decode(self.token_ids[start:end], **self.decode_kwargs)
+
+    def push(self, token_ids: List[int]) -> str:
+        """
+        Adds generated ids and returns the text they complete, possibly empty.
+        """
+        self.token_ids.extend(token_ids)
+        prefix_text = self._decode(self.prefix_offset, self.read_offset)
+        end = len(self.token_ids)
+        text = self._decode(self.prefix_offset)
+        if text.endswith("\ufffd"):
+            # Emit up to the last complete character and hold back the tokens of an
+            # unfinished one; a push may carry both
+            for tail in range(1, min(MAX_PENDING_TOKENS, end - self.read_offset + 1)):
+                head_text = self._decode(self.prefix_offset, end - tail)
+                if not head_text.endswith("\ufffd"):
+                    end, text = end - tail, head_text
+                    break
+        if end == self.read_offset:
+            return ""
+        self.prefix_offset = self.read_offset
+        self.read_offset = end
+        return text[len(prefix_text):]
+
+    def flush(self) -> str:
+        """
+        Returns whatever text is still held back, at the end of the stream.
+        """
+        text = self._decode(self.prefix_offset)[len(self._decode(self.prefix_offset, self.read_offset)):]
+        self.prefix_offset = self.read_offset = len(self.token_ids)
+        return text
+
+
+class AsyncTextStreamer(TextStreamer):
+    """
+    Streamer that a generation thread pushes decoded text into and an asyncio
+    consumer reads with `async for`, without a thread-pool hop per chunk.
+
+    Generated ids are decoded with an `IncrementalDetokenizer`, so each token's
+    text is emitted as soon as it is complete.
+
+    Chunks are handed to the event loop with `loop.call_soon_threadsafe`. At
+    most `max_buffer` chunks are waiting at any time; beyond that the
+    generation thread blocks until the consumer catches up, or until the
+    streamer is closed.
+    """
+    _END = object()
+
+    def __init__(
+        self,
+        tokenizer,
+        loop: asyncio.AbstractEventLoop,
+        skip_prompt: bool = False,
+        max_buffer: Optional[int] = 64,
+        **decode_kwargs
+    ):
+        """
+        Args:
+            tokenizer: Tokenizer used to decode the generated ids.
+            loop (asyncio.AbstractEventLoop): Event loop the consumer runs on.
+            skip_prompt (bool): Skip the first `put`, which `generate` uses for the prompt.
+            max_buffer (Optional[int]): Maximum number of chunks waiting for the consumer,
+                                        None for an unbounded buffer that never blocks.
+            decode_kwargs: Passed on to `tokenizer.decode`.
+        """
+        super().__init__(tokenizer, skip_prompt, **decode_kwargs)
+        self.detokenizer = IncrementalDetokenizer(tokenizer, **decode_kwargs)
+        self.loop = loop
+        self.text_queue: asyncio.Queue = asyncio.Queue()
+        self._space = threading.Semaphore(max_buffer) if max_buffer else None
+        self._closed = threading.Event()
+        self.num_tokens = 0  # generated tokens received, excluding the prompt
+        self.num_steps = 0  # puts of generated tokens; fewer than tokens with speculative decoding
+        self.token_times: List[float] = []  # perf_counter() arrival time of each generated token
+
+    def put(self, value):
+        """
+        Receives token ids from the generation thread.
+        """
+        if len(value.shape) > 1:
+            if value.shape[0] > 1:
+                raise ValueError("AsyncTextStreamer only supports batch size 1")
+            value = value[0]
+
+        if self.skip_prompt and self.next_tokens_are_prompt:
+            self.next_tokens_are_prompt = False
+            return
+
+        self.num_tokens += value.numel()
+        self.num_steps += 1
+        self.token_times.extend([time_module.perf_counter()] * value.numel())
+        self.on_finalized_text(self.detokenizer.push(value.tolist()))
+
+    def put_text(self, text: str, num_tokens: int, num_steps: int = 1):
+        """
+        Receives text that was already decoded elsewhere, such as in a worker
+        process, together with the number of tokens it came from.
+        """
+        self.num_tokens += num_tokens
+        self.num_steps += num_steps
+        self.token_times.extend([time_module.perf_counter()] * num_tokens)
+        self.on_finalized_text(text)
+
+    def end(self):
+        """
+        Flushes the remaining text and signals the end of the stream.
+        """
+        self.on_finalized_text(self.detokenizer.flush(), stream_end=True)
+        self.next_tokens_are_prompt = True
+
+    def on_finalized_text(self, text: str, stream_end: bool = False):
+        """
+        Called from the generation thread with each decoded chunk.
+        """
+        if self._closed.is_set():
+            return
+        if text:
+            # Backpressure: wait for the consumer, but never past close()
+            while self._space is not None and not self._space.acquire(timeout=0.1):
+                if self._closed.is_set():
+                    return
+            self.loop.call_soon_threadsafe(self.text_queue.put_nowait, text)
+        if stream_end:
+            self.loop.call_soon_threadsafe(self.text_queue.put_nowait, self._END)
+
+    def close(self):
+        """
+        Stops accepting text, releasing a generation thread blocked on a full buffer.
+        """
+        self._closed.set()
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self) -> str:
+        text = await self.text_queue.get()
+        if text is self._END:
+            raise StopAsyncIteration()
+        if self._space is not None:
+            self._space.release()
+        return text
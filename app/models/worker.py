@@ -0,0 +1,329 @@
+# app/models/worker.py
+import itertools
+import logging
+import multiprocessing
+import os
+import threading
+from typing import Any, Dict, List, Optional
+
+import torch
+from transformers.generation.streamers import BaseStreamer
+
+from app.models.cancellation import CancellationToken
+from app.models.cpu_topology import apply_to_process
+from app.models.streamers import IncrementalDetokenizer
+from app.utils.logging_config import setup_logging
+
+logger = logging.getLogger(__name__)
+
+# Messages are tuples whose first item is one of these kinds
+READY = "ready"  # worker -> pool: (READY, info)
+LOAD_ERROR = "load_error"  # worker -> pool: (LOAD_ERROR, message)
+GENERATE = "generate"  # pool -> worker: (GENERATE, request_id, request)
+CANCEL = "cancel"  # pool -> worker: (CANCEL, request_id)
+STOP = "stop"  # pool -> worker: (STOP,)
+TOKENS = "tokens"  # worker -> pool: (TOKENS, request_id, text, num_tokens, num_steps)
+DONE = "done"  # worker -> pool: (DONE, request_id, result)
+ERROR = "error"  # worker -> pool: (ERROR, request_id, message)
+
+
+class _PipeStreamer(BaseStreamer):
+    """
+    Streamer of a worker's generation: decodes the new tokens of each step and
+    sends their text to the pool.
+    """
+    def __init__(self, tokenizer, send, request_id: int, **decode_kwargs):
+        self.detokenizer = IncrementalDetokenizer(tokenizer, **decode_kwargs)
+        self.send = send
+        self.request_id = request_id
+        self.next_tokens_are_prompt = True
+
+    def put(self, value):
+        if len(value.shape) > 1:
+            value = value[0]
+        # `generate` puts the prompt first
+        if self.next_tokens_are_prompt:
+            self.next_tokens_are_prompt = False
+            return
+        self.send((TOKENS, self.request_id, self.detokenizer.push(value.tolist()), value.numel(), 1))
+
+    def end(self):
+        text = self.detokenizer.flush()
+        if text:
+            self.send((TOKENS, self.request_id, text, 0, 0))
+
+
+def _serve(pool, model_instance: Dict[str, Any], send, request_id: int, request: Dict[str, Any],
+           cancel_token: CancellationToken):
+    """
+    Runs one generation inside the worker, the same way an in-process
+    exclusive instance does.
+    """
+    try:
+        model = model_instance['model']
+        input_ids = torch.tensor([request['input_ids']], device=model.device)
+        inputs = {'input_ids': input_ids, 'attention_mask': torch.ones_like(input_ids)}
+        session_id = request['session_id'] if pool.session_cache is not None else None
+        past_key_values, cached_tokens = pool._resume_cache(model_instance, input_ids, session_id)
+
+        streamer = _PipeStreamer(pool.tokenizer, send, request_id, skip_special_tokens=True)
+        generation_kwargs = pool._generation_kwargs(
+            model_instance, inputs, streamer, cancel_token, request['max_new_tokens'],
+            request['temperature'], request['top_p'], past_key_values,
+            request['speculative'] and model_instance['draft_model'] is not None
+        )
+        sequences = model.generate(**generation_kwargs)
+        if session_id is not None:
+            pool._store_session(session_id, input_ids, None, sequences, past_key_values)
+        send((DONE, request_id, {'cached_tokens': cached_tokens}))
+    except Exception as e:
+        logger.error(f"Generation error in worker: {e}")
+        send((ERROR, request_id, f"{type(e).__name__}: {e}"))
+
+
+def _worker_main(connection, pool_class, pool_kwargs: Dict[str, Any], device: str, tokenizer,
+                 prefix_ids: List[torch.Tensor], cpu: Optional[Dict[str, Any]]):
+    """
+    Entry point of a worker process: loads one instance and serves the
+    requests the pool sends, one at a time.
+    """
+    setup_logging()
+    if cpu:
+        # Before anything starts torch threads, which inherit the affinity
+        apply_to_process(cpu)
+
+    send_lock = threading.Lock()
+
+    def send(message):
+        with send_lock:
+            connection.send(message)
+
+    try:
+        # A pool of the same class loads the instance, so overridden loaders apply
+        pool = pool_class(**pool_kwargs)
+        pool.tokenizer = tokenizer
+        pool._add_instance(device, pool._load_shared(device, prefix_ids))
+        model_instance = pool.model_instances[0]
+    except Exception as e:
+        send((LOAD_ERROR, f"{type(e).__name__}: {e}"))
+        return
+    send((READY, {
+        'pid': os.getpid(),
+        'num_threads': torch.get_num_threads(),
+        'interop_threads': torch.get_num_interop_threads(),
+        'cpu_cores': sorted(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else None,
+        'draft_model': model_instance['draft_model'] is not None,
+    }))
+
+    cancel_tokens: Dict[int, CancellationToken] = {}
+    while True:
+        try:
+            message = connection.recv()
+        except (EOFError, OSError):
+            break  # The pool went away
+        kind = message[0]
+        if kind == GENERATE:
+            _, request_id, request = message
+            cancel_token = cancel_tokens[request_id] = CancellationToken()
+
+            def run(request_id=request_id, request=request, cancel_token=cancel_token):
+                try:
+                    _serve(pool, model_instance, send, request_id, request, cancel_token)
+                finally:
+                    cancel_tokens.pop(request_id, None)
+
+            threading.Thread(target=run, name=f"generate-{request_id}", daemon=True).start()
+        elif kind == CANCEL:
+            cancel_token = cancel_tokens.get(message[1])
+            if cancel_token is not None:
+                cancel_token.cancel()
+        elif kind == STOP:
+            break
+    for cancel_token in list(cancel_tokens.values()):
+        cancel_token.cancel()
+
+
+class WorkerRequest:
+    """
+    A generation running in a worker process, as seen by the pool.
+    """
+    def __init__(self, request_id: int, streamer, cancel_token: CancellationToken):
+        self.request_id = request_id
+        self.streamer = streamer
+        self.cancel_token = cancel_token
+        self.done = threading.Event()  # set once the worker has stopped decoding for this request
+        self.result: Optional[Dict[str, Any]] = None
+        self.error: Optional[Exception] = None
+        self.cancel_sent = False
+
+
+class WorkerProcess:
+    """
+    One model instance running in its own process, so that its decode loop,
+    detokenization and torch threads do not contend with the server's GIL or
+    with the other instances.
+
+    Requests are sent over a pipe as prompt token ids; the worker streams
+    back decoded text with token counts. A reader thread hands that text to
+    each request's `AsyncTextStreamer`, so the pool streams from a worker
+    exactly as it does from an in-process instance.
+    """
+    def __init__(
+        self,
+        pool_class,
+        pool_kwargs: Dict[str, Any],
+        device: str,
+        tokenizer,
+        prefix_ids: List[torch.Tensor],
+        cpu: Optional[Dict[str, Any]] = None
+    ):
+        """
+        Args:
+            pool_class: Pool class the worker builds to load its instance.
+            pool_kwargs (Dict[str, Any]): Arguments of that pool.
+            device (str): Device the instance runs on.
+            tokenizer: Tokenizer of the served model, used for decoding in the worker.
+            prefix_ids (List[torch.Tensor]): Static prompt prefixes whose KV caches are precomputed.
+            cpu (Optional[Dict[str, Any]]): "cores" the worker is pinned to, and its intra-op
+                                            "threads" and "interop_threads"; torch's defaults
+                                            for whatever is missing.
+        """
+        self.pool_class = pool_class
+        self.pool_kwargs = pool_kwargs
+        self.device = device
+        self.tokenizer = tokenizer
+        self.prefix_ids = prefix_ids
+        self.cpu = cpu
+        self.process = None
+        self.connection = None
+        self.info: Dict[str, Any] = {}
+        self.exit_error: Optional[str] = None
+        self.requests: Dict[int, WorkerRequest] = {}
+        self._request_ids = itertools.count()
+        self._send_lock = threading.Lock()
+        self._reader = None
+
+    def start(self) -> Dict[str, Any]:
+        """
+        Starts the worker and waits until its instance is loaded.
+
+        Returns:
+            Dict[str, Any]: What the worker reports: pid, threads, cores and whether it has a draft model.
+
+        Raises:
+            RuntimeError: If the worker fails to load the instance.
+        """
+        # Forking a process that holds CUDA contexts and running threads is unsafe
+        context = multiprocessing.get_context("spawn")
+        self.connection, child_connection = context.Pipe()
+        self.process = context.Process(
+            target=_worker_main,
+            args=(child_connection, self.pool_class, self.pool_kwargs, self.device, self.tokenizer,
+                  self.prefix_ids, self.cpu),
+            name=f"model-worker-{self.device}",
+            daemon=True
+        )
+        self.process.start()
+        child_connection.close()
+
+        while not self.connection.poll(1.0):
+            if not self.process.is_alive():
+                raise RuntimeError(f"Worker process exited with code {self.process.exitcode} while loading")
+        message = self.connection.recv()
+        if message[0] == LOAD_ERROR:
+            self.process.join()
+            raise RuntimeError(message[1])
+        self.info = message[1]
+
+        self._reader = threading.Thread(target=self._read, name=f"worker-reader-{self.info['pid']}", daemon=True)
+        self._reader.start()
+        logger.info(f"Worker process {self.info['pid']} on {self.device} is ready "
+                    f"with {self.info['num_threads']} threads")
+        return self.info
+
+    def _send(self, message):
+        with self._send_lock:
+            self.connection.send(message)
+
+    def submit(self, input_ids: List[int], streamer, cancel_token: CancellationToken, **request) -> WorkerRequest:
+        """
+        Starts a generation in the worker. Its text is pushed into `streamer`,
+        and the returned request's `done` is set once the worker has finished.
+
+        Args:
+            input_ids (List[int]): Prompt token ids.
+            streamer (AsyncTextStreamer): Streamer the generated text is pushed into.
+            cancel_token (CancellationToken): Token that stops the generation once cancelled.
+            request: max_new_tokens, temperature, top_p, session_id and speculative.
+        """
+        if self.exit_error is not None:
+            raise RuntimeError(self.exit_error)
+        worker_request = WorkerRequest(next(self._request_ids), streamer, cancel_token)
+        self.requests[worker_request.request_id] = worker_request
+        self._send((GENERATE, worker_request.request_id, {'input_ids': input_ids, **request}))
+        return worker_request
+
+    def cancel(self, worker_request: WorkerRequest):
+        """
+        Stops a running generation at the worker's next decode step.
+        """
+        worker_request.cancel_token.cancel()
+        with self._send_lock:
+            if worker_request.cancel_sent or worker_request.done.is_set() or self.exit_error is not None:
+                return
+            worker_request.cancel_sent = True
+            self.connection.send((CANCEL, worker_request.request_id))
+
+    def _finish(self, worker_request: WorkerRequest):
+        self.requests.pop(worker_request.request_id, None)
+        # Done before the stream ends, so a consumer reaching the end never sees a running request
+        worker_request.done.set()
+        worker_request.streamer.end()
+
+    def _read(self):
+        """
+        Reader thread: dispatches the worker's messages to their requests.
+        """
+        while True:
+            try:
+                message = self.connection.recv()
+            except (EOFError, OSError):
+                break
+            kind, request_id = message[0], message[1]
+            worker_request = self.requests.get(request_id)
+            if worker_request is None:
+                continue
+            if kind == TOKENS:
+                if worker_request.cancel_token.cancelled:
+                    self.cancel(worker_request)
+                worker_request.streamer.put_text(message[2], message[3], message[4])
+            elif kind == DONE:
+                worker_request.result = message[2]
+                self._finish(worker_request)
+            elif kind == ERROR:
+                worker_request.error = RuntimeError(message[2])
+                self._finish(worker_request)
+
+        self.exit_error = f"Worker process {self.info.get('pid')} on {self.device} exited"
+        if self.requests:
+            logger.error(f"{self.exit_error} with {len(self.requests)} requests in flight")
+        for worker_request in list(self.requests.values()):
+            worker_request.error = RuntimeError(self.exit_error)
+            self._finish(worker_request)
+
+    def stop(self, timeout: float = 5.0):
+        """
+        Stops the worker, cancelling what it is generating.
+        """
+        if self.process is None:
+            return
+        try:
+            if self.process.is_alive():
+                self._send((STOP,))
+        except (OSError, ValueError):
+            pass
+        self.process.join(timeout)
+        if self.process.is_alive():
+            self.process.terminate()
+            self.process.join()
+        self.connection.close()
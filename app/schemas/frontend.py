@@ -1,6 +1,6 @@
 # app/schemas/frontend.py
-from typing import List, Optional, Union, Any, Dict
-from pydantic import BaseModel
+from typing import List, Literal, Optional, Union, Any, Dict
+from pydantic import BaseModel, Field
 
 class FrontendPayload(BaseModel):
     query: str
@@ -10,3 +10,6 @@ class FrontendPayload(BaseModel):
     temperature: float = 0.7
     top_p: float = 0.9
     top_k: Optional[int] = None  # Optional, can be ignored or used if needed
+    max_new_tokens: Optional[int] = Field(None, ge=1)  # Defaults to the backend's limit
+    session_id: Optional[str] = None  # Reuses the conversation's KV cache across turns
+    priority: Literal["high", "normal", "low"] = "normal"  # Admission order when the pool is saturated
@@ -1,5 +1,5 @@
 # app/schemas/llm_request.py
-from typing import List, Optional, Dict
+from typing import List, Literal, Optional, Dict
 from pydantic import BaseModel
 
 class LLMRequest(BaseModel):
@@ -8,3 +8,5 @@ class LLMRequest(BaseModel):
     max_new_tokens: int = 1024
     temperature: float = 0.7
     top_p: float = 0.9
+    session_id: Optional[str] = None
+    priority: Literal["high", "normal", "low"] = "normal"
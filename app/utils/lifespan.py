@@ -2,16 +2,25 @@
 import logging
 from contextlib import asynccontextmanager
 from fastapi import FastAPI
+from ..dependencies import model_pool, trace_recorder
 
 logger = logging.getLogger(__name__)
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     logger.info("Starting application...")
+    # Load models in the background so the server binds right away;
+    # /ready reports instances as they come online
+    model_pool.start_loading()
+    model_pool.memory_manager.start()
     try:
         yield
     except Exception as e:
         logger.error(f"Error during application lifespan: {e}")
         raise e
     finally:
+        await model_pool.memory_manager.stop()
+        model_pool.shutdown()
+        if trace_recorder is not None:
+            trace_recorder.close()
         logger.info("Application stopped.")
@@ -0,0 +1,157 @@
+# app/utils/metrics.py
+import bisect
+import threading
+from typing import Dict, Iterable, List, Sequence, Tuple
+
+# Latency buckets in seconds, from sub-millisecond decode steps to minute-long requests
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels.items()) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value))
+
+
+class Histogram:
+    """
+    Cumulative histogram in the Prometheus text exposition format, with one
+    series per combination of label values.
+    """
+    def __init__(self, name: str, documentation: str, label_names: Sequence[str] = ("device",),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        """
+        Args:
+            name (str): Metric name.
+            documentation (str): Help text.
+            label_names (Sequence[str]): Names of the labels every observation carries.
+            buckets (Sequence[float]): Sorted upper bounds of the buckets; +Inf is implied.
+        """
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(buckets)
+        self._series: Dict[Tuple, Dict] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, count: int = 1, **labels):
+        """
+        Records `count` observations of `value`.
+        """
+        key = tuple(str(labels[name]) for name in self.label_names)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = {
+                    'counts': [0] * (len(self.buckets) + 1),
+                    'sum': 0.0,
+                    'count': 0
+                }
+            series['counts'][bisect.bisect_left(self.buckets, value)] += count
+            series['sum'] += value * count
+            series['count'] += count
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, series in sorted(self._series.items()):
+                labels = dict(zip(self.label_names, key))
+                cumulative = 0
+                for bound, count in zip((*self.buckets, float("inf")), series['counts']):
+                    cumulative += count
+                    bucket_labels = _format_labels({**labels, 'le': _format_value(bound)})
+                    lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+                lines.append(f"{self.name}_sum{_format_labels(labels)} {_format_value(series['sum'])}")
+                lines.append(f"{self.name}_count{_format_labels(labels)} {series['count']}")
+        return lines
+
+
+def _render_samples(name: str, documentation: str, metric_type: str,
+                    samples: Iterable[Tuple[Dict[str, str], float]]) -> List[str]:
+    lines = [f"# HELP {name} {documentation}", f"# TYPE {name} {metric_type}"]
+    for labels, value in samples:
+        lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+    return lines
+
+
+def render_gauge(name: str, documentation: str, samples: Iterable[Tuple[Dict[str, str], float]]) -> List[str]:
+    """
+    Renders a gauge whose values are read at scrape time.
+
+    Args:
+        name (str): Metric name.
+        documentation (str): Help text.
+        samples (Iterable[Tuple[Dict[str, str], float]]): (labels, value) pairs.
+    """
+    return _render_samples(name, documentation, "gauge", samples)
+
+
+def render_counter(name: str, documentation: str, samples: Iterable[Tuple[Dict[str, str], float]]) -> List[str]:
+    """
+    Renders a monotonically increasing counter kept elsewhere, e.g. in the pool.
+
+    Args:
+        name (str): Metric name, ending in `_total`.
+        documentation (str): Help text.
+        samples (Iterable[Tuple[Dict[str, str], float]]): (labels, value) pairs.
+    """
+    return _render_samples(name, documentation, "counter", samples)
+
+
+class ServingMetrics:
+    """
+    Per-device latency histograms of the request path, from admission to the
+    last streamed token.
+    """
+    def __init__(self):
+        self.queue_wait = Histogram(
+            "llm_queue_wait_seconds",
+            "Time a request waited in the admission queue for a model instance."
+        )
+        self.tokenization = Histogram(
+            "llm_tokenization_seconds",
+            "Time spent building and tokenizing the prompt."
+        )
+        self.time_to_first_token = Histogram(
+            "llm_time_to_first_token_seconds",
+            "Time from handing the prompt to an instance until its first generated token (prefill)."
+        )
+        self.inter_token_latency = Histogram(
+            "llm_inter_token_latency_seconds",
+            "Time between two consecutive generated tokens of a request; tokens that arrive "
+            "together are observed once, with the gap divided among them."
+        )
+        self.request_latency = Histogram(
+            "llm_request_latency_seconds",
+            "End-to-end time from receiving a request until its last token was streamed."
+        )
+
+    def histograms(self) -> List[Histogram]:
+        return [
+            self.queue_wait,
+            self.tokenization,
+            self.time_to_first_token,
+            self.inter_token_latency,
+            self.request_latency,
+        ]
+
+    def render(self, gauges: Iterable[List[str]] = ()) -> str:
+        """
+        Renders the histograms and the given gauges and counters in the Prometheus text format.
+        """
+        lines = []
+        for histogram in self.histograms():
+            lines.extend(histogram.render())
+        for gauge in gauges:
+            lines.extend(gauge)
+        return "\n".join(lines) + "\n"
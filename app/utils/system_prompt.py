@@ -590,6 +590,70 @@ Examples
 
 """
 
+# Instructions wrapped around the question and its retrieved context for RAG answers
+rag_user_prompt_template = Template("""
+            Please answer the following question using **only** the provided context and function call responses. **Do not use any external information or your own knowledge.**
+
+            When you reference information from the context or function call responses, you **must** cite the source from the provided metadata by including an inline citation in the format `[Document Name](URL)(Page X)` for documents, or `[Function Name](Reference)` for function calls.
+
+            ### Example of metadata in the retrieved documents:
+
+            {"Subquery-1": {"Source": [{"name": "Resume.pdf", "page":1, "url": "user_data/Candidate/Resume.pdf", "text": "Document Content"}], "Type": "RAG"}}
+
+            The format of the citation becomes `[Resume.pdf](user_data/Candidate/Resume.pdf)(page 1)`
+
+            ### Example of metadata in the function call responses:
+
+            {'Subquery-1': {'Source': [{'FunctionName': [{'name': 'google_search', 'arguments': {'query': '2024 US election', 'num_results': '10'}}], 'Output': 'output of the function call'}], 'Type': 'Action'}}
+
+            The format of the citation becomes `[google_search](query: '2024 US election', num_results: '10')`
+
+            Ensure that the citations are properly formatted as clickable links in Markdown.
+
+            If the context and function call responses do not contain enough information to answer the question, politely inform the user of this limitation.
+
+            ---
+
+            **Question:**
+
+            $query
+
+            ---
+
+            **Context:**
+
+            $context_str
+
+            ---
+
+            **Instructions:**
+
+            - Provide a clear and concise answer to the question.
+            - Do not include any information that is not in the provided context or function call responses.
+            - If the answer cannot be found in the context or function call responses, state that the information is not available.
+            - **Every time** you use information from the context or function call responses, include an inline citation immediately after the information.
+            - Always prioritize the most recent information if there are conflicting information from the context or function call responses.
+
+            **Example:**
+
+            "According to [Resume.pdf](user_data/Candidate/Resume.pdf)(page 1), ..."
+
+            "As provided by [Function Name], ..."
+
+            **Citation Format requirement:**
+            - Citation Format: `[Document Name](URL)(page X)`
+            - Place citation IMMEDIATELY after used information
+            - Use metadata from the context to get the right page number
+                
+            **Validation:**
+            - Don't cite Document Name that does not have a page number.
+            - Double check if you have cited the correct document.
+
+            ---
+
+            **Answer:**
+            """)
+
 tool_prompt = (
     "You are an expert assistant equipped with advanced tool-calling capabilities. "
     "When you receive a response from a tool invocation, you must perform the following steps:\n"
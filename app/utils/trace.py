@@ -0,0 +1,113 @@
+# app/utils/trace.py
+import hashlib
+import json
+import logging
+import os
+import threading
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+def session_hash(session_id: Optional[str]) -> Optional[str]:
+    """
+    Stable pseudonym of a session id, so a trace keeps which requests share a
+    conversation without recording the id itself.
+    """
+    if session_id is None:
+        return None
+    return hashlib.sha256(session_id.encode("utf-8")).hexdigest()[:16]
+
+
+class TraceRecorder:
+    """
+    Appends one JSON line per `/generate` request to a trace file: arrival
+    time, prompt and history sizes, sampling parameters and what was produced.
+    Traces are replayed with `benchmarks/replay.py`.
+
+    By default only sizes are recorded; `include_text` also keeps the query
+    and history so a replay sends the exact prompts.
+    """
+    def __init__(self, path: str, include_text: bool = False):
+        """
+        Args:
+            path (str): Trace file; created if missing and only ever appended to.
+            include_text (bool): Records the query and history text as well as their sizes.
+        """
+        self.path = path
+        self.include_text = include_text
+        self.records = 0
+        self.write_errors = 0
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # Line buffered, so every record reaches the file as one write
+        self._file = open(path, "a", encoding="utf-8", buffering=1)
+
+    def request_entry(self, arrival: float, query: str, history_messages: Optional[List[Dict[str, str]]],
+                      **parameters) -> Dict[str, Any]:
+        """
+        Starts the record of a request; the outcome is added by `record`.
+
+        Args:
+            arrival (float): Unix time the request arrived.
+            query (str): The user query.
+            history_messages (Optional[List[Dict[str, str]]]): Previous messages in the conversation.
+            parameters: Sampling and routing parameters (temperature, top_p,
+                        max_new_tokens, priority, session_id).
+        """
+        history_messages = history_messages or []
+        entry = {
+            "arrival": arrival,
+            "query_chars": len(query),
+            "history_messages": len(history_messages),
+            "history_chars": sum(len(message.get("content") or "") for message in history_messages),
+        }
+        session_id = parameters.pop("session_id", None)
+        entry.update(parameters)
+        entry["session"] = session_hash(session_id)
+        if self.include_text:
+            entry["query"] = query
+            entry["history"] = history_messages
+        return entry
+
+    def record(self, entry: Dict[str, Any], status: int, metrics: Optional[Dict[str, Any]] = None,
+               ttft: Optional[float] = None, latency: Optional[float] = None):
+        """
+        Completes a request's record and appends it to the trace.
+
+        Args:
+            entry (Dict[str, Any]): Record started by `request_entry`.
+            status (int): HTTP status; 499 if the client disconnected mid-stream.
+            metrics (Optional[Dict[str, Any]]): The response's metrics event, if it was sent.
+            ttft (Optional[float]): Seconds from arrival to the first streamed chunk.
+            latency (Optional[float]): Seconds from arrival to the end of the response.
+        """
+        metrics = metrics or {}
+        entry = {
+            **entry,
+            "status": status,
+            "ttft": ttft,
+            "latency": latency,
+            "tokens": metrics.get("tokens"),
+            "prompt_tokens": metrics.get("prompt_tokens"),
+            "cached_prompt_tokens": metrics.get("cached_prompt_tokens"),
+            "cached_response": metrics.get("cached_response", False),
+        }
+        line = json.dumps(entry, ensure_ascii=False) + "\n"
+        with self._lock:
+            try:
+                self._file.write(line)
+                self.records += 1
+            except (OSError, ValueError) as e:
+                # Tracing must never fail a request
+                self.write_errors += 1
+                logger.warning(f"Could not write trace record to {self.path}: {e}")
+
+    def metrics(self) -> Dict[str, Any]:
+        return {"path": self.path, "records": self.records, "write_errors": self.write_errors}
+
+    def close(self):
+        with self._lock:
+            self._file.close()
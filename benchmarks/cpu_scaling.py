@@ -0,0 +1,93 @@
+# benchmarks/cpu_scaling.py
+"""
+Aggregate decoding throughput of CPU instances against their number, with
+the cores partitioned between instances by the CPU topology or left to
+torch's defaults, in-process or in worker processes.
+
+Every configuration runs `benchmarks.serving` in its own subprocess, with
+twice as many concurrent clients as instances so that every instance stays
+busy. Results are printed as JSON, with each run's speedup over a single
+instance of the same configuration.
+
+    python -m benchmarks.cpu_scaling --model meta-llama/Llama-3.2-1B-Instruct --instances 1,2,4,8
+    python -m benchmarks.cpu_scaling --backend fake --instances 1,2,4 --topologies auto,off --workers both
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+
+def run_config(args, instances: int, topology: str, workers: bool) -> dict:
+    pool_kwargs = {"worker_processes": workers}
+    if topology != "auto":
+        pool_kwargs["cpu_topology"] = topology
+    with tempfile.NamedTemporaryFile(suffix=".json") as output_file:
+        command = [
+            sys.executable, "-m", "benchmarks.serving",
+            "--backend", args.backend, "--model", args.model, "--devices", "cpu",
+            "--instances", str(instances),
+            "--concurrency", str(2 * instances),
+            "--requests", str(args.requests_per_instance * instances),
+            "--prompt-length", args.prompt_length,
+            "--output-length", args.output_length,
+            "--temperature", "0.7",
+            "--pool-kwargs", json.dumps(pool_kwargs),
+            "--output", output_file.name,
+        ]
+        subprocess.run(command, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        with open(output_file.name, encoding="utf-8") as report_file:
+            report = json.load(report_file)
+    return {
+        "instances": instances,
+        "topology": topology,
+        "workers": workers,
+        "succeeded": report["succeeded"],
+        "tokens_per_second": report["tokens_per_second"],
+        "ttft_p50": (report["ttft_seconds"] or {}).get("p50"),
+        "inter_token_p50": (report["inter_token_seconds"] or {}).get("p50"),
+        "latency_p95": (report["latency_seconds"] or {}).get("p95"),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--backend", choices=("fake", "model"), default="model")
+    parser.add_argument("--model", default=os.getenv("MODEL_PATH", "meta-llama/Llama-3.2-1B-Instruct"))
+    parser.add_argument("--instances", default="1,2,4", help="comma-separated instance counts")
+    parser.add_argument("--topologies", default="auto,off",
+                        help='comma-separated CPU topologies: "auto", "off", or JSON configs separated by ";"')
+    parser.add_argument("--workers", choices=("no", "yes", "both"), default="no",
+                        help="run instances in-process, in worker processes, or both")
+    parser.add_argument("--requests-per-instance", type=int, default=8)
+    parser.add_argument("--prompt-length", default="fixed:32")
+    parser.add_argument("--output-length", default="fixed:64")
+    args = parser.parse_args()
+
+    counts = [int(count) for count in args.instances.split(",")]
+    topologies = args.topologies.split(";") if args.topologies.lstrip().startswith("{") else args.topologies.split(",")
+    modes = {"no": [False], "yes": [True], "both": [False, True]}[args.workers]
+
+    runs = []
+    for workers in modes:
+        for topology in topologies:
+            baseline = None
+            for count in counts:
+                run = run_config(args, count, topology, workers)
+                if baseline is None:
+                    baseline = run["tokens_per_second"]
+                run["speedup"] = run["tokens_per_second"] / baseline if baseline else None
+                runs.append(run)
+                print(json.dumps(run), file=sys.stderr)
+
+    print(json.dumps({
+        "model": args.model if args.backend == "model" else "fake",
+        "cpus": len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count(),
+        "runs": runs,
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+# benchmarks/fake_backend.py
+"""
+A deterministic stand-in backend for benchmarking the serving path without
+model weights: a byte-level tokenizer built in memory and a tiny randomly
+initialized Llama whose forward pass sleeps for a configurable time.
+
+The model never emits end-of-sequence, so every request generates exactly
+its max_new_tokens and the load shape stays under the benchmark's control.
+"""
+import time as time_module
+
+import torch
+from tokenizers import Tokenizer, decoders, models, pre_tokenizers
+from transformers import LlamaConfig, LlamaForCausalLM, PreTrainedTokenizerFast
+
+from app.models.model_pool import ParallelModelPool
+
+SPECIAL_TOKENS = ["<|bos|>", "<|eos|>", "<|system|>", "<|user|>", "<|assistant|>", "<|end|>"]
+CHAT_TEMPLATE = (
+    "{% for message in messages %}<|{{ message['role'] }}|>{{ message['content'] }}<|end|>{% endfor %}"
+    "{% if add_generation_prompt %}<|assistant|>{% endif %}"
+)
+
+
+def build_tokenizer() -> PreTrainedTokenizerFast:
+    """
+    Byte-level tokenizer with one token per byte and no merges, so a prompt's
+    token count is its UTF-8 length.
+    """
+    alphabet = pre_tokenizers.ByteLevel.alphabet()
+    vocab = {token: index for index, token in enumerate(SPECIAL_TOKENS)}
+    for character in sorted(alphabet):
+        vocab[character] = len(vocab)
+    tokenizer = Tokenizer(models.BPE(vocab=vocab, merges=[]))
+    tokenizer.pre_tokenizer = pre_tokenizers.ByteLevel(add_prefix_space=False, use_regex=False)
+    tokenizer.decoder = decoders.ByteLevel()
+    tokenizer.add_special_tokens(SPECIAL_TOKENS)
+
+    wrapped = PreTrainedTokenizerFast(
+        tokenizer_object=tokenizer,
+        bos_token="<|bos|>",
+        eos_token="<|eos|>",
+        pad_token="<|eos|>",
+        clean_up_tokenization_spaces=False
+    )
+    wrapped.chat_template = CHAT_TEMPLATE
+    return wrapped
+
+
+def build_model(vocab_size: int, eos_token_id: int, token_delay: float, prefill_delay: float,
+                seed: int = 0) -> LlamaForCausalLM:
+    """
+    Tiny Llama whose every forward pass sleeps `token_delay` seconds, plus
+    `prefill_delay` per input token beyond the first, and which never
+    predicts `eos_token_id`.
+    """
+    config = LlamaConfig(
+        vocab_size=vocab_size,
+        hidden_size=32,
+        intermediate_size=64,
+        num_hidden_layers=2,
+        num_attention_heads=4,
+        num_key_value_heads=2,
+        max_position_embeddings=32768,
+        bos_token_id=0,
+        eos_token_id=eos_token_id,
+    )
+    torch.manual_seed(seed)
+    model = LlamaForCausalLM(config)
+    model.eval()
+    model.requires_grad_(False)
+
+    def delay(module, args, kwargs):
+        input_ids = kwargs.get('input_ids', args[0] if args else None)
+        new_tokens = input_ids.shape[-1] if input_ids is not None else 1
+        time_module.sleep(token_delay + prefill_delay * max(new_tokens - 1, 0))
+
+    def suppress_eos(module, args, kwargs, output):
+        output.logits[..., eos_token_id] = torch.finfo(output.logits.dtype).min
+        return output
+
+    model.register_forward_pre_hook(delay, with_kwargs=True)
+    model.register_forward_hook(suppress_eos, with_kwargs=True)
+    return model
+
+
+class FakeBackendPool(ParallelModelPool):
+    """
+    `ParallelModelPool` over the fake tokenizer and model. Everything else
+    (admission, routing, caches, scheduling, streaming) is the real pool.
+    """
+    def __init__(self, *args, token_delay: float = 0.01, prefill_delay: float = 0.0, **kwargs):
+        """
+        Args:
+            token_delay (float): Seconds each forward pass takes, i.e. per decoding step.
+            prefill_delay (float): Additional seconds per prompt token a forward pass processes.
+            args, kwargs: Passed on to `ParallelModelPool`.
+        """
+        super().__init__(*args, **kwargs)
+        self.token_delay = token_delay
+        self.prefill_delay = prefill_delay
+
+    def _worker_kwargs(self, device: str):
+        return {**super()._worker_kwargs(device), 'token_delay': self.token_delay, 'prefill_delay': self.prefill_delay}
+
+    def _load_tokenizer(self):
+        return build_tokenizer()
+
+    def _load_model(self, model_path: str, dtype, device: str):
+        return build_model(
+            len(self.tokenizer), self.tokenizer.eos_token_id, self.token_delay, self.prefill_delay
+        ).to(device)
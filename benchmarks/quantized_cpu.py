@@ -0,0 +1,162 @@
+# benchmarks/quantized_cpu.py
+"""
+Compares CPU instances loaded with full weights against int8 dynamically
+quantized ones: load time, weight memory, resident memory and greedy
+decoding throughput.
+
+Each configuration runs in its own subprocess so that memory figures are not
+skewed by the previous one. Results are printed as JSON.
+
+    python -m benchmarks.quantized_cpu --model meta-llama/Llama-3.2-1B-Instruct --new-tokens 64
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time as time_module
+
+import psutil
+import torch
+
+from app.models.model_pool import ParallelModelPool
+
+DTYPES = {"float32": torch.float32, "float16": torch.float16, "bfloat16": torch.bfloat16}
+
+
+def _weight_bytes(model) -> int:
+    """
+    Bytes of every tensor in the state dict, including packed quantized weights.
+    """
+    def size(value):
+        if isinstance(value, torch.Tensor):
+            return value.numel() * value.element_size()
+        if isinstance(value, (tuple, list)):
+            return sum(size(item) for item in value)
+        return 0
+
+    # Tied weights appear under several names but are stored once
+    seen = set()
+    total = 0
+    for value in model.state_dict().values():
+        if isinstance(value, torch.Tensor):
+            if value.data_ptr() in seen:
+                continue
+            seen.add(value.data_ptr())
+        total += size(value)
+    return total
+
+
+def run_one(args) -> dict:
+    """
+    Loads one configuration through the pool's loader and measures it.
+    """
+    torch.set_num_threads(args.threads)
+    process = psutil.Process()
+    rss_before = process.memory_info().rss
+
+    pool = ParallelModelPool(
+        args.model,
+        num_instances=0,
+        dtype=DTYPES[args.dtype],
+        devices=["cpu"],
+        cpu_quantization=args.quantization,
+        quantized_cache_dir=args.cache_dir
+    )
+    start = time_module.perf_counter()
+    model = pool._load_model(args.model, DTYPES[args.dtype], "cpu")
+    load_seconds = time_module.perf_counter() - start
+
+    # Same prompt length for every configuration, independent of the tokenizer
+    generator = torch.Generator().manual_seed(0)
+    input_ids = torch.randint(3, model.config.vocab_size, (1, args.prompt_tokens), generator=generator)
+    generation_kwargs = {
+        'input_ids': input_ids,
+        'attention_mask': torch.ones_like(input_ids),
+        'max_new_tokens': args.new_tokens,
+        'min_new_tokens': args.new_tokens,
+        'do_sample': False,
+        'pad_token_id': 0,
+    }
+    with torch.inference_mode():
+        model.generate(**{**generation_kwargs, 'max_new_tokens': 2, 'min_new_tokens': 2})  # warm-up
+        prefill_start = time_module.perf_counter()
+        model.generate(**{**generation_kwargs, 'max_new_tokens': 1, 'min_new_tokens': 1})
+        prefill_seconds = time_module.perf_counter() - prefill_start
+
+        runs = []
+        for _ in range(args.repeats):
+            start = time_module.perf_counter()
+            output = model.generate(**generation_kwargs)
+            runs.append((output.shape[-1] - input_ids.shape[-1], time_module.perf_counter() - start))
+
+    # Measured after generating, since memory-mapped weights are only resident once used
+    rss_after = process.memory_info().rss
+    generated = sum(tokens for tokens, _ in runs)
+    seconds = sum(elapsed for _, elapsed in runs)
+    return {
+        "config": args.quantization or args.dtype,
+        "load_seconds": load_seconds,
+        "weight_bytes": _weight_bytes(model),
+        "rss_bytes": rss_after - rss_before,
+        "prefill_seconds": prefill_seconds,
+        "tokens_per_second": generated / seconds if seconds > 0 else 0.0,
+        "generated_tokens": generated,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--model", default=os.getenv("MODEL_PATH", "meta-llama/Llama-3.2-1B-Instruct"))
+    parser.add_argument("--dtype", default="float32", choices=sorted(DTYPES), help="dtype of the unquantized run")
+    parser.add_argument("--prompt-tokens", type=int, default=256)
+    parser.add_argument("--new-tokens", type=int, default=64)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--threads", type=int, default=torch.get_num_threads())
+    parser.add_argument("--cache-dir", default=None,
+                        help="quantized model cache; a temporary directory if unset, so both cold and "
+                             "cached loads are measured")
+    parser.add_argument("--quantization", default=None, help=argparse.SUPPRESS)
+    parser.add_argument("--single", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.single:
+        print(json.dumps(run_one(args)))
+        return
+
+    with tempfile.TemporaryDirectory() as temporary_dir:
+        cache_dir = args.cache_dir or temporary_dir
+        common = [
+            "--model", args.model, "--dtype", args.dtype, "--prompt-tokens", str(args.prompt_tokens),
+            "--new-tokens", str(args.new_tokens), "--repeats", str(args.repeats),
+            "--threads", str(args.threads), "--cache-dir", cache_dir, "--single",
+        ]
+        runs = {}
+        for name, extra in (
+            (args.dtype, []),
+            ("int8", ["--quantization", "int8"]),
+            ("int8_cached", ["--quantization", "int8"]),
+        ):
+            completed = subprocess.run(
+                [sys.executable, "-m", "benchmarks.quantized_cpu", *common, *extra],
+                capture_output=True, text=True, check=True
+            )
+            runs[name] = json.loads(completed.stdout.strip().splitlines()[-1])
+
+    baseline, quantized = runs[args.dtype], runs["int8"]
+    print(json.dumps({
+        "model": args.model,
+        "threads": args.threads,
+        "prompt_tokens": args.prompt_tokens,
+        "new_tokens": args.new_tokens,
+        "runs": runs,
+        "speedup": quantized["tokens_per_second"] / baseline["tokens_per_second"]
+        if baseline["tokens_per_second"] else None,
+        "weight_memory_ratio": quantized["weight_bytes"] / baseline["weight_bytes"],
+        "cached_load_speedup": quantized["load_seconds"] / runs["int8_cached"]["load_seconds"],
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,246 @@
+# benchmarks/replay.py
+"""
+Replays a request trace recorded with TRACE_PATH against a running server and
+compares latency distributions between runs.
+
+Requests are sent at their recorded arrival offsets, divided by --speed, no
+matter how long earlier ones take, so the load shape matches the trace.
+Prompts are rebuilt from the recorded text when the trace has it
+(TRACE_TEXT=true) and otherwise synthesized at the recorded sizes. Sessions
+keep their grouping, and each request asks for as many tokens as it produced
+originally.
+
+    python -m benchmarks.replay run trace.jsonl --url http://localhost:8000 --speed 2 --output run_a.json
+    python -m benchmarks.replay compare run_a.json run_b.json
+
+`compare` also accepts a trace file, whose server-side TTFT and latency are
+then compared to the replay's client-side ones.
+"""
+import argparse
+import asyncio
+import json
+import random
+import time as time_module
+from typing import Any, Dict, List, Optional
+
+import httpx
+
+from benchmarks.serving import WORDS, git_commit, percentiles, summarize_response
+
+METRICS = ("ttft", "inter_token", "latency")
+
+
+def read_trace(path: str, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+    """
+    Reads a trace, skipping a partially written last line, sorted by arrival.
+    """
+    records = []
+    with open(path, encoding="utf-8") as trace_file:
+        for line in trace_file:
+            try:
+                records.append(json.loads(line))
+            except json.JSONDecodeError:
+                continue
+    records.sort(key=lambda record: record["arrival"])
+    return records[:limit] if limit else records
+
+
+def synthesize_text(chars: int, rng: random.Random) -> str:
+    words = []
+    length = 0
+    while length < chars:
+        word = rng.choice(WORDS)
+        words.append(word)
+        length += len(word) + 1
+    return " ".join(words)[:max(chars, 1)]
+
+
+def build_payload(record: Dict[str, Any], index: int, output_tokens: str, run_id: str) -> Dict[str, Any]:
+    """
+    Rebuilds the `/generate` body of one traced request.
+
+    Args:
+        record (Dict[str, Any]): Trace record.
+        index (int): Position of the record in the trace, which seeds synthesized text.
+        output_tokens (str): "recorded" asks for the tokens the request produced,
+                             "limit" for its original max_new_tokens.
+        run_id (str): Prefix of replayed session ids, so runs do not share session caches.
+    """
+    rng = random.Random(index)
+    if "query" in record:
+        query, history = record["query"], record.get("history") or []
+    else:
+        query = synthesize_text(record["query_chars"], rng)
+        history = []
+        turns = record.get("history_messages", 0)
+        for turn in range(turns):
+            history.append({
+                "role": "user" if turn % 2 == 0 else "assistant",
+                "content": synthesize_text(record.get("history_chars", 0) // turns, rng)
+            })
+
+    max_new_tokens = record.get("max_new_tokens")
+    if output_tokens == "recorded" and record.get("tokens"):
+        max_new_tokens = record["tokens"]
+    payload = {
+        "query": query,
+        "history_messages": history or None,
+        "temperature": record.get("temperature", 0.7),
+        "top_p": record.get("top_p", 0.9),
+        "priority": record.get("priority", "normal"),
+    }
+    if max_new_tokens:
+        payload["max_new_tokens"] = max_new_tokens
+    if record.get("session"):
+        payload["session_id"] = f"{run_id}-{record['session']}"
+    return payload
+
+
+async def send(client: httpx.AsyncClient, payload: Dict[str, Any]) -> Dict[str, Any]:
+    result = {"status": None, "chunks": [], "times": [], "start": time_module.perf_counter()}
+    try:
+        async with client.stream("POST", "/generate", json=payload) as response:
+            result["status"] = response.status_code
+            async for chunk in response.aiter_text():
+                result["chunks"].append(chunk)
+                result["times"].append(time_module.perf_counter())
+    except httpx.HTTPError as e:
+        result["error"] = str(e)
+    result["end"] = time_module.perf_counter()
+    return result
+
+
+async def replay(args) -> Dict[str, Any]:
+    records = read_trace(args.trace, args.limit)
+    if not records:
+        raise SystemExit(f"No requests in {args.trace}")
+    run_id = f"replay-{int(time_module.time())}"
+    first_arrival = records[0]["arrival"]
+    results: List[Optional[Dict[str, Any]]] = [None] * len(records)
+
+    limits = httpx.Limits(max_connections=None, max_keepalive_connections=None)
+    async with httpx.AsyncClient(base_url=args.url, timeout=args.timeout, limits=limits) as client:
+        start = time_module.perf_counter()
+
+        async def issue(index: int, record: Dict[str, Any]):
+            scheduled = (record["arrival"] - first_arrival) / args.speed
+            await asyncio.sleep(max(0.0, scheduled - (time_module.perf_counter() - start)))
+            sent_at = time_module.perf_counter() - start
+            response = await send(client, build_payload(record, index, args.output_tokens, run_id))
+            summary = summarize_response(response)
+            results[index] = {
+                "index": index,
+                "scheduled": scheduled,
+                # How far behind schedule the replay itself fell
+                "send_lag": sent_at - scheduled,
+                "recorded_status": record.get("status"),
+                "recorded_ttft": record.get("ttft"),
+                "recorded_latency": record.get("latency"),
+                **summary,
+                "error": response.get("error"),
+            }
+
+        await asyncio.gather(*(issue(index, record) for index, record in enumerate(records)))
+        wall_seconds = time_module.perf_counter() - start
+
+    return {
+        "commit": git_commit(),
+        "trace": args.trace,
+        "url": args.url,
+        "speed": args.speed,
+        "output_tokens": args.output_tokens,
+        "wall_seconds": wall_seconds,
+        "summary": summarize_run(results),
+        "requests": results,
+    }
+
+
+def summarize_run(results: List[Dict[str, Any]]) -> Dict[str, Any]:
+    succeeded = [result for result in results if result["ok"]]
+    statuses: Dict[str, int] = {}
+    for result in results:
+        statuses[str(result["status"])] = statuses.get(str(result["status"]), 0) + 1
+    return {
+        "requests": len(results),
+        "succeeded": len(succeeded),
+        "statuses": statuses,
+        "generated_tokens": sum(result["tokens"] for result in succeeded),
+        "send_lag_seconds": percentiles([result["send_lag"] for result in results]),
+        "ttft_seconds": percentiles([result["ttft"] for result in succeeded if result["ttft"] is not None]),
+        "inter_token_seconds": percentiles([gap for result in succeeded for gap in result["inter_token"]]),
+        "latency_seconds": percentiles([result["latency"] for result in succeeded]),
+    }
+
+
+def load_distributions(path: str) -> Dict[str, Any]:
+    """
+    Latency distributions of a replay report, or of a trace's server-side
+    measurements. Traces have no inter-token gaps.
+    """
+    if path.endswith(".jsonl"):
+        records = [record for record in read_trace(path) if record.get("status") == 200]
+        return {
+            "ttft": percentiles([record["ttft"] for record in records if record.get("ttft") is not None]),
+            "inter_token": None,
+            "latency": percentiles([record["latency"] for record in records if record.get("latency") is not None]),
+        }
+    with open(path, encoding="utf-8") as report_file:
+        summary = json.load(report_file)["summary"]
+    return {metric: summary[f"{metric}_seconds"] for metric in METRICS}
+
+
+def compare(baseline_path: str, candidate_path: str) -> Dict[str, Any]:
+    baseline = load_distributions(baseline_path)
+    candidate = load_distributions(candidate_path)
+    comparison = {}
+    for metric in METRICS:
+        if not baseline[metric] or not candidate[metric]:
+            comparison[metric] = None
+            continue
+        comparison[metric] = {
+            statistic: {
+                "baseline": baseline[metric][statistic],
+                "candidate": candidate[metric][statistic],
+                # Above 1 means the candidate is slower
+                "ratio": candidate[metric][statistic] / baseline[metric][statistic]
+                if baseline[metric][statistic] else None,
+            }
+            for statistic in ("p50", "p95", "p99", "mean")
+        }
+    return {"baseline": baseline_path, "candidate": candidate_path, "comparison": comparison}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="replay a trace against a server")
+    run_parser.add_argument("trace", help="JSONL trace written with TRACE_PATH")
+    run_parser.add_argument("--url", default="http://localhost:8000")
+    run_parser.add_argument("--speed", type=float, default=1.0, help="time scale; 2 sends the trace twice as fast")
+    run_parser.add_argument("--output-tokens", choices=("recorded", "limit"), default="recorded",
+                            help="max_new_tokens: the tokens each request produced, or its original limit")
+    run_parser.add_argument("--limit", type=int, default=None, help="replay only the first N requests")
+    run_parser.add_argument("--timeout", type=float, default=600.0)
+    run_parser.add_argument("--output", default=None, help="write the full report to this file")
+
+    compare_parser = commands.add_parser("compare", help="compare latency distributions of two runs")
+    compare_parser.add_argument("baseline", help="replay report, or a .jsonl trace")
+    compare_parser.add_argument("candidate", help="replay report, or a .jsonl trace")
+
+    args = parser.parse_args()
+    if args.command == "compare":
+        print(json.dumps(compare(args.baseline, args.candidate), indent=2))
+        return
+
+    if args.speed <= 0:
+        parser.error("--speed must be positive")
+    report = asyncio.run(replay(args))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as output_file:
+            json.dump(report, output_file, indent=2)
+    print(json.dumps({key: value for key, value in report.items() if key != "requests"}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,277 @@
+# benchmarks/serving.py
+"""
+Concurrency benchmark of the FastAPI app, driven in-process over ASGI.
+
+A fixed number of clients send `/generate` requests back to back, with
+prompt and output lengths drawn from the configured distributions. The
+backend is either the deterministic fake one (tiny random model that sleeps
+per decoding step) or a real model. Time to first token, inter-token latency
+(the gap between streamed chunks, which may carry several tokens), request
+latency and aggregate tokens/s are printed as JSON, together with the
+configuration and commit, so runs can be compared across commits.
+
+    python -m benchmarks.serving --concurrency 16 --requests 200 --token-delay 0.01
+    python -m benchmarks.serving --backend model --model /path/to/tiny-model --devices cpu
+"""
+import argparse
+import asyncio
+import json
+import random
+import subprocess
+import time as time_module
+from typing import Any, Dict, List, Optional
+
+import torch
+
+WORDS = (
+    "the model pool serves requests from several instances while the scheduler batches decoding steps "
+    "and the cache keeps prefixes of prompts that repeat across conversations"
+).split()
+
+
+def parse_distribution(spec: str):
+    """
+    Parses a length distribution: "fixed:N", "uniform:LOW:HIGH",
+    "normal:MEAN:STD" or "lognormal:MEDIAN:SIGMA". Returns a sampler taking a
+    `random.Random`.
+    """
+    kind, *values = spec.split(":")
+    numbers = [float(value) for value in values]
+    samplers = {
+        "fixed": (1, lambda rng, n: n),
+        "uniform": (2, lambda rng, low, high: rng.uniform(low, high)),
+        "normal": (2, lambda rng, mean, std: rng.gauss(mean, std)),
+        "lognormal": (2, lambda rng, median, sigma: median * rng.lognormvariate(0, sigma)),
+    }
+    if kind not in samplers or len(numbers) != samplers[kind][0]:
+        raise argparse.ArgumentTypeError(f"Invalid length distribution: {spec}")
+    sample = samplers[kind][1]
+    return lambda rng: max(1, int(round(sample(rng, *numbers))))
+
+
+def percentiles(values: List[float]) -> Optional[Dict[str, float]]:
+    if not values:
+        return None
+    ordered = sorted(values)
+
+    def at(fraction: float) -> float:
+        return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+    return {
+        "p50": at(0.50),
+        "p95": at(0.95),
+        "p99": at(0.99),
+        "mean": sum(ordered) / len(ordered),
+        "max": ordered[-1],
+        "count": len(ordered),
+    }
+
+
+async def asgi_post(app, path: str, payload: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Sends one POST straight to the ASGI app and timestamps every body chunk
+    as it is sent, which an HTTP client over a transport would buffer or delay.
+    """
+    body = json.dumps(payload).encode("utf-8")
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "POST",
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode("utf-8"),
+        "query_string": b"",
+        "root_path": "",
+        "headers": [(b"host", b"benchmark"), (b"content-type", b"application/json"),
+                    (b"content-length", str(len(body)).encode("ascii"))],
+        "client": ("127.0.0.1", 0),
+        "server": ("benchmark", 80),
+    }
+    response_done = asyncio.Event()
+    request_sent = False
+
+    async def receive():
+        nonlocal request_sent
+        if not request_sent:
+            request_sent = True
+            return {"type": "http.request", "body": body, "more_body": False}
+        await response_done.wait()
+        return {"type": "http.disconnect"}
+
+    result = {"status": None, "chunks": [], "times": []}
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            result["status"] = message["status"]
+        elif message["type"] == "http.response.body":
+            if message.get("body"):
+                result["chunks"].append(message["body"].decode("utf-8"))
+                result["times"].append(time_module.perf_counter())
+            if not message.get("more_body", False):
+                response_done.set()
+
+    result["start"] = time_module.perf_counter()
+    try:
+        await app(scope, receive, send)
+    finally:
+        response_done.set()
+    result["end"] = time_module.perf_counter()
+    return result
+
+
+def summarize_response(result: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Extracts the timings of one streamed response: SSE text events and the
+    trailing metrics event.
+    """
+    events = []
+    for chunk, arrival in zip(result["chunks"], result["times"]):
+        for event in chunk.split("\n\n"):
+            if event.startswith("data: "):
+                events.append((event[len("data: "):], arrival))
+    metrics = {}
+    if events and events[-1][0].startswith('{"metrics"'):
+        metrics = json.loads(events.pop()[0])["metrics"]
+    arrivals = [arrival for _, arrival in events]
+    return {
+        "ok": result["status"] == 200 and bool(metrics),
+        "status": result["status"],
+        "ttft": arrivals[0] - result["start"] if arrivals else None,
+        "inter_token": [current - previous for previous, current in zip(arrivals, arrivals[1:])],
+        "latency": result["end"] - result["start"],
+        "tokens": metrics.get("tokens", 0),
+        "prompt_tokens": metrics.get("prompt_tokens", 0),
+    }
+
+
+def build_requests(args) -> List[Dict[str, Any]]:
+    rng = random.Random(args.seed)
+    prompt_length = parse_distribution(args.prompt_length)
+    output_length = parse_distribution(args.output_length)
+    requests = []
+    for index in range(args.requests):
+        words = [rng.choice(WORDS) for _ in range(prompt_length(rng))]
+        requests.append({
+            # A unique prefix keeps identical requests from being coalesced or cached
+            "query": f"Request {index}: " + " ".join(words),
+            "max_new_tokens": output_length(rng),
+            "temperature": args.temperature,
+        })
+    return requests
+
+
+def build_pool(args):
+    pool_kwargs = {
+        "num_instances": args.instances,
+        "devices": args.devices.split(",") if args.devices else ["cpu"],
+        "dtype": torch.float32,
+        "scheduling": args.scheduling,
+        "max_batch_size": args.max_batch_size,
+        "max_queue_depth": max(args.concurrency, 64),
+        **json.loads(args.pool_kwargs),
+    }
+    if args.backend == "fake":
+        from benchmarks.fake_backend import FakeBackendPool
+        return FakeBackendPool(
+            "fake", token_delay=args.token_delay, prefill_delay=args.prefill_delay, **pool_kwargs
+        )
+    from app.models.model_pool import ParallelModelPool
+    return ParallelModelPool(args.model, **pool_kwargs)
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def run(args) -> Dict[str, Any]:
+    # The app's routers use the pool from app.dependencies; swap in the
+    # benchmark's pool before they are imported
+    import app.dependencies
+    app.dependencies.model_pool = build_pool(args)
+    from app.main import app as asgi_app
+    pool = app.dependencies.model_pool
+
+    requests = build_requests(args)
+    async with asgi_app.router.lifespan_context(asgi_app):
+        await pool.loading_task
+        if not pool.model_instances:
+            raise RuntimeError(f"No model instance loaded: {pool.load_errors}")
+
+        # Warm-up requests are not measured
+        for request in requests[:args.warmup]:
+            await asgi_post(asgi_app, "/generate", {**request, "query": "warm-up " + request["query"]})
+
+        pending = list(enumerate(requests))
+        responses: List[Optional[Dict[str, Any]]] = [None] * len(requests)
+
+        async def client():
+            while pending:
+                index, request = pending.pop(0)
+                responses[index] = summarize_response(await asgi_post(asgi_app, "/generate", request))
+
+        start = time_module.perf_counter()
+        await asyncio.gather(*(client() for _ in range(args.concurrency)))
+        wall_seconds = time_module.perf_counter() - start
+        pool_status = {"admission": pool.admission.metrics(), "stats": pool.stats}
+
+    succeeded = [response for response in responses if response["ok"]]
+    generated = sum(response["tokens"] for response in succeeded)
+    return {
+        "commit": git_commit(),
+        "config": {key: value for key, value in vars(args).items()},
+        "requests": len(responses),
+        "succeeded": len(succeeded),
+        "failed": {
+            str(status): sum(1 for response in responses if not response["ok"] and response["status"] == status)
+            for status in {response["status"] for response in responses if not response["ok"]}
+        },
+        "wall_seconds": wall_seconds,
+        "generated_tokens": generated,
+        "prompt_tokens": sum(response["prompt_tokens"] for response in succeeded),
+        "tokens_per_second": generated / wall_seconds if wall_seconds > 0 else 0.0,
+        "requests_per_second": len(succeeded) / wall_seconds if wall_seconds > 0 else 0.0,
+        "ttft_seconds": percentiles([response["ttft"] for response in succeeded if response["ttft"] is not None]),
+        "inter_token_seconds": percentiles([gap for response in succeeded for gap in response["inter_token"]]),
+        "latency_seconds": percentiles([response["latency"] for response in succeeded]),
+        "pool": pool_status,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--backend", choices=("fake", "model"), default="fake")
+    parser.add_argument("--model", default="meta-llama/Llama-3.2-1B-Instruct", help="model path for --backend model")
+    parser.add_argument("--devices", default=None, help='comma-separated devices; "cpu" if unset')
+    parser.add_argument("--instances", type=int, default=2)
+    parser.add_argument("--scheduling", choices=("exclusive", "continuous"), default="exclusive")
+    parser.add_argument("--max-batch-size", type=int, default=8)
+    parser.add_argument("--pool-kwargs", default="{}", help="JSON of further ParallelModelPool arguments")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=64)
+    parser.add_argument("--warmup", type=int, default=2)
+    parser.add_argument("--prompt-length", default="uniform:8:64", help="words per query, see parse_distribution")
+    parser.add_argument("--output-length", default="uniform:16:64", help="max_new_tokens per request")
+    parser.add_argument("--temperature", type=float, default=0.0)
+    parser.add_argument("--token-delay", type=float, default=0.01, help="fake backend: seconds per decoding step")
+    parser.add_argument("--prefill-delay", type=float, default=0.0, help="fake backend: seconds per prompt token")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=None, help="also write the JSON report to this file")
+    args = parser.parse_args()
+    for spec in (args.prompt_length, args.output_length):
+        parse_distribution(spec)
+
+    report = json.dumps(asyncio.run(run(args)), indent=2)
+    print(report)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as output_file:
+            output_file.write(report + "\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,42 @@
+# tests/conftest.py
+import os
+import sys
+
+import pytest
+import torch
+
+# The app is run from the repository root rather than installed
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.fake_backend import FakeBackendPool, build_tokenizer  # noqa: E402
+
+
+@pytest.fixture(scope="session")
+def tokenizer():
+    """
+    Byte-level tokenizer with one token per byte, so multi-byte characters
+    always span several tokens.
+    """
+    return build_tokenizer()
+
+
+@pytest.fixture
+def make_pool():
+    """
+    Async factory of loaded pools over the fake backend, shut down after the
+    test. Pools must be made inside the event loop that uses them.
+    """
+    pools = []
+
+    async def make(num_instances: int = 1, token_delay: float = 0.0, **kwargs) -> FakeBackendPool:
+        pool = FakeBackendPool(
+            "fake", num_instances=num_instances, devices=["cpu"], dtype=torch.float32,
+            token_delay=token_delay, **kwargs
+        )
+        await pool.load()
+        pools.append(pool)
+        return pool
+
+    yield make
+    for pool in pools:
+        pool.shutdown()
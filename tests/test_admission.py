@@ -0,0 +1,64 @@
+# tests/test_admission.py
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+from app.models.admission import AdmissionController
+
+
+def test_full_queue_is_rejected_with_retry_after():
+    async def scenario():
+        admission = AdmissionController(max_queue_depth=1, max_wait=5.0)
+        admission.add("slot")
+        assert await admission.acquire() == "slot"
+        waiter = asyncio.create_task(admission.acquire())
+        await asyncio.sleep(0)
+
+        with pytest.raises(HTTPException) as rejected:
+            await admission.acquire()
+        assert rejected.value.status_code == 429
+        assert int(rejected.value.headers["Retry-After"]) >= 1
+
+        admission.release("slot")
+        assert await waiter == "slot"
+        assert admission.metrics()["rejected"]["normal"] == 1
+
+    asyncio.run(scenario())
+
+
+def test_higher_priority_evicts_newest_lower_priority_waiter():
+    async def scenario():
+        admission = AdmissionController(max_queue_depth=1, max_wait=5.0)
+        admission.add("slot")
+        await admission.acquire()
+        low = asyncio.create_task(admission.acquire(priority="low"))
+        await asyncio.sleep(0)
+        high = asyncio.create_task(admission.acquire(priority="high"))
+        await asyncio.sleep(0)
+
+        with pytest.raises(HTTPException) as rejected:
+            await low
+        assert rejected.value.status_code == 429
+        admission.release("slot")
+        assert await high == "slot"
+
+    asyncio.run(scenario())
+
+
+def test_wait_timeout_is_rejected_with_retry_after(make_pool):
+    async def scenario():
+        pool = await make_pool(num_instances=1, token_delay=0.01, max_queue_wait=0.2)
+        # Keep the only instance busy
+        busy = pool.generate_text_stream("busy", context={}, max_new_tokens=500, temperature=0)
+        await busy.__anext__()
+        try:
+            with pytest.raises(HTTPException) as rejected:
+                async for _ in pool.generate_text_stream("waiting", context={}, max_new_tokens=5, temperature=0):
+                    pass
+            assert rejected.value.status_code == 429
+            assert "Retry-After" in rejected.value.headers
+        finally:
+            await busy.aclose()
+
+    asyncio.run(scenario())
@@ -0,0 +1,53 @@
+# tests/test_batch_runner.py
+import asyncio
+import json
+from collections import Counter
+
+from app.models.batch_runner import completed_ids, read_requests, run_file
+
+
+def write_requests(path):
+    rows = [
+        {"id": f"r{index}", "query": "hello " * (index % 3 + 1), "max_new_tokens": 6, "temperature": 0}
+        for index in range(8)
+    ]
+    rows.append({"id": "no-query", "max_new_tokens": 6})
+    lines = [json.dumps(row) for row in rows] + ["not json"]
+    path.write_text("\n".join(lines) + "\n", encoding="utf-8")
+
+
+def read_results(path):
+    return [json.loads(line) for line in path.read_text(encoding="utf-8").splitlines()]
+
+
+def test_invalid_rows_keep_their_id():
+    requests = read_requests(['{"id": "x7", "max_new_tokens": 0}', '{"query": "hi", "id": 5}', "not json"])
+    assert [request['id'] for request in requests] == ["x7", "5", "3"]
+    assert 'error' in requests[0] and 'error' not in requests[1] and 'error' in requests[2]
+
+
+def test_resume_answers_every_request_exactly_once(make_pool, tmp_path):
+    input_path, output_path = tmp_path / "requests.jsonl", tmp_path / "results.jsonl"
+    write_requests(input_path)
+
+    async def scenario():
+        pool = await make_pool(num_instances=2)
+        first = await run_file(pool, str(input_path), str(output_path), batch_size=3)
+        assert first["written"] == 10 and first["completed"] == 8 and first["failed"] == 2
+
+        # An interrupted run: a few results written, the last one cut off mid-line
+        lines = output_path.read_text(encoding="utf-8").splitlines()
+        output_path.write_text("\n".join(lines[:4]) + "\n" + lines[4][:10], encoding="utf-8")
+        assert len(completed_ids(str(output_path))) == 4
+
+        resumed = await run_file(pool, str(input_path), str(output_path), batch_size=3)
+        assert resumed["skipped"] == 4 and resumed["written"] == 6
+        # Invalid rows are answered with their error once and not retried
+        finished = await run_file(pool, str(input_path), str(output_path), batch_size=3)
+        assert finished["skipped"] == 10 and finished["written"] == 0
+
+    asyncio.run(scenario())
+    results = read_results(output_path)
+    expected_ids = [f"r{index}" for index in range(8)] + ["no-query", "10"]
+    assert Counter(result["id"] for result in results) == Counter(expected_ids)
+    assert all("response" in result for result in results if result["id"].startswith("r"))
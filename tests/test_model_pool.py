@@ -0,0 +1,53 @@
+# tests/test_model_pool.py
+import asyncio
+import json
+
+PROMPTS = ["first prompt", "a somewhat longer second prompt", "third", "the fourth prompt of the test"]
+
+
+async def generate(pool, query: str, **kwargs):
+    """
+    Runs one streamed request and returns its text and metrics.
+    """
+    chunks = [chunk async for chunk in pool.generate_text_stream(query, context={}, **kwargs)]
+    metrics = json.loads(chunks[-1][len("data: "):])["metrics"]
+    text = "".join(chunk[len("data: "):-len("\n\n")] for chunk in chunks[:-1])
+    return text, metrics
+
+
+def test_cancelled_stream_frees_its_instance(make_pool):
+    async def scenario():
+        pool = await make_pool(num_instances=1, token_delay=0.01)
+        stream = pool.generate_text_stream("a long answer", context={}, max_new_tokens=500, temperature=0)
+        await stream.__anext__()
+        await stream.aclose()
+
+        # A greedy request runs as a shared generation, which is cancelled in its
+        # own task once its last subscriber has gone
+        for _ in range(500):
+            if len(pool.admission.free) == 1:
+                break
+            await asyncio.sleep(0.01)
+        assert pool.stats['cancelled_requests'] == 1
+        assert pool.stats['cancelled_tokens_saved'] > 0
+        assert len(pool.admission.free) == 1
+        # The freed instance serves the next request right away
+        _, metrics = await asyncio.wait_for(generate(pool, "next", max_new_tokens=5, temperature=0), timeout=10)
+        assert metrics["tokens"] == 5
+
+    asyncio.run(scenario())
+
+
+def test_exclusive_and_continuous_greedy_outputs_match(make_pool):
+    async def outputs(scheduling: str):
+        pool = await make_pool(num_instances=1, scheduling=scheduling, max_batch_size=4)
+        results = await asyncio.gather(*(
+            generate(pool, prompt, max_new_tokens=8 + 4 * index, temperature=0)
+            for index, prompt in enumerate(PROMPTS)
+        ))
+        return [(text, metrics["tokens"]) for text, metrics in results]
+
+    exclusive = asyncio.run(outputs("exclusive"))
+    continuous = asyncio.run(outputs("continuous"))
+    assert [tokens for _, tokens in exclusive] == [8 + 4 * index for index in range(len(PROMPTS))]
+    assert continuous == exclusive
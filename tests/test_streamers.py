@@ -0,0 +1,27 @@
+# tests/test_streamers.py
+import pytest
+
+from app.models.streamers import IncrementalDetokenizer
+
+TEXT = "héllo 日本語のテキスト 🙂🚀 ünïcödé 한국어, done. " * 4
+
+
+@pytest.mark.parametrize("tokens_per_push", [1, 2, 3])
+@pytest.mark.parametrize("offset", range(4))
+def test_incremental_detokenizer_matches_full_decode(tokenizer, tokens_per_push, offset):
+    # Offsets shift the push boundaries against the character boundaries
+    token_ids = tokenizer.encode(TEXT, add_special_tokens=False)[offset:]
+    detokenizer = IncrementalDetokenizer(tokenizer, skip_special_tokens=True)
+    chunks = [
+        detokenizer.push(token_ids[start:start + tokens_per_push])
+        for start in range(0, len(token_ids), tokens_per_push)
+    ]
+    chunks.append(detokenizer.flush())
+    assert "".join(chunks) == tokenizer.decode(token_ids, skip_special_tokens=True)
+
+
+def test_incremental_detokenizer_never_emits_partial_characters(tokenizer):
+    token_ids = tokenizer.encode(TEXT, add_special_tokens=False)
+    detokenizer = IncrementalDetokenizer(tokenizer, skip_special_tokens=True)
+    for start in range(0, len(token_ids), 2):
+        assert "�" not in detokenizer.push(token_ids[start:start + 2])